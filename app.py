@@ -1,4 +1,4 @@
-import gradio as gr
+import argparse
 import sys
 from pathlib import Path
 
@@ -6,15 +6,29 @@ current_dir = Path(__file__).parent
 if str(current_dir) not in sys.path:
     sys.path.insert(0, str(current_dir))
 
-import sidekick
-from sidekick import Sidekick
+parser = argparse.ArgumentParser(description="Sidekick Personal Co-Worker")
+parser.add_argument("--startup-report", action="store_true",
+                    help="Print import and session setup timings instead of starting the UI")
+args, _ = parser.parse_known_args()
+if args.startup_report:
+    from startup_report import print_startup_report
+    print_startup_report()
+    sys.exit(0)
+
+import gradio as gr
+
+
+async def new_sidekick():
+    # Imported on first use, so the UI is up before the graph, models and tools load
+    from sidekick import Sidekick
+    sidekick = Sidekick()
+    await sidekick.setup()
+    return sidekick
 
 
 async def setup():
     try:
-        sidekick = Sidekick()
-        await sidekick.setup()
-        return sidekick
+        return await new_sidekick()
     except Exception as e:
         print(f"Error in setup: {e}")
         import traceback
@@ -24,8 +38,7 @@ async def setup():
 
 async def process_message(sidekick, message, success_criteria, history, answer1, answer2, answer3):
     if sidekick is None:
-        sidekick = Sidekick()
-        await sidekick.setup()
+        sidekick = await new_sidekick()
 
     clarification_answers = []
     if answer1 and answer1.strip():
@@ -35,15 +48,16 @@ async def process_message(sidekick, message, success_criteria, history, answer1,
     if answer3 and answer3.strip():
         clarification_answers.append(answer3.strip())
     
-    results = await sidekick.run_superstep(message, success_criteria, history, clarification_answers)
-    return results, sidekick, "", "", ""
+    results = history
+    async for results in sidekick.stream_superstep(message, success_criteria, history, clarification_answers):
+        yield results, sidekick, gr.update(), gr.update(), gr.update()
+    yield results, sidekick, "", "", ""
 
 
 async def get_clarification_questions(sidekick, message, success_criteria):
     """Get clarification questions for the task"""
     if sidekick is None:
-        sidekick = Sidekick()
-        await sidekick.setup()
+        sidekick = await new_sidekick()
     
     if not message or not message.strip():
         return "Please enter a task request first.", sidekick, gr.update(visible=False), gr.update(visible=False)
@@ -57,6 +71,7 @@ async def get_clarification_questions(sidekick, message, success_criteria):
         "feedback_on_work": None,
         "success_criteria_met": False,
         "user_input_needed": False,
+        "request_complexity": None,
         "clarification_questions": None,
         "clarification_answers": [],
         "clarification_complete": False,
@@ -67,13 +82,18 @@ async def get_clarification_questions(sidekick, message, success_criteria):
         "all_tasks_complete": False,
         "planning_complete": False,
         "plan_quality_score": None,
+        "plan_quality_feedback": None,
         "plan_needs_refinement": False,
         "plan_quality_check_enabled": False,
+        "plan_validation": None,
         "task_evaluation_results": {},
+        "subtask_retry_counts": {},
         "overall_evaluation_score": None,
     }
+    # Plan in the background while the questions are generated and answered
+    sidekick.speculate(message, success_criteria)
     try:
-        clarifier_result = sidekick.clarifier(state)
+        clarifier_result = await sidekick.clarifier(state)
         questions = clarifier_result.get("clarification_questions", [])
         
         if questions and len(questions) >= 3:
@@ -86,9 +106,7 @@ async def get_clarification_questions(sidekick, message, success_criteria):
 
 
 async def reset():
-    new_sidekick = Sidekick()
-    await new_sidekick.setup()
-    return "", "", None, new_sidekick, "", "", "", gr.update(visible=False), gr.update(visible=False)
+    return "", "", None, await new_sidekick(), "", "", "", gr.update(visible=False), gr.update(visible=False)
 
 
 def free_resources(sidekick):
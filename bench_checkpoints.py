@@ -0,0 +1,74 @@
+"""Benchmarks checkpoint writes per second under concurrent Sidekick sessions.
+
+Compares the previous setup, where every session opened its own connection
+to the database, with the shared CheckpointStore.
+
+Usage: python bench_checkpoints.py [--sessions 8] [--writes 50] [--payload 4000]
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+import uuid
+import aiosqlite
+from langgraph.checkpoint.base import empty_checkpoint
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+from checkpoint_store import CheckpointStore, ConnectionWrapper
+
+
+async def run_session(saver, session: int, writes: int, payload: int):
+    config = {"configurable": {"thread_id": f"bench-{session}", "checkpoint_ns": ""}}
+    for step in range(writes):
+        checkpoint = empty_checkpoint()
+        checkpoint["id"] = str(uuid.uuid4())
+        checkpoint["channel_values"] = {"worker_results": {step: "x" * payload}}
+        config = await saver.aput(config, checkpoint, {"step": step}, {})
+        await saver.aput_writes(config, [("worker_results", {step: "y" * payload})], task_id=str(uuid.uuid4()))
+    await saver.aget_tuple(config)
+
+
+async def bench_per_session_connections(db_path: str, sessions: int, writes: int, payload: int) -> float:
+    conns = [await aiosqlite.connect(db_path) for _ in range(sessions)]
+    savers = [AsyncSqliteSaver(ConnectionWrapper(conn)) for conn in conns]
+    for saver in savers:
+        await saver.setup()
+    start = time.perf_counter()
+    await asyncio.gather(*[run_session(saver, i, writes, payload) for i, saver in enumerate(savers)])
+    elapsed = time.perf_counter() - start
+    for conn in conns:
+        await conn.close()
+    return elapsed
+
+
+async def bench_checkpoint_store(db_path: str, sessions: int, writes: int, payload: int) -> float:
+    stores = [await CheckpointStore.shared(db_path) for _ in range(sessions)]
+    start = time.perf_counter()
+    await asyncio.gather(*[run_session(store.saver, i, writes, payload) for i, store in enumerate(stores)])
+    await stores[0].flush()
+    elapsed = time.perf_counter() - start
+    for store in stores:
+        await store.release()
+    return elapsed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=8)
+    parser.add_argument("--writes", type=int, default=50)
+    parser.add_argument("--payload", type=int, default=4000, help="Bytes of text per state value")
+    args = parser.parse_args()
+
+    total = args.sessions * args.writes * 2
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, bench in [
+            ("per-session connections", bench_per_session_connections),
+            ("shared checkpoint store", bench_checkpoint_store),
+        ]:
+            db_path = os.path.join(tmp, f"{name.replace(' ', '_')}.db")
+            elapsed = await bench(db_path, args.sessions, args.writes, args.payload)
+            print(f"{name:<26} {total} writes in {elapsed:.2f}s  ({total / elapsed:,.0f} writes/s)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
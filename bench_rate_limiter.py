@@ -0,0 +1,95 @@
+"""Benchmarks LLM call scheduling against a simulated rate-limited endpoint.
+
+The simulated provider accepts a fixed number of requests per second and
+answers anything above that with a 429. Compares an unbounded fan-out whose
+calls each retry on their own with the shared AdaptiveRateLimiter.
+
+Usage: python bench_rate_limiter.py [--calls 300] [--provider-rps 40] [--latency 0.2]
+"""
+import argparse
+import asyncio
+import random
+import time
+from collections import deque
+from rate_limiter import AdaptiveRateLimiter
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+
+class SimulatedProvider:
+    """Accepts provider_rps requests in any one-second window and rejects the rest"""
+    def __init__(self, provider_rps: int, latency: float):
+        self.provider_rps = provider_rps
+        self.latency = latency
+        self.accepted = deque()
+        self.rejected = 0
+
+    async def call(self):
+        now = time.monotonic()
+        while self.accepted and now - self.accepted[0] > 1.0:
+            self.accepted.popleft()
+        if len(self.accepted) >= self.provider_rps:
+            self.rejected += 1
+            await asyncio.sleep(0.01)
+            raise RateLimitError("rate limited")
+        self.accepted.append(now)
+        await asyncio.sleep(self.latency * random.uniform(0.5, 1.5))
+        return "ok"
+
+
+async def bench_unbounded(provider: SimulatedProvider, calls: int):
+    async def call_with_retries():
+        # What each client does on its own: exponential backoff without jitter
+        for attempt in range(6):
+            try:
+                return await provider.call()
+            except RateLimitError:
+                await asyncio.sleep(0.5 * 2 ** attempt)
+        return None
+
+    results = await asyncio.gather(*[call_with_retries() for _ in range(calls)])
+    return sum(result is not None for result in results), {}
+
+
+async def bench_limiter(provider: SimulatedProvider, calls: int):
+    limiter = AdaptiveRateLimiter(
+        requests_per_minute=provider.provider_rps * 60 * 0.95, tokens_per_minute=10 ** 9,
+        max_concurrency=64, target_latency=provider.latency * 10, max_retries=8, base_backoff=0.5
+    )
+    peak_queue = 0
+
+    async def sample_queue():
+        nonlocal peak_queue
+        while True:
+            peak_queue = max(peak_queue, limiter.stats()["queue_depth"])
+            await asyncio.sleep(0.05)
+
+    sampler = asyncio.create_task(sample_queue())
+    results = await asyncio.gather(*[limiter.run(provider.call, estimated_tokens=1) for _ in range(calls)],
+                                   return_exceptions=True)
+    sampler.cancel()
+    return sum(result == "ok" for result in results), {**limiter.stats(), "peak_queue_depth": peak_queue}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=300)
+    parser.add_argument("--provider-rps", type=int, default=40, help="Requests per second the provider accepts")
+    parser.add_argument("--latency", type=float, default=0.2, help="Mean seconds per successful call")
+    args = parser.parse_args()
+
+    for name, bench in [("unbounded fan-out", bench_unbounded), ("adaptive rate limiter", bench_limiter)]:
+        provider = SimulatedProvider(args.provider_rps, args.latency)
+        start = time.perf_counter()
+        succeeded, stats = await bench(provider, args.calls)
+        elapsed = time.perf_counter() - start
+        print(f"{name:<22} {succeeded}/{args.calls} ok in {elapsed:.2f}s  ({succeeded / elapsed:.1f}/s of "
+              f"{args.provider_rps}/s allowed), {provider.rejected} x 429")
+        if stats:
+            print(f"{'':<22} " + ", ".join(f"{key.replace('_', ' ')}: {value}" for key, value in stats.items()))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,121 @@
+"""Benchmarks checkpoint serializers on a realistic Sidekick checkpoint.
+
+Compares LangGraph's default JsonPlusSerializer with CompressedSerializer for
+every installed codec, both on their own and behind the BlobSerializer used by
+the CheckpointStore, over a run whose worker results and messages grow at each
+superstep.
+
+Usage: python bench_serializers.py [--subtasks 6] [--steps 12] [--result-size 6000] [--repeat 20]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import string
+import tempfile
+import time
+from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.checkpoint.base import empty_checkpoint
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+from blob_store import BlobSerializer
+from serializers import CompressedSerializer, available_codecs
+
+
+def make_text(size: int, rng: random.Random) -> str:
+    words = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 9))) for _ in range(400)]
+    text = []
+    while sum(len(word) + 1 for word in text) < size:
+        text.append(rng.choice(words))
+    return " ".join(text)
+
+
+def make_checkpoints(subtasks: int, steps: int, result_size: int):
+    """Builds one checkpoint per superstep, each carrying everything produced so far"""
+    rng = random.Random(0)
+    task_plan = [{
+        "description": f"Research part {idx} of the report",
+        "dependencies": list(range(idx)) if idx == subtasks - 1 else [],
+        "success_criteria": "Covers the topic with sources",
+        "can_parallelize": idx != subtasks - 1,
+        "fingerprint": f"{idx:064x}",
+    } for idx in range(subtasks)]
+    messages = [HumanMessage(content="Write a report on renewable energy adoption in Europe")]
+    worker_results = {}
+    checkpoints = []
+    for step in range(steps):
+        idx = step % subtasks
+        worker_results = {**worker_results, idx: make_text(result_size, rng)}
+        messages = messages + [AIMessage(content=make_text(result_size // 4, rng))]
+        checkpoint = empty_checkpoint()
+        checkpoint["channel_values"] = {
+            "messages": messages,
+            "task_plan": task_plan,
+            "worker_results": worker_results,
+            "success_criteria": "A clear, sourced report",
+        }
+        checkpoints.append(checkpoint)
+    return checkpoints
+
+
+def bench(serde, checkpoints, repeat: int):
+    """Returns total bytes written, and encode and decode time per checkpoint in milliseconds"""
+    conn = None
+    if isinstance(serde, BlobSerializer):
+        conn = sqlite3.connect(serde.db_path)
+        conn.execute("CREATE TABLE IF NOT EXISTS blobs (key TEXT PRIMARY KEY, type TEXT NOT NULL, data BLOB NOT NULL, created_at REAL NOT NULL)")
+        conn.execute("DELETE FROM blobs")
+    written = 0
+    encoded = []
+    start = time.perf_counter()
+    for checkpoint in checkpoints:
+        type_, data = serde.dumps_typed(checkpoint)
+        written += len(data)
+        if conn:
+            # New blobs are written once, alongside the checkpoint that first references them
+            blobs = serde.take_pending()
+            written += sum(len(blob) for _, _, blob in blobs)
+            conn.executemany("INSERT OR IGNORE INTO blobs VALUES (?, ?, ?, 0)", blobs)
+            conn.commit()
+            serde.mark_committed(key for key, _, _ in blobs)
+        encoded.append((type_, data))
+    encode_ms = (time.perf_counter() - start) * 1000 / len(checkpoints)
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for data in encoded:
+            serde.loads_typed(data)
+    decode_ms = (time.perf_counter() - start) * 1000 / (len(encoded) * repeat)
+    if conn:
+        conn.close()
+        serde.close()
+    return written, encode_ms, decode_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--subtasks", type=int, default=6)
+    parser.add_argument("--steps", type=int, default=12)
+    parser.add_argument("--result-size", type=int, default=6000, help="Characters per worker result")
+    parser.add_argument("--repeat", type=int, default=20, help="Decode passes over all checkpoints")
+    args = parser.parse_args()
+
+    checkpoints = make_checkpoints(args.subtasks, args.steps, args.result_size)
+    candidates = [("jsonplus (default)", lambda db_path: JsonPlusSerializer())]
+    for codec in available_codecs():
+        candidates.append((codec, lambda db_path, codec=codec: CompressedSerializer(codec=codec)))
+    candidates.append(("blobs + jsonplus", lambda db_path: BlobSerializer(db_path)))
+    for codec in available_codecs():
+        candidates.append((f"blobs + {codec}", lambda db_path, codec=codec: BlobSerializer(
+            db_path, serde=CompressedSerializer(codec=codec))))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        baseline = None
+        print(f"{'serializer':<20} {'bytes written':>14} {'ratio':>7} {'encode ms':>10} {'decode ms':>10}")
+        for name, factory in candidates:
+            written, encode_ms, decode_ms = bench(factory(os.path.join(tmp, "blobs.db")), checkpoints, args.repeat)
+            baseline = baseline or written
+            print(f"{name:<20} {written:>14,} {baseline / written:>6.1f}x {encode_ms:>10.2f} {decode_ms:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
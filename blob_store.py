@@ -0,0 +1,282 @@
+import contextvars
+import hashlib
+import sqlite3
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+
+BLOB_MARKER = "__blob__"
+
+# The (thread_id, checkpoint_ns, checkpoint_id) whose checkpoint or writes are being serialized
+_blob_owner = contextvars.ContextVar("blob_owner", default=None)
+
+
+class BlobSerializer:
+    """Checkpoint serializer that moves large state values into a content-addressed blob table.
+
+    Every item of a list or dict channel (and every other channel value) whose
+    serialized form is at least min_blob_bytes is stored once under its sha256
+    and replaced by a {"__blob__": key} reference. Unchanged worker results and
+    messages are therefore not written again at every superstep.
+    """
+    def __init__(self, db_path: str, serde=None, min_blob_bytes: int = 1024, cache_size: int = 256):
+        self.db_path = db_path
+        self.serde = serde or JsonPlusSerializer()
+        self.min_blob_bytes = min_blob_bytes
+        self.cache_size = cache_size
+        self.pending: Dict[str, Tuple[str, bytes]] = {}
+        self.pending_refs: Set[Tuple[str, str, str, str]] = set()
+        self._cache: "OrderedDict[str, Any]" = OrderedDict()
+        self._stored: "OrderedDict[str, None]" = OrderedDict()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def dumps_typed(self, obj: Any) -> Tuple[str, bytes]:
+        return self.serde.dumps_typed(self._map_channels(obj, self._to_blob))
+
+    def loads_typed(self, data: Tuple[str, bytes]) -> Any:
+        return self._map_channels(self.serde.loads_typed(data), self._from_blob)
+
+    def deferred(self) -> "DeferredBlobSerializer":
+        """Returns a view of this serializer that loads values with their blob references unresolved"""
+        return DeferredBlobSerializer(self)
+
+    async def aresolve(self, checkpoint_tuple, conn):
+        """Resolves the blob references in a checkpoint tuple loaded through deferred().
+
+        Blobs that are neither cached nor pending are fetched in one query on conn,
+        an aiosqlite connection, so loading a checkpoint never blocks the event loop.
+        """
+        keys = set()
+        self._map_channels(checkpoint_tuple.checkpoint, lambda value: self._collect_key(value, keys))
+        for _, _, value in checkpoint_tuple.pending_writes or []:
+            self._map_value(value, lambda value: self._collect_key(value, keys))
+
+        missing = [key for key in keys if key not in self._cache and key not in self.pending]
+        fetched = {}
+        # Stay below SQLite's limit on query parameters
+        for start in range(0, len(missing), 500):
+            chunk = missing[start:start + 500]
+            async with conn.execute(
+                f"SELECT key, type, data FROM blobs WHERE key IN ({', '.join('?' * len(chunk))})", chunk
+            ) as cursor:
+                for key, type_, data in await cursor.fetchall():
+                    fetched[key] = (type_, data)
+
+        resolve = lambda value: self._from_blob(value, fetched)
+        pending_writes = checkpoint_tuple.pending_writes
+        if pending_writes is not None:
+            pending_writes = [
+                (task_id, channel, self._map_value(value, resolve)) for task_id, channel, value in pending_writes
+            ]
+        return checkpoint_tuple._replace(
+            checkpoint=self._map_channels(checkpoint_tuple.checkpoint, resolve),
+            pending_writes=pending_writes,
+        )
+
+    def referenced_blobs(self, data: Tuple[str, bytes]) -> Set[str]:
+        """Returns the blob keys referenced by a serialized checkpoint or write, without loading them"""
+        keys = set()
+        self._map_channels(self.serde.loads_typed(data), lambda value: self._collect_key(value, keys))
+        return keys
+
+    @contextmanager
+    def referenced_by(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str):
+        """Records the blobs serialized inside the block as referenced by that checkpoint"""
+        token = _blob_owner.set((thread_id, checkpoint_ns, checkpoint_id))
+        try:
+            yield
+        finally:
+            _blob_owner.reset(token)
+
+    def take_pending(self) -> List[Tuple[str, str, bytes]]:
+        """Returns blobs written since the last call, for the store to insert before it commits"""
+        return [(key, type_, data) for key, (type_, data) in self.pending.items()]
+
+    def take_pending_refs(self) -> List[Tuple[str, str, str, str]]:
+        """Returns the blob references recorded since the last commit, inserted alongside the blobs"""
+        return list(self.pending_refs)
+
+    def pending_ref_keys(self) -> Set[str]:
+        return {key for _, _, _, key in self.pending_refs}
+
+    def mark_committed(self, keys: Iterable[str], refs: Iterable[Tuple[str, str, str, str]] = ()):
+        for key in keys:
+            self.pending.pop(key, None)
+            self._stored[key] = None
+            self._stored.move_to_end(key)
+        while len(self._stored) > self.cache_size * 16:
+            self._stored.popitem(last=False)
+        self.pending_refs.difference_update(refs)
+
+    def forget(self, keys: Iterable[str]):
+        """Drops deleted blobs from the written set, so they are stored again when next referenced"""
+        for key in keys:
+            self._stored.pop(key, None)
+            self._cache.pop(key, None)
+
+    def _map_channels(self, obj: Any, fn) -> Any:
+        if isinstance(obj, dict) and isinstance(obj.get("channel_values"), dict):
+            # A full checkpoint: map every channel value
+            return {**obj, "channel_values": {
+                channel: self._map_value(value, fn) for channel, value in obj["channel_values"].items()
+            }}
+        # A pending write carries a single channel value
+        return self._map_value(obj, fn)
+
+    def _map_value(self, value: Any, fn) -> Any:
+        if isinstance(value, list):
+            return [fn(item) for item in value]
+        if isinstance(value, dict) and BLOB_MARKER not in value:
+            return {key: fn(item) for key, item in value.items()}
+        return fn(value)
+
+    def _to_blob(self, value: Any) -> Any:
+        size = quick_size(value)
+        if size is not None and size < self.min_blob_bytes:
+            # Fast path: clearly small values stay inline without being serialized twice
+            return value
+        type_, data = self.serde.dumps_typed(value)
+        if len(data) < self.min_blob_bytes:
+            return value
+        key = hashlib.sha256(type_.encode("utf-8") + b"\0" + data).hexdigest()
+        if key not in self._stored:
+            self.pending[key] = (type_, data)
+        owner = _blob_owner.get()
+        if owner is not None:
+            self.pending_refs.add((*owner, key))
+        return {BLOB_MARKER: key}
+
+    def _from_blob(self, value: Any, fetched: Optional[Dict[str, Tuple[str, bytes]]] = None) -> Any:
+        if not (isinstance(value, dict) and len(value) == 1 and BLOB_MARKER in value):
+            return value
+        key = value[BLOB_MARKER]
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            cached = self._cache[key]
+            return cached if isinstance(cached, str) else self.serde.loads_typed(cached)
+
+        if fetched is not None:
+            blob = self.pending.get(key) or fetched.get(key)
+        else:
+            blob = self.pending.get(key) or self._read_blob(key)
+        if blob is None:
+            print(f"Warning: Missing checkpoint blob {key}.")
+            return None
+        loaded = self.serde.loads_typed(blob)
+        # Strings are immutable and shared as-is; anything else is re-loaded on every read
+        self._cache[key] = loaded if isinstance(loaded, str) else blob
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return loaded
+
+    def _collect_key(self, value: Any, keys: Set[str]) -> Any:
+        if isinstance(value, dict) and len(value) == 1 and BLOB_MARKER in value:
+            keys.add(value[BLOB_MARKER])
+        return value
+
+    def _read_blob(self, key: str) -> Optional[Tuple[str, bytes]]:
+        # Only for synchronous callers such as the retention CLI; the checkpoint store loads through aresolve
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        row = self._conn.execute("SELECT type, data FROM blobs WHERE key = ?", (key,)).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def close(self):
+        if self._conn:
+            self._conn.close()
+            self._conn = None
+
+
+class DeferredBlobSerializer:
+    """Serializer for the checkpoint read pool: loads values without touching the blob table.
+
+    The blob references are left in place for the saver to resolve through
+    BlobSerializer.aresolve on the reader's own async connection.
+    """
+    def __init__(self, blobs: BlobSerializer):
+        self.blobs = blobs
+
+    def dumps_typed(self, obj: Any) -> Tuple[str, bytes]:
+        return self.blobs.dumps_typed(obj)
+
+    def loads_typed(self, data: Tuple[str, bytes]) -> Any:
+        return self.blobs.serde.loads_typed(data)
+
+
+def quick_size(value: Any) -> Optional[int]:
+    """Cheaply approximates the serialized size of plain text, task_plan entries and messages"""
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    if isinstance(value, (int, float, bool)) or value is None:
+        return 8
+    if isinstance(value, dict):
+        sizes = [quick_size(item) for item in value.values()]
+        return None if None in sizes else sum(sizes) + 16 * len(sizes)
+    if isinstance(value, list):
+        sizes = [quick_size(item) for item in value]
+        return None if None in sizes else sum(sizes) + 8 * len(sizes)
+    if isinstance(getattr(value, "content", None), str) and not getattr(value, "tool_calls", None):
+        return len(value.content.encode("utf-8"))
+    return None
+
+
+async def setup_blob_table(conn):
+    await conn.execute(
+        """CREATE TABLE IF NOT EXISTS blobs (
+            key TEXT PRIMARY KEY,
+            type TEXT NOT NULL,
+            data BLOB NOT NULL,
+            created_at REAL NOT NULL
+        )"""
+    )
+
+
+async def setup_blob_refs(conn, serde: BlobSerializer):
+    """Creates the table of which checkpoint references which blob.
+
+    Retention deletes a checkpoint's references along with it, so unreferenced
+    blobs are found without loading any checkpoint. A database written before
+    the table existed is indexed once from its checkpoints and writes.
+    """
+    cursor = await conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'blob_refs'")
+    exists = await cursor.fetchone() is not None
+    await conn.execute(
+        """CREATE TABLE IF NOT EXISTS blob_refs (
+            thread_id TEXT NOT NULL,
+            checkpoint_ns TEXT NOT NULL DEFAULT '',
+            checkpoint_id TEXT NOT NULL,
+            key TEXT NOT NULL,
+            PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, key)
+        )"""
+    )
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_blob_refs_key ON blob_refs (key)")
+    if exists:
+        return
+    refs = set()
+    for query in [
+        "SELECT thread_id, checkpoint_ns, checkpoint_id, type, checkpoint FROM checkpoints",
+        "SELECT thread_id, checkpoint_ns, checkpoint_id, type, value FROM writes",
+    ]:
+        async with conn.execute(query) as cursor:
+            async for thread_id, checkpoint_ns, checkpoint_id, type_, data in cursor:
+                if type_ and data is not None:
+                    for key in serde.referenced_blobs((type_, data)):
+                        refs.add((thread_id, checkpoint_ns, checkpoint_id, key))
+    await write_blob_refs(conn, list(refs))
+
+
+async def write_blobs(conn, blobs: List[Tuple[str, str, bytes]]):
+    now = time.time()
+    await conn.executemany(
+        "INSERT OR IGNORE INTO blobs (key, type, data, created_at) VALUES (?, ?, ?, ?)",
+        [(key, type_, data, now) for key, type_, data in blobs]
+    )
+
+
+async def write_blob_refs(conn, refs: List[Tuple[str, str, str, str]]):
+    await conn.executemany(
+        "INSERT OR IGNORE INTO blob_refs (thread_id, checkpoint_ns, checkpoint_id, key) VALUES (?, ?, ?, ?)", refs
+    )
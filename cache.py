@@ -0,0 +1,192 @@
+import asyncio
+import contextvars
+import hashlib
+import json
+import re
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Type
+import aiosqlite
+from pydantic import BaseModel
+
+
+def normalize_messages(messages: List[Any]) -> List[Dict[str, str]]:
+    """Reduces messages to their role and whitespace-normalized content"""
+    normalized = []
+    for message in messages:
+        if isinstance(message, dict):
+            role = message.get("role", "")
+            content = message.get("content", "")
+        else:
+            role = getattr(message, "type", type(message).__name__)
+            content = getattr(message, "content", "")
+        if not isinstance(content, str):
+            content = json.dumps(content, sort_keys=True, default=str)
+        normalized.append({"role": role, "content": re.sub(r"\s+", " ", content).strip()})
+    return normalized
+
+
+def make_cache_key(*parts: Any) -> str:
+    """Hashes the given parts into a stable cache key"""
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+_fresh_responses = contextvars.ContextVar("fresh_responses", default=False)
+
+
+@contextmanager
+def fresh_responses(enabled: bool = True):
+    """Answers the cached calls made inside the block upstream instead of from the cache.
+
+    For passes that ask again after an answer was rejected, such as a re-plan or
+    the evaluation of a retried subtask: with an unchanged prompt the cache would
+    only replay the rejected answer. The fresh answers replace the cached ones.
+    """
+    token = _fresh_responses.set(enabled)
+    try:
+        yield
+    finally:
+        _fresh_responses.reset(token)
+
+
+class ResponseCache:
+    """SQLite-backed cache with TTL expiry, LRU eviction and single-flight lookups"""
+    def __init__(self, db_path: str, ttl_seconds: float = 7 * 24 * 3600, max_entries: int = 5000):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.conn = None
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def setup(self):
+        self.conn = await aiosqlite.connect(self.db_path)
+        await self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS response_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_accessed REAL NOT NULL
+            )"""
+        )
+        await self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_response_cache_last_accessed ON response_cache (last_accessed)"
+        )
+        await self.conn.commit()
+
+    async def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        async with self.conn.execute(
+            "SELECT value, created_at FROM response_cache WHERE key = ?", (key,)
+        ) as cursor:
+            row = await cursor.fetchone()
+        if row is None:
+            return None
+        value, created_at = row
+        if now - created_at > self.ttl_seconds:
+            await self.conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+            await self.conn.commit()
+            return None
+        await self.conn.execute("UPDATE response_cache SET last_accessed = ? WHERE key = ?", (now, key))
+        await self.conn.commit()
+        return value
+
+    async def set(self, key: str, value: str):
+        now = time.time()
+        await self.conn.execute(
+            "INSERT OR REPLACE INTO response_cache (key, value, created_at, last_accessed) VALUES (?, ?, ?, ?)",
+            (key, value, now, now)
+        )
+        # Evict expired entries, then the least recently used ones above the size limit
+        await self.conn.execute("DELETE FROM response_cache WHERE created_at < ?", (now - self.ttl_seconds,))
+        await self.conn.execute(
+            """DELETE FROM response_cache WHERE key IN (
+                SELECT key FROM response_cache ORDER BY last_accessed DESC LIMIT -1 OFFSET ?
+            )""",
+            (self.max_entries,)
+        )
+        await self.conn.commit()
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Any]],
+                             dumps: Callable[[Any], str], loads: Callable[[str], Any], refresh: bool = False) -> Any:
+        """Returns the cached value for key, computing it at most once across concurrent callers.
+
+        The lookup runs in its own task, which every caller awaits through a
+        shield, so a caller that is cancelled only stops waiting and the others
+        still get the value. If the lookup fails, its waiters get the error and
+        the next caller starts a new one. With refresh, the value is computed
+        again and replaces the cached one.
+        """
+        if refresh:
+            self.misses += 1
+            value = await compute()
+            await self.set(key, dumps(value))
+            return value
+
+        while True:
+            lookup = self._in_flight.get(key)
+            if lookup is None:
+                lookup = asyncio.ensure_future(self._lookup(key, compute, dumps, loads))
+                self._in_flight[key] = lookup
+                lookup.add_done_callback(lambda done: self._finish_lookup(key, done))
+            else:
+                self.hits += 1
+            try:
+                return await asyncio.shield(lookup)
+            except asyncio.CancelledError:
+                # Start another lookup if it was the lookup that got cancelled rather than this
+                # caller, which Task.cancelling() tells apart from Python 3.11 on
+                cancelling = getattr(asyncio.current_task(), "cancelling", None)
+                if lookup.cancelled() and cancelling and not cancelling():
+                    continue
+                raise
+
+    async def _lookup(self, key: str, compute: Callable[[], Awaitable[Any]],
+                      dumps: Callable[[Any], str], loads: Callable[[str], Any]) -> Any:
+        cached = await self.get(key)
+        if cached is not None:
+            self.hits += 1
+            return loads(cached)
+        self.misses += 1
+        value = await compute()
+        await self.set(key, dumps(value))
+        return value
+
+    def _finish_lookup(self, key: str, lookup: asyncio.Future):
+        if self._in_flight.get(key) is lookup:
+            del self._in_flight[key]
+        if not lookup.cancelled():
+            # Mark the exception as retrieved when nobody is waiting on it anymore
+            lookup.exception()
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "in_flight": len(self._in_flight)}
+
+    async def close(self):
+        if self.conn:
+            await self.conn.close()
+            self.conn = None
+
+
+class CachedStructuredLLM:
+    """Wraps a with_structured_output chain so identical requests are answered from the cache"""
+    def __init__(self, llm_with_output, cache: ResponseCache, model_name: str, schema: Type[BaseModel]):
+        self.llm_with_output = llm_with_output
+        self.cache = cache
+        self.model_name = model_name
+        self.schema = schema
+
+    async def ainvoke(self, messages: List[Any], *args, **kwargs) -> BaseModel:
+        key = make_cache_key(self.model_name, self.schema.__name__, normalize_messages(messages))
+        return await self.cache.get_or_compute(
+            key,
+            lambda: self.llm_with_output.ainvoke(messages, *args, **kwargs),
+            dumps=lambda result: result.model_dump_json(),
+            loads=self.schema.model_validate_json,
+            refresh=_fresh_responses.get(),
+        )
+
+    def invoke(self, messages: List[Any], *args, **kwargs) -> BaseModel:
+        return self.llm_with_output.invoke(messages, *args, **kwargs)
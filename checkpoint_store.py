@@ -0,0 +1,210 @@
+import asyncio
+import os
+from typing import Any, AsyncIterator, Dict, Optional
+import aiosqlite
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+from blob_store import BlobSerializer, setup_blob_refs, setup_blob_table, write_blob_refs, write_blobs
+from serializers import CompressedSerializer
+from retention import CheckpointRetention
+
+
+checkpoint_synchronous = os.getenv("CHECKPOINT_SYNCHRONOUS", "NORMAL").upper()
+checkpoint_read_pool_size = int(os.getenv("CHECKPOINT_READ_POOL_SIZE", "4"))
+checkpoint_commit_interval = float(os.getenv("CHECKPOINT_COMMIT_INTERVAL_MS", "5")) / 1000
+
+
+class ConnectionWrapper:
+    """Adds the is_alive check AsyncSqliteSaver expects, and optionally defers commits to a store"""
+    def __init__(self, conn, store: "CheckpointStore" = None):
+        self._conn = conn
+        self._store = store
+
+    def is_alive(self):
+        try:
+            return hasattr(self._conn, '_connection') and self._conn._connection is not None
+        except:
+            return False
+
+    async def commit(self):
+        if self._store:
+            self._store.schedule_commit()
+        else:
+            await self._conn.commit()
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+class PooledSqliteSaver(AsyncSqliteSaver):
+    """AsyncSqliteSaver that writes through one shared connection and reads through a pool"""
+    def __init__(self, conn, store: "CheckpointStore", **kwargs):
+        super().__init__(conn, **kwargs)
+        self.store = store
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        configurable = config["configurable"]
+        with self.serde.referenced_by(
+            str(configurable["thread_id"]), str(configurable["checkpoint_ns"]), checkpoint["id"]
+        ):
+            return await super().aput(config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        configurable = config["configurable"]
+        with self.serde.referenced_by(
+            str(configurable["thread_id"]), str(configurable["checkpoint_ns"]), str(configurable["checkpoint_id"])
+        ):
+            return await super().aput_writes(config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id):
+        await super().adelete_thread(thread_id)
+        async with self.lock:
+            await self.conn.execute("DELETE FROM blob_refs WHERE thread_id = ?", (str(thread_id),))
+            await self.conn.commit()
+
+    async def aget_tuple(self, config):
+        async with self.store.reader() as reader:
+            checkpoint_tuple = await reader.aget_tuple(config)
+            if checkpoint_tuple is None:
+                return None
+            # Readers load blob references unresolved; the blobs are fetched on the same async connection
+            return await self.serde.aresolve(checkpoint_tuple, reader.conn)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None) -> AsyncIterator[Any]:
+        async with self.store.reader() as reader:
+            async for checkpoint_tuple in reader.alist(config, filter=filter, before=before, limit=limit):
+                yield await self.serde.aresolve(checkpoint_tuple, reader.conn)
+
+
+class CheckpointStore:
+    """Process-wide SQLite checkpoint store shared by every Sidekick session.
+
+    All sessions write through a single WAL-mode connection whose commits are
+    batched, and read through a small pool of connections, so sessions no longer
+    contend for the database write lock. Large state values are kept in a
+    deduplicated blob table and checkpoints only store references to them, and
+    old checkpoints are pruned in the background by CheckpointRetention.
+    """
+    _stores: Dict[str, "CheckpointStore"] = {}
+    _stores_lock = asyncio.Lock()
+
+    def __init__(self, db_path: str, synchronous: str = checkpoint_synchronous,
+                 read_pool_size: int = checkpoint_read_pool_size, commit_interval: float = checkpoint_commit_interval):
+        self.db_path = db_path
+        self.synchronous = synchronous
+        self.read_pool_size = read_pool_size
+        self.commit_interval = commit_interval
+        self.writer = None
+        self.saver = None
+        self.serde = None
+        self.retention = CheckpointRetention(self)
+        self._readers: Optional[asyncio.Queue] = None
+        self._reader_conns = []
+        self._commit_task: Optional[asyncio.Task] = None
+        self._users = 0
+        self.commits = 0
+
+    @classmethod
+    async def shared(cls, db_path: str, **kwargs) -> "CheckpointStore":
+        """Returns the store for db_path, opening it on first use"""
+        async with cls._stores_lock:
+            store = cls._stores.get(db_path)
+            if store is None:
+                store = cls(db_path, **kwargs)
+                await store.setup()
+                cls._stores[db_path] = store
+            store._users += 1
+            return store
+
+    async def release(self):
+        """Releases one session's hold on the store, closing it when no sessions remain"""
+        async with self._stores_lock:
+            self._users -= 1
+            if self._users > 0:
+                return
+            self._stores.pop(self.db_path, None)
+        await self.close()
+
+    async def _connect(self) -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(self.db_path)
+        # Only takes effect on a new database; retention.py --vacuum converts an existing one
+        await conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        await conn.execute("PRAGMA journal_mode=WAL")
+        await conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        await conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    async def setup(self):
+        self.writer = await self._connect()
+        await setup_blob_table(self.writer)
+        await self.writer.commit()
+        self.serde = BlobSerializer(self.db_path, serde=CompressedSerializer())
+        self.saver = PooledSqliteSaver(ConnectionWrapper(self.writer, self), self, serde=self.serde)
+        await self.saver.setup()
+        await setup_blob_refs(self.writer, self.serde)
+        await self.writer.commit()
+
+        self._readers = asyncio.Queue()
+        for _ in range(self.read_pool_size):
+            conn = await self._connect()
+            self._reader_conns.append(conn)
+            reader = AsyncSqliteSaver(ConnectionWrapper(conn), serde=self.serde.deferred())
+            await reader.setup()
+            self._readers.put_nowait(reader)
+        self.retention.start()
+
+    def schedule_commit(self):
+        """Commits pending writes shortly, so writes from concurrent sessions share one commit"""
+        if self._commit_task is None or self._commit_task.done():
+            self._commit_task = asyncio.create_task(self._commit_later())
+
+    async def _commit_later(self):
+        await asyncio.sleep(self.commit_interval)
+        await self.flush()
+
+    async def flush(self):
+        """Commits any pending writes right away"""
+        async with self.saver.lock:
+            # Blobs and their references go into the same transaction as the checkpoints that use them
+            blobs = self.serde.take_pending()
+            refs = self.serde.take_pending_refs()
+            if blobs:
+                await write_blobs(self.writer, blobs)
+            if refs:
+                await write_blob_refs(self.writer, refs)
+            if self.writer.in_transaction:
+                await self.writer.commit()
+                self.commits += 1
+            self.serde.mark_committed((key for key, _, _ in blobs), refs)
+
+    def reader(self):
+        return _ReaderLease(self)
+
+    async def close(self):
+        await self.retention.stop()
+        if self._commit_task:
+            await asyncio.gather(self._commit_task, return_exceptions=True)
+        if self.writer:
+            await self.flush()
+            await self.writer.close()
+            self.writer = None
+        for conn in self._reader_conns:
+            await conn.close()
+        self._reader_conns = []
+        if self.serde:
+            self.serde.close()
+
+
+class _ReaderLease:
+    """Leases a read-only saver from the pool after flushing pending writes"""
+    def __init__(self, store: CheckpointStore):
+        self.store = store
+        self.reader = None
+
+    async def __aenter__(self) -> AsyncSqliteSaver:
+        # Reads must see every write the caller has already made
+        await self.store.flush()
+        self.reader = await self.store._readers.get()
+        return self.reader
+
+    async def __aexit__(self, *exc_info):
+        self.store._readers.put_nowait(self.reader)
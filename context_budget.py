@@ -0,0 +1,208 @@
+import os
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, ToolMessage
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+subtask_context_tokens = int(os.getenv("SUBTASK_CONTEXT_TOKENS", "12000"))
+subtask_tool_output_tokens = int(os.getenv("SUBTASK_TOOL_OUTPUT_TOKENS", "300"))
+
+# Tokens the chat format adds around every message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_encoding = None
+
+
+def _get_encoding():
+    """Returns the gpt-4o tokenizer, or None when tiktoken or its encoding file is unavailable"""
+    global _encoding
+    if _encoding is None:
+        try:
+            _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            # Not installed, or the encoding cannot be downloaded; fall back to an estimate
+            _encoding = False
+    return _encoding or None
+
+
+def count_text_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+def count_message_tokens(message: BaseMessage) -> int:
+    content = message.content if isinstance(message.content, str) else str(message.content)
+    tokens = count_text_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+    for call in getattr(message, "tool_calls", None) or []:
+        tokens += count_text_tokens(f"{call.get('name', '')}{call.get('args', '')}")
+    return tokens
+
+
+def shorten(text: str, max_tokens: int) -> str:
+    """Keeps the head and tail of text within roughly max_tokens and notes how much was dropped"""
+    total = count_text_tokens(text)
+    if total <= max_tokens:
+        return text
+    # Characters per token of this text, so the cut lands close to the budget
+    keep_chars = max(1, int(len(text) * max_tokens / total) // 2)
+    return (f"{text[:keep_chars]}\n[... {total - max_tokens} tokens of earlier output omitted to save context ...]\n"
+            f"{text[-keep_chars:]}")
+
+
+class ContextBudget:
+    """Keeps a subtask's tool-loop conversation under max_tokens.
+
+    The system and task messages and the newest turn (the last model response
+    and the tool outputs that answer it) are always kept whole. When the
+    conversation is over budget, older tool outputs are shortened to their head
+    and tail, oldest first, and if that is not enough the text of older model
+    responses is shortened too. Tool calls are kept, so every tool output still
+    pairs with the call that produced it.
+    """
+    def __init__(self, max_tokens: int = subtask_context_tokens, tool_output_tokens: int = subtask_tool_output_tokens):
+        self.max_tokens = max_tokens
+        self.tool_output_tokens = tool_output_tokens
+        self._counts: Dict[int, Tuple[BaseMessage, int]] = {}
+
+    def count(self, message: BaseMessage) -> int:
+        # Keep the message with its count so a reused id() can never return a stale value
+        cached = self._counts.get(id(message))
+        if cached is None or cached[0] is not message:
+            cached = (message, count_message_tokens(message))
+            self._counts[id(message)] = cached
+        return cached[1]
+
+    def compact(self, messages: List[BaseMessage]) -> Tuple[List[BaseMessage], Dict[str, Any]]:
+        """Returns the messages to send and the prompt token counts before and after compaction"""
+        counts = [self.count(message) for message in messages]
+        total = sum(counts)
+        stats = {"prompt_tokens": total, "tokens_before_compaction": total, "messages_shortened": 0}
+        if total <= self.max_tokens:
+            return messages, stats
+
+        newest_turn = self._newest_turn_start(messages)
+        compacted = list(messages)
+        for kind in (ToolMessage, AIMessage):
+            for idx in range(2, newest_turn):
+                if total <= self.max_tokens:
+                    break
+                message = compacted[idx]
+                if not isinstance(message, kind) or not isinstance(message.content, str):
+                    continue
+                shortened = message.model_copy(update={"content": shorten(message.content, self.tool_output_tokens)})
+                saved = counts[idx] - self.count(shortened)
+                if saved > 0:
+                    compacted[idx] = shortened
+                    counts[idx] -= saved
+                    total -= saved
+                    stats["messages_shortened"] += 1
+
+        stats["prompt_tokens"] = total
+        return compacted, stats
+
+    def _newest_turn_start(self, messages: List[BaseMessage]) -> int:
+        for idx in range(len(messages) - 1, 1, -1):
+            if isinstance(messages[idx], AIMessage):
+                return idx
+        return len(messages)
+
+
+evaluator_transcript_tokens = int(os.getenv("EVALUATOR_TRANSCRIPT_TOKENS", "4000"))
+
+
+def render_transcript_line(message: BaseMessage) -> Optional[str]:
+    if isinstance(message, HumanMessage):
+        return f"User: {message.content}"
+    if isinstance(message, AIMessage):
+        return f"Assistant: {message.content or '[Tools use]'}"
+    return None
+
+
+class RollingTranscript:
+    """Conversation transcript that is rendered incrementally and stays within max_tokens.
+
+    Each message is rendered once, when it is first seen. The user's original
+    request is pinned, the newest turns are kept whole in a sliding window, and
+    turns that slide out of it are kept as one-line excerpts in a bounded
+    summary, beyond which only a count of omitted turns remains.
+    """
+    def __init__(self, max_tokens: int = evaluator_transcript_tokens, summary_share: float = 0.25,
+                 pinned_tokens: int = 800, excerpt_tokens: int = 40):
+        self.summary_tokens_budget = int(max_tokens * summary_share)
+        self.window_tokens_budget = max_tokens - self.summary_tokens_budget - pinned_tokens
+        self.pinned_tokens = pinned_tokens
+        self.excerpt_tokens = excerpt_tokens
+        self.reset()
+
+    def reset(self):
+        self.seen = 0
+        self.last_id = None
+        self.pinned = None
+        self.window: "deque[Tuple[str, int]]" = deque()
+        self.window_tokens = 0
+        self.summary: "deque[Tuple[str, int]]" = deque()
+        self.summary_tokens = 0
+        self.omitted = 0
+        self._rendered = None
+
+    def update(self, messages: List[BaseMessage]) -> str:
+        """Renders the messages added since the last call and returns the transcript"""
+        continues = self.seen == 0 or (
+            len(messages) >= self.seen and self.last_id is not None and messages[self.seen - 1].id == self.last_id
+        )
+        if not continues:
+            # Not a continuation of what was rendered before; start over
+            self.reset()
+        for message in messages[self.seen:]:
+            line = render_transcript_line(message)
+            if line is not None:
+                if self.pinned is None and isinstance(message, HumanMessage):
+                    self.pinned = shorten(line, self.pinned_tokens)
+                else:
+                    self._push(line)
+                self._rendered = None
+        self.seen = len(messages)
+        self.last_id = messages[-1].id if messages else None
+        if self._rendered is None:
+            self._rendered = self._render()
+        return self._rendered
+
+    def _push(self, line: str):
+        # A turn longer than the whole window keeps only its head and tail
+        line = shorten(line, self.window_tokens_budget)
+        tokens = count_text_tokens(line)
+        self.window.append((line, tokens))
+        self.window_tokens += tokens
+        while self.window_tokens > self.window_tokens_budget and len(self.window) > 1:
+            old_line, old_tokens = self.window.popleft()
+            self.window_tokens -= old_tokens
+            excerpt = old_line.splitlines()[0]
+            if count_text_tokens(excerpt) > self.excerpt_tokens:
+                excerpt = excerpt[:self.excerpt_tokens * 4] + " …"
+            excerpt_tokens = count_text_tokens(excerpt)
+            self.summary.append((excerpt, excerpt_tokens))
+            self.summary_tokens += excerpt_tokens
+            while self.summary_tokens > self.summary_tokens_budget and self.summary:
+                _, dropped_tokens = self.summary.popleft()
+                self.summary_tokens -= dropped_tokens
+                self.omitted += 1
+
+    def _render(self) -> str:
+        parts = ["Conversation history:\n"]
+        if self.pinned:
+            parts.append(self.pinned)
+        if self.omitted:
+            parts.append(f"[{self.omitted} earlier turns omitted]")
+        if self.summary:
+            parts.append("Earlier turns (excerpts):\n" + "\n".join(line for line, _ in self.summary))
+        if self.summary or self.omitted:
+            parts.append("Most recent turns:")
+        parts.extend(line for line, _ in self.window)
+        return "\n".join(parts) + "\n"
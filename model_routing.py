@@ -0,0 +1,131 @@
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+default_model = os.getenv("DEFAULT_MODEL", "gpt-4o-mini")
+model_routes = os.getenv("MODEL_ROUTES", "")
+cascade_margin = float(os.getenv("CASCADE_MARGIN", "0.15"))
+
+
+def parse_model_routes(spec: str) -> Dict[str, List[str]]:
+    """Parses routes such as "planner=gpt-4o,per_task=gpt-4o-mini>gpt-4o".
+
+    Each entry maps a node to one model, or to a cascade of models separated by
+    ">" that are tried from left to right.
+    """
+    routes = {}
+    for entry in spec.split(","):
+        if not entry.strip():
+            continue
+        node, _, models = entry.partition("=")
+        cascade = [model.strip() for model in models.split(">") if model.strip()]
+        if not node.strip() or not cascade:
+            print(f"Warning: Ignoring invalid model route '{entry.strip()}'")
+            continue
+        routes[node.strip()] = cascade
+    return routes
+
+
+def near(score: Optional[float], threshold: float, margin: float) -> bool:
+    return score is not None and abs(score - threshold) <= margin
+
+
+# When a cascade node's answer is too close to its decision threshold to trust the faster model
+ESCALATION_CHECKS: Dict[str, Callable[[Any, float], bool]] = {
+    "per_task": lambda result, margin: any(
+        near(task.completion_score, 0.7, margin) for task in result.task_results
+    ),
+    "plan_quality": lambda result, margin: near(result.plan_quality_score, 0.6, margin),
+    "overall": lambda result, margin: near(result.overall_evaluation_score, 0.7, margin),
+}
+
+
+class RouteStats:
+    """Calls, escalations and latency of one node's route"""
+    def __init__(self, models: List[str]):
+        self.models = models
+        self.calls = 0
+        self.escalations = 0
+        self.failures = 0
+        self.latency = {model: [0, 0.0] for model in models}
+
+    def record(self, model: str, elapsed: float):
+        self.latency[model][0] += 1
+        self.latency[model][1] += elapsed
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "models": " > ".join(self.models),
+            "calls": self.calls,
+            "escalation_rate": round(self.escalations / self.calls, 3) if self.calls else 0.0,
+            "failures": self.failures,
+            "avg_latency_ms": {
+                model: round(total / count * 1000) for model, (count, total) in self.latency.items() if count
+            },
+        }
+
+
+class CascadingLLM:
+    """Tries a node's models in order, escalating when a call fails or its answer is not confident.
+
+    A failure covers structured parsing errors as well as errors the rate
+    limiter gave up on. Nodes without an escalation check, such as the worker
+    and digest, only escalate on failures. The last model's answer, or error, is final.
+    """
+    def __init__(self, tiers: List[Tuple[str, Any]], stats: RouteStats,
+                 should_escalate: Callable[[Any], bool] = None):
+        self.tiers = tiers
+        self.stats = stats
+        self.should_escalate = should_escalate
+
+    async def ainvoke(self, messages: List[Any], *args, **kwargs):
+        self.stats.calls += 1
+        for tier, (model, llm) in enumerate(self.tiers):
+            last = tier == len(self.tiers) - 1
+            started = time.monotonic()
+            try:
+                result = await llm.ainvoke(messages, *args, **kwargs)
+            except Exception as e:
+                self.stats.record(model, time.monotonic() - started)
+                if last:
+                    raise
+                self.stats.failures += 1
+                print(f"Warning: {model} failed ({type(e).__name__}), escalating to {self.tiers[tier + 1][0]}")
+            else:
+                self.stats.record(model, time.monotonic() - started)
+                if last or not (self.should_escalate and self.should_escalate(result)):
+                    return result
+            if tier == 0:
+                self.stats.escalations += 1
+
+    def invoke(self, messages: List[Any], *args, **kwargs):
+        return self.tiers[-1][1].invoke(messages, *args, **kwargs)
+
+
+class ModelRouter:
+    """Assigns a model, or a cascade of models, to each node and tracks how each route performs"""
+    def __init__(self, routes: Dict[str, List[str]] = None, default: str = default_model,
+                 margin: float = cascade_margin):
+        self.routes = parse_model_routes(model_routes) if routes is None else routes
+        self.default = default
+        self.margin = margin
+        self._stats: Dict[str, RouteStats] = {}
+
+    def models_for(self, node_name: str) -> List[str]:
+        return self.routes.get(node_name) or [self.default]
+
+    def route(self, node_name: str, build: Callable[[str], Any]):
+        """Returns a CascadingLLM over build(model) for each of the node's models.
+
+        A single-model route is a cascade of one, so its calls and latency are recorded too.
+        """
+        models = self.models_for(node_name)
+        stats = self._stats.setdefault(node_name, RouteStats(models))
+        check = ESCALATION_CHECKS.get(node_name)
+        should_escalate = (lambda result: check(result, self.margin)) if check else None
+        return CascadingLLM([(model, build(model)) for model in models], stats, should_escalate)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Returns per-node call counts, escalation rates and average latency per model"""
+        return {node_name: stats.summary() for node_name, stats in self._stats.items()}
@@ -62,3 +62,17 @@ class OverallEvaluation(BaseModel):
     missing_aspects: List[str] = Field(description="Aspects that are missing or incomplete", default_factory=list)
     needs_additional_tasks: bool = Field(description="True if additional tasks are needed")
 
+
+
+class PlanRevisionCheck(BaseModel):
+    needs_replan: bool = Field(
+        description="True if the clarification answers change which subtasks are needed, their scope or the final output"
+    )
+    reason: str = Field(description="Short explanation of the decision")
+
+
+class ComplexityAssessment(BaseModel):
+    is_simple: bool = Field(
+        description="True if one assistant with tools can answer the request directly, without a multi-step plan"
+    )
+    reason: str = Field(description="Short explanation of the decision")
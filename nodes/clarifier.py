@@ -1,5 +1,4 @@
 from typing import Dict, Any
-from langchain_core.messages import SystemMessage, HumanMessage
 import sys
 from pathlib import Path
 parent_dir = Path(__file__).parent.parent
@@ -7,11 +6,27 @@ if str(parent_dir) not in sys.path:
     sys.path.insert(0, str(parent_dir))
 from state import State
 from models import ClarifierOutput
+from prompts import PromptTemplate
+
+
+CLARIFIER_PROMPT = PromptTemplate("clarifier", prefix="""You are a helpful assistant that asks clarifying questions to better understand tasks.
+Given an initial task request, generate exactly 3 clarifying questions that will help refine and focus the work.
+The questions should:
+- Help understand the user's specific interests or goals
+- Clarify ambiguous aspects of the task
+- Identify the scope or depth of information needed
+- Be concise and easy to answer
+
+Output exactly 3 questions that will improve the quality and relevance of the work.""", suffix="""The user's request is: {user_message}
+
+The success criteria is: {success_criteria}
+
+Generate exactly 3 clarifying questions to better understand this task.""")
 
 
 def create_clarifier_node(clarifier_llm_with_output):
     """Creates a clarifier node function"""
-    def clarifier(state: State) -> Dict[str, Any]:
+    async def clarifier(state: State) -> Dict[str, Any]:
         """Generates exactly 3 clarifying questions"""
         existing_questions = state.get("clarification_questions")
         if existing_questions and len(existing_questions) >= 3:
@@ -25,28 +40,9 @@ def create_clarifier_node(clarifier_llm_with_output):
         user_message = state["messages"][-1].content if state["messages"] else ""
         success_criteria = state.get("success_criteria", "The answer should be clear and accurate")
         
-        system_message = """You are a helpful assistant that asks clarifying questions to better understand tasks.
-Given an initial task request, generate exactly 3 clarifying questions that will help refine and focus the work.
-The questions should:
-- Help understand the user's specific interests or goals
-- Clarify ambiguous aspects of the task
-- Identify the scope or depth of information needed
-- Be concise and easy to answer
-
-Output exactly 3 questions that will improve the quality and relevance of the work."""
-
-        user_prompt = f"""The user's request is: {user_message}
-
-The success criteria is: {success_criteria}
-
-Generate exactly 3 clarifying questions to better understand this task."""
-
-        messages = [
-            SystemMessage(content=system_message),
-            HumanMessage(content=user_prompt)
-        ]
+        messages = CLARIFIER_PROMPT.messages(user_message=user_message, success_criteria=success_criteria)
 
-        result = clarifier_llm_with_output.invoke(messages)
+        result = await clarifier_llm_with_output.ainvoke(messages)
         questions = [q.question for q in result.questions]
 
         return {
@@ -1,5 +1,6 @@
 from typing import Dict, Any, List
-from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
+from collections import OrderedDict
+from langchain_core.runnables import RunnableConfig
 import sys
 from pathlib import Path
 parent_dir = Path(__file__).parent.parent
@@ -7,59 +8,69 @@ if str(parent_dir) not in sys.path:
     sys.path.insert(0, str(parent_dir))
 from state import State
 from models import PlanQualityEvaluation, PerTaskEvaluation, OverallEvaluation
+from context_budget import RollingTranscript
+from prompts import PromptTemplate
+from routing import plan_rejected
+from cache import fresh_responses
 
 
-def create_evaluator_node(evaluator_llm_with_output):
-    """Creates an evaluator node function"""
-    def format_conversation(messages: List[Any]) -> str:
-        conversation = "Conversation history:\n\n"
-        for message in messages:
-            if isinstance(message, HumanMessage):
-                conversation += f"User: {message.content}\n"
-            elif isinstance(message, AIMessage):
-                text = message.content or "[Tools use]"
-                conversation += f"Assistant: {text}\n"
-        return conversation
-
-    def evaluator(state: State) -> State:
-        last_response = state["messages"][-1].content
-
-        system_message = """You are an evaluator that determines if a task has been completed successfully by an Assistant.
+EVALUATOR_PROMPT = PromptTemplate("evaluator", prefix="""You are an evaluator that determines if a task has been completed successfully by an Assistant.
 Assess the Assistant's last response based on the given criteria. Respond with your feedback, and with your decision on whether the success criteria has been met,
-and whether more input is needed from the user."""
+and whether more input is needed from the user.
 
-        user_message = f"""You are evaluating a conversation between the User and Assistant. You decide what action to take based on the last response from the Assistant.
+You are evaluating a conversation between the User and Assistant. You decide what action to take based on the last response from the Assistant.
+Respond with your feedback, and decide if the success criteria is met by this response.
+Also, decide if more user input is required, either because the assistant has a question, needs clarification, or seems to be stuck and unable to answer without help.
 
-The entire conversation with the assistant, with the user's original request and all replies, is:
-{format_conversation(state["messages"])}
+The Assistant has access to a tool to write files. If the Assistant says they have written a file, then you can assume they have done so.
+Overall you should give the Assistant the benefit of the doubt if they say they've done something. But you should reject if you feel that more work should go into this.""",
+suffix="""The conversation with the assistant, with the user's original request and its most recent replies, is:
+{conversation}
 
 The success criteria for this assignment is:
-{state["success_criteria"]}
+{success_criteria}
 
 And the final response from the Assistant that you are evaluating is:
 {last_response}
+{prior_feedback}""")
 
-Respond with your feedback, and decide if the success criteria is met by this response.
-Also, decide if more user input is required, either because the assistant has a question, needs clarification, or seems to be stuck and unable to answer without help.
+EVALUATOR_PRIOR_FEEDBACK = """
+Also, note that in a prior attempt from the Assistant, you provided this feedback: {feedback_on_work}
+If you're seeing the Assistant repeating the same mistakes, then consider responding that user input is required."""
 
-The Assistant has access to a tool to write files. If the Assistant says they have written a file, then you can assume they have done so.
-Overall you should give the Assistant the benefit of the doubt if they say they've done something. But you should reject if you feel that more work should go into this.
 
-"""
+def create_evaluator_node(evaluator_llm_with_output, max_threads: int = 256):
+    """Creates an evaluator node function"""
+    # One incrementally rendered transcript per thread, since the compiled graph is shared by every session
+    transcripts: "OrderedDict[str, RollingTranscript]" = OrderedDict()
+
+    def format_conversation(messages: List[Any], thread_id: str) -> str:
+        transcript = transcripts.pop(thread_id, None) or RollingTranscript()
+        transcripts[thread_id] = transcript
+        while len(transcripts) > max_threads:
+            transcripts.popitem(last=False)
+        return transcript.update(messages)
+
+    async def evaluator(state: State, config: RunnableConfig) -> State:
+        last_response = state["messages"][-1].content
+
+        prior_feedback = ""
         if state["feedback_on_work"]:
-            user_message += f"Also, note that in a prior attempt from the Assistant, you provided this feedback: {state['feedback_on_work']}\n"
-            user_message += "If you're seeing the Assistant repeating the same mistakes, then consider responding that user input is required."
+            prior_feedback = EVALUATOR_PRIOR_FEEDBACK.format(feedback_on_work=state["feedback_on_work"])
 
-        evaluator_messages = [
-            SystemMessage(content=system_message),
-            HumanMessage(content=user_message),
-        ]
+        evaluator_messages = EVALUATOR_PROMPT.messages(
+            conversation=format_conversation(state["messages"], config.get("configurable", {}).get("thread_id", "")),
+            success_criteria=state["success_criteria"],
+            last_response=last_response,
+            prior_feedback=prior_feedback
+        )
 
-        eval_result = evaluator_llm_with_output.invoke(evaluator_messages)
+        eval_result = await evaluator_llm_with_output.ainvoke(evaluator_messages)
         new_state = {
             "messages": [
                 {
                     "role": "assistant",
+                    "name": "evaluator",
                     "content": f"Evaluator Feedback on this answer: {eval_result.feedback}",
                 }
             ],
@@ -72,21 +83,13 @@ Overall you should give the Assistant the benefit of the doubt if they say they'
     return evaluator
 
 
-def create_plan_quality_evaluator_node(plan_quality_evaluator_llm_with_output):
-    """Creates a plan quality evaluator node function"""
-    def plan_quality_evaluator(state: State) -> Dict[str, Any]:
-        """Evaluates if planner divided tasks into meaningful chunks"""
-        task_plan = state.get("task_plan", [])
-        parallel_groups = state.get("parallel_groups", [])
-        user_message = state["messages"][0].content if state["messages"] else ""
-        success_criteria = state.get("success_criteria", "")
-
-        system_message = """You are an evaluator that assesses the quality of task plans.
+PLAN_QUALITY_PROMPT = PromptTemplate("plan_quality", prefix="""You are an evaluator that assesses the quality of task plans.
+The plan's structure has already been checked: it has no dependency cycles, and its parallel groups are derived
+from the dependencies. Review its content instead.
 Evaluate if tasks are meaningfully divided:
 - Are tasks appropriately granular (not too fine, not too coarse)?
 - Do tasks align with the original goal?
-- Are dependencies correctly identified?
-- Can parallel groups execute efficiently?
+- Does each task depend on every task whose results it needs?
 
 CRITICAL: If the task involves creating a SINGLE output file (PDF, document, report), check that:
 - Only ONE subtask is responsible for generating the final file
@@ -96,7 +99,57 @@ CRITICAL: If the task involves creating a SINGLE output file (PDF, document, rep
 - If multiple workers would generate files (intermediate or final), flag this as a critical issue
 - Workers should pass results through state/responses, not through file creation
 
-Provide a quality score (0-1) and feedback."""
+Provide a quality score (0-1) and feedback.""", suffix="""Original task: {user_message}
+Success criteria: {success_criteria}
+
+Task plan:
+{plan_summary}
+
+Parallel groups:
+{groups_summary}
+
+Structural check:
+{structural_issues}
+
+Evaluate the quality of this plan.""")
+
+
+def create_plan_quality_evaluator_node(plan_quality_evaluator_llm_with_output, semantic_review: bool = True):
+    """Creates a plan quality evaluator node function.
+
+    Plans the planner's validator found structurally unsound are rejected
+    without an LLM call. Sound plans get an LLM review of their content, or
+    pass directly when semantic_review is off.
+    """
+    async def plan_quality_evaluator(state: State) -> Dict[str, Any]:
+        """Evaluates if planner divided tasks into meaningful chunks"""
+        task_plan = state.get("task_plan", [])
+        parallel_groups = state.get("parallel_groups", [])
+        user_message = state["messages"][0].content if state["messages"] else ""
+        success_criteria = state.get("success_criteria", "")
+        validation = state.get("plan_validation") or {}
+        issues = validation.get("issues") or []
+
+        if not validation.get("structure_valid", True):
+            return {
+                "plan_quality_score": 0.0,
+                "plan_needs_refinement": True,
+                "plan_quality_feedback": "The plan's dependencies cannot be executed.",
+                "messages": [{
+                    "role": "assistant",
+                    "content": f"Plan Quality Evaluation:\nScore: 0.00\nFeedback: The plan's dependencies cannot be executed.\nIssues: {', '.join(issues)}"
+                }]
+            }
+        if not semantic_review:
+            return {
+                "plan_quality_score": 1.0,
+                "plan_needs_refinement": False,
+                "plan_quality_feedback": None,
+                "messages": [{
+                    "role": "assistant",
+                    "content": f"Plan Quality Evaluation:\nScore: 1.00\nFeedback: Structure is sound.\nIssues: {', '.join(issues) if issues else 'None'}"
+                }]
+            }
 
         plan_summary = "\n".join([
             f"Task {i}: {task['description']} (Dependencies: {task['dependencies']})"
@@ -108,27 +161,27 @@ Provide a quality score (0-1) and feedback."""
             for i, group in enumerate(parallel_groups)
         ])
 
-        user_prompt = f"""Original task: {user_message}
-Success criteria: {success_criteria}
-
-Task plan:
-{plan_summary}
-
-Parallel groups:
-{groups_summary}
-
-Evaluate the quality of this plan."""
+        messages = PLAN_QUALITY_PROMPT.messages(
+            user_message=user_message,
+            success_criteria=success_criteria,
+            plan_summary=plan_summary,
+            groups_summary=groups_summary,
+            structural_issues="\n".join(f"- {issue}" for issue in issues) or "No issues found"
+        )
 
-        messages = [
-            SystemMessage(content=system_message),
-            HumanMessage(content=user_prompt)
-        ]
+        # After a rejection the plan is reviewed afresh, even if the planner repeated it
+        with fresh_responses(bool(state.get("plan_quality_feedback"))):
+            result = await plan_quality_evaluator_llm_with_output.ainvoke(messages)
 
-        result = plan_quality_evaluator_llm_with_output.invoke(messages)
+        plan_quality_feedback = None
+        if plan_rejected(result.model_dump()):
+            # Kept for the planner, so the next plan addresses why this one was rejected
+            plan_quality_feedback = result.feedback + "".join(f"\n- {issue}" for issue in result.issues)
 
         return {
             "plan_quality_score": result.plan_quality_score,
             "plan_needs_refinement": result.plan_needs_refinement,
+            "plan_quality_feedback": plan_quality_feedback,
             "messages": [{
                 "role": "assistant",
                 "content": f"Plan Quality Evaluation:\nScore: {result.plan_quality_score:.2f}\nFeedback: {result.feedback}\nIssues: {', '.join(result.issues) if result.issues else 'None'}"
@@ -138,87 +191,105 @@ Evaluate the quality of this plan."""
     return plan_quality_evaluator
 
 
+PER_TASK_PROMPT = PromptTemplate("per_task", prefix="""You are an evaluator that checks if individual subtasks have been completed successfully.
+For each subtask in the plan, evaluate:
+- Whether the subtask was completed
+- If it meets its specific success criteria
+- Quality of the output
+
+Provide a quick pass/fail check for each task.""", suffix="""Evaluate the following tasks from the plan:
+
+{tasks_summary}
+
+Provide evaluation for each task.""")
+
+
+async def evaluate_subtasks(per_task_evaluator_llm_with_output, plan_tasks: List[Dict[str, Any]]) -> PerTaskEvaluation:
+    """Asks the per-task evaluator to grade the given subtasks and their results"""
+    tasks_summary = "\n\n".join([
+        f"Task {task['index']}:\nDescription: {task['description']}\nSuccess Criteria: {task['success_criteria']}\nResult: {task['result'][:500]}..."
+        for task in plan_tasks
+    ])
+
+    messages = PER_TASK_PROMPT.messages(tasks_summary=tasks_summary)
+
+    return await per_task_evaluator_llm_with_output.ainvoke(messages)
+
+
+def create_subtask_evaluator(per_task_evaluator_llm_with_output):
+    """Creates an evaluate_subtask function that grades one subtask as soon as it finishes"""
+    async def evaluate_subtask(subtask: Dict[str, Any], subtask_index: int, result: str) -> Dict[str, Any]:
+        # A retried subtask that repeats its output is graded again rather than replaying its rejection
+        with fresh_responses(bool(subtask.get("retry_feedback"))):
+            evaluation = await evaluate_subtasks(per_task_evaluator_llm_with_output, [{
+                "index": subtask_index,
+                "description": subtask.get("description", "Unknown"),
+                "success_criteria": subtask.get("success_criteria", ""),
+                "result": result
+            }])
+        task_results = [r for r in evaluation.task_results if r.subtask_index == subtask_index] or evaluation.task_results
+        if not task_results:
+            raise ValueError(f"No evaluation returned for subtask {subtask_index}")
+        task_result = task_results[0]
+        return {
+            "completion_score": task_result.completion_score,
+            "is_complete": task_result.is_complete,
+            "feedback": task_result.feedback
+        }
+
+    return evaluate_subtask
+
+
 def create_per_task_evaluator_node(per_task_evaluator_llm_with_output):
     """Creates a per-task evaluator node function"""
-    def per_task_evaluator(state: State) -> Dict[str, Any]:
-        """Evaluates if each task/group has been completed within success criteria"""
+    async def per_task_evaluator(state: State) -> Dict[str, Any]:
+        """Evaluates if each subtask in the plan has been completed within success criteria"""
         task_plan = state.get("task_plan")
-        parallel_groups = state.get("parallel_groups")
-        current_parallel_group = state.get("current_parallel_group", 0)
         
-        if not task_plan or not parallel_groups:
+        if not task_plan:
             return {
                 "messages": [{
                     "role": "assistant",
-                    "content": "Error: Missing task plan or parallel groups for evaluation."
+                    "content": "Error: Missing task plan for evaluation."
                 }]
             }
         
-        if current_parallel_group >= len(parallel_groups):
-            return {
-                "all_tasks_complete": True,
-                "messages": [{
-                    "role": "assistant",
-                    "content": "All parallel groups have been processed."
-                }]
-            }
-        
-        current_group = parallel_groups[current_parallel_group]
         worker_results = state.get("worker_results", {})
         task_evaluation_results = state.get("task_evaluation_results", {}).copy()
 
-        # Get subtasks and results for current group (with validation)
-        group_tasks = []
-        for idx in current_group:
-            if isinstance(idx, int) and 0 <= idx < len(task_plan):
-                try:
-                    subtask = task_plan[idx]
-                    result = worker_results.get(idx, "")
-                    group_tasks.append({
-                        "index": idx,
-                        "description": subtask.get("description", "Unknown"),
-                        "success_criteria": subtask.get("success_criteria", ""),
-                        "result": result
-                    })
-                except (IndexError, KeyError, TypeError) as e:
-                    print(f"Error accessing task_plan[{idx}]: {e}. Skipping.")
-                    continue
-            else:
-                print(f"Warning: Invalid index {idx} in parallel group {current_parallel_group}. Skipping.")
+        # Get subtasks and results that have not been evaluated yet (carried-forward tasks keep theirs)
+        plan_tasks = []
+        for idx, subtask in enumerate(task_plan):
+            if idx in task_evaluation_results:
+                continue
+            try:
+                result = worker_results.get(idx, "")
+                plan_tasks.append({
+                    "index": idx,
+                    "description": subtask.get("description", "Unknown"),
+                    "success_criteria": subtask.get("success_criteria", ""),
+                    "result": result
+                })
+            except (KeyError, TypeError, AttributeError) as e:
+                print(f"Error accessing task_plan[{idx}]: {e}. Skipping.")
+                continue
         
-        if not group_tasks:
+        if not plan_tasks:
+            all_passed = all(
+                task_evaluation_results.get(idx, {}).get("is_complete", False)
+                for idx in range(len(task_plan))
+            )
             return {
+                "all_tasks_complete": all_passed,
                 "messages": [{
                     "role": "assistant",
-                    "content": f"Error: No valid tasks found in parallel group {current_parallel_group} for evaluation."
+                    "content": f"Per-Task Evaluation:\nAll subtasks already evaluated\n{'All tasks passed!' if all_passed else 'Some tasks need refinement.'}"
                 }]
             }
 
-        system_message = """You are an evaluator that checks if individual subtasks have been completed successfully.
-For each subtask in the current group, evaluate:
-- Whether the subtask was completed
-- If it meets its specific success criteria
-- Quality of the output
-
-Provide a quick pass/fail check for each task."""
-
-        tasks_summary = "\n\n".join([
-            f"Task {task['index']}:\nDescription: {task['description']}\nSuccess Criteria: {task['success_criteria']}\nResult: {task['result'][:500]}..."
-            for task in group_tasks
-        ])
-
-        user_prompt = f"""Evaluate the following tasks from the current parallel group:
-
-{tasks_summary}
-
-Provide evaluation for each task."""
-
-        messages = [
-            SystemMessage(content=system_message),
-            HumanMessage(content=user_prompt)
-        ]
-
-        result = per_task_evaluator_llm_with_output.invoke(messages)
+        retried = any(task_plan[task["index"]].get("retry_feedback") for task in plan_tasks)
+        with fresh_responses(retried):
+            result = await evaluate_subtasks(per_task_evaluator_llm_with_output, plan_tasks)
 
         for task_result in result.task_results:
             task_evaluation_results[task_result.subtask_index] = {
@@ -227,11 +298,9 @@ Provide evaluation for each task."""
                 "feedback": task_result.feedback
             }
 
-        all_tasks_complete = state["current_parallel_group"] >= len(state["parallel_groups"]) - 1
-
         return {
             "task_evaluation_results": task_evaluation_results,
-            "all_tasks_complete": all_tasks_complete if result.group_passed else False,
+            "all_tasks_complete": result.group_passed,
             "messages": [{
                 "role": "assistant",
                 "content": f"Per-Task Evaluation:\nGroup Passed: {result.group_passed}\nNeeds Refinement: {result.needs_refinement}\n{'All tasks passed!' if result.group_passed else 'Some tasks need refinement.'}"
@@ -241,9 +310,24 @@ Provide evaluation for each task."""
     return per_task_evaluator
 
 
+OVERALL_PROMPT = PromptTemplate("overall", prefix="""You are an evaluator that assesses overall task completion.
+Evaluate whether all subtasks collectively achieve the overall goal.
+Consider:
+- Whether all subtasks together meet the original success criteria
+- Quality and coherence of the final output
+- Alignment with the original user request
+- Integration of all subtask results""", suffix="""Original task: {original_message}
+Success criteria: {success_criteria}
+
+All subtask results:
+{results_summary}
+
+Evaluate if the overall task has been completed successfully.""")
+
+
 def create_overall_evaluator_node(overall_evaluator_llm_with_output):
     """Creates an overall evaluator node function"""
-    def overall_evaluator(state: State) -> Dict[str, Any]:
+    async def overall_evaluator(state: State) -> Dict[str, Any]:
         """Evaluates overall task completion against original success criteria"""
         task_plan = state.get("task_plan", [])
         worker_results = state.get("worker_results", {})
@@ -261,33 +345,20 @@ def create_overall_evaluator_node(overall_evaluator_llm_with_output):
                 "evaluation": eval_result
             })
 
-        system_message = """You are an evaluator that assesses overall task completion.
-Evaluate whether all subtasks collectively achieve the overall goal.
-Consider:
-- Whether all subtasks together meet the original success criteria
-- Quality and coherence of the final output
-- Alignment with the original user request
-- Integration of all subtask results"""
-
         results_summary = "\n\n".join([
             f"Task {i}: {r['task']}\nResult: {r['result'][:300]}...\nEvaluation: {r['evaluation'].get('feedback', 'N/A')}"
             for i, r in enumerate(all_results)
         ])
 
-        user_prompt = f"""Original task: {original_message}
-Success criteria: {success_criteria}
-
-All subtask results:
-{results_summary}
-
-Evaluate if the overall task has been completed successfully."""
-
-        messages = [
-            SystemMessage(content=system_message),
-            HumanMessage(content=user_prompt)
-        ]
+        messages = OVERALL_PROMPT.messages(
+            original_message=original_message,
+            success_criteria=success_criteria,
+            results_summary=results_summary
+        )
 
-        result = overall_evaluator_llm_with_output.invoke(messages)
+        # Evaluations after a re-plan are made afresh
+        with fresh_responses(state.get("overall_evaluation_score") is not None):
+            result = await overall_evaluator_llm_with_output.ainvoke(messages)
 
         return {
             "overall_evaluation_score": result.overall_evaluation_score,
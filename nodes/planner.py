@@ -1,59 +1,97 @@
-from typing import Dict, Any
-from langchain_core.messages import SystemMessage, HumanMessage
+from typing import Dict, Any, List, Tuple
+import hashlib
+import json
 import sys
 from pathlib import Path
 parent_dir = Path(__file__).parent.parent
 if str(parent_dir) not in sys.path:
     sys.path.insert(0, str(parent_dir))
 from state import State
-from models import PlannerOutput
+from models import PlannerOutput, PlanRevisionCheck
+from prompts import PromptTemplate
+from plan_validator import execution_levels, normalize_dependencies, validate_plan
+from routing import plan_rejected
+from cache import fresh_responses
 
 
-def create_planner_node(planner_llm_with_output, move_to_next_group_func):
-    """Creates a planner node function"""
-    def planner(state: State) -> Dict[str, Any]:
-        """Breaks refined task into subtasks and identifies parallel execution groups"""
-        overall_score = state.get("overall_evaluation_score")
-        needs_new_plan = (
-            state.get("plan_needs_refinement", False) or 
-            (overall_score is not None and overall_score < 0.7)
+def fingerprint_subtasks(task_plan: List[Dict[str, Any]]) -> List[str]:
+    """Fingerprints each subtask by its description, criteria and the fingerprints of its dependencies"""
+    fingerprints: Dict[int, str] = {}
+
+    def fingerprint(idx: int, visiting: set) -> str:
+        if idx in fingerprints:
+            return fingerprints[idx]
+        visiting = visiting | {idx}
+        subtask = task_plan[idx]
+        upstream = sorted(
+            fingerprint(dep_idx, visiting)
+            for dep_idx in subtask.get("dependencies", []) or []
+            if isinstance(dep_idx, int) and 0 <= dep_idx < len(task_plan) and dep_idx not in visiting
         )
-        
-        if not needs_new_plan and state.get("planning_complete", False) and state.get("task_plan") is not None:
-            parallel_groups = state.get("parallel_groups", [])
-            current_parallel_group = state.get("current_parallel_group", 0)
-            
-            if current_parallel_group < len(parallel_groups) - 1:
-                next_state = move_to_next_group_func(state)
-                if next_state:
-                    return {
-                        **next_state,
-                        "plan_quality_check_enabled": False,
-                        "messages": [{
-                            "role": "assistant",
-                            "content": f"Moving to parallel group {next_state['current_parallel_group']}"
-                        }]
-                    }
-        
-        user_message = state["messages"][0].content if state["messages"] else ""
-        success_criteria = state.get("success_criteria", "The answer should be clear and accurate")
-        answers = state.get("clarification_answers", [])
-        
-        refined_query = user_message
-        if answers:
-            answers_text = "\n".join([f"- {answer}" for answer in answers if answer and answer.strip()])
-            refined_query += f"\n\nAdditional context from clarification:\n{answers_text}"
-        
-        evaluation_feedback = ""
-        if state.get("feedback_on_work"):
-            evaluation_feedback = f"\n\nIMPORTANT: Previous attempt feedback: {state['feedback_on_work']}"
-        if state.get("overall_evaluation_score") is not None:
-            score = state['overall_evaluation_score']
-            evaluation_feedback += f"\nPrevious evaluation score: {score:.2f}/1.0"
-            if score < 0.7:
-                evaluation_feedback += "\nThe previous plan did not meet the success criteria. Create a better plan that addresses the feedback."
+        payload = json.dumps([subtask.get("description", ""), subtask.get("success_criteria", ""), upstream])
+        fingerprints[idx] = hashlib.sha256(payload.encode("utf-8")).hexdigest()
+        return fingerprints[idx]
+
+    return [fingerprint(idx, set()) for idx in range(len(task_plan))]
+
+
+def result_fingerprint(fingerprint: str, dependency_results: List[Any]) -> str:
+    """Fingerprints a subtask's result by the subtask and the results of the dependencies it was built from"""
+    upstream = sorted(hashlib.sha256(str(result).encode("utf-8")).hexdigest() for result in dependency_results)
+    payload = json.dumps([fingerprint, upstream])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def carry_forward_results(state: State, task_plan: List[Dict[str, Any]]) -> Tuple[Dict[int, Any], Dict[int, Dict[str, Any]]]:
+    """Maps results and evaluations of unchanged, passing subtasks from the previous plan onto the new one.
+
+    A subtask is only reused when every dependency is reused too, and with the
+    same results it was built from, so a rejected or re-run upstream result
+    makes its dependents run again.
+    """
+    previous_plan = state.get("task_plan") or []
+    previous_results = state.get("worker_results") or {}
+    previous_evaluations = state.get("task_evaluation_results") or {}
+
+    reusable = {}
+    previous_dependencies, _ = normalize_dependencies(previous_plan)
+    for idx, subtask in enumerate(previous_plan):
+        evaluation = previous_evaluations.get(idx, {})
+        if not (subtask.get("fingerprint") and idx in previous_results and evaluation.get("is_complete", False)):
+            continue
+        if any(dep_idx not in previous_results for dep_idx in previous_dependencies[idx]):
+            continue
+        key = result_fingerprint(
+            subtask["fingerprint"], [previous_results[dep_idx] for dep_idx in previous_dependencies[idx]]
+        )
+        reusable[key] = (previous_results[idx], evaluation)
+
+    worker_results = {}
+    task_evaluation_results = {}
+    dependencies, _ = normalize_dependencies(task_plan)
+    levels, _ = execution_levels(dependencies)
+    for level in levels:
+        for idx in level:
+            if any(dep_idx not in worker_results for dep_idx in dependencies[idx]):
+                continue
+            key = result_fingerprint(
+                task_plan[idx]["fingerprint"], [worker_results[dep_idx] for dep_idx in dependencies[idx]]
+            )
+            if key in reusable:
+                worker_results[idx], task_evaluation_results[idx] = reusable[key]
 
-        system_message = """You are a planning assistant that breaks down complex tasks into manageable subtasks.
+    if task_plan and len(worker_results) == len(task_plan):
+        # Nothing changed, so re-run the final subtasks to let the refinement make progress
+        dependents = {dep_idx for subtask in task_plan for dep_idx in subtask.get("dependencies", []) or []}
+        for idx in range(len(task_plan)):
+            if idx not in dependents:
+                worker_results.pop(idx, None)
+                task_evaluation_results.pop(idx, None)
+
+    return worker_results, task_evaluation_results
+
+
+PLANNER_PROMPT = PromptTemplate("planner", prefix="""You are a planning assistant that breaks down complex tasks into manageable subtasks.
 Analyze the task and create a list of subtasks that can be executed to complete the overall goal.
 
 IMPORTANT: If the task requires creating a SINGLE output file (like a PDF, document, or report), 
@@ -85,13 +123,85 @@ For each subtask, identify:
 
 Then, group subtasks into parallel execution groups where tasks in the same group can run concurrently.
 Tasks in different groups must run sequentially (later groups depend on earlier ones).
+Each subtask starts as soon as all of its dependencies have finished, so list every dependency explicitly.
 
 If creating a single output file, ensure subtasks are organized as:
 - Research/gathering tasks (can be parallel) - return results as text
 - Analysis/synthesis tasks (may depend on research) - return results as text
 - Writing/compilation tasks (depends on analysis) - return content as text/markdown
 - Final output generation (single task that creates the file)
-- Push notification task (if requested, depends on all previous tasks)"""
+- Push notification task (if requested, depends on all previous tasks)
+
+CRITICAL: The clarification answers in the task contain specific user requirements (e.g., page count, format preferences, content depth, etc.). 
+You MUST incorporate these requirements into your subtask descriptions and success criteria. For example:
+- If the user specified "10 pages" in a clarification answer, ensure subtasks explicitly mention this requirement
+- If the user specified format preferences, include those in relevant subtask descriptions
+- Make sure each subtask's success criteria reflects the clarification requirements
+
+IMPORTANT: When creating parallel_groups, use 0-based indices that correspond to the subtasks list.
+For example, if you create 3 subtasks, valid indices are 0, 1, 2.
+Each group should contain a list of indices (e.g., [0, 1] means subtasks at index 0 and 1 run in parallel).
+Make absolutely sure all indices in parallel_groups are valid (0 to len(subtasks)-1).
+
+CRITICAL: If this task involves creating a single output file (PDF, document, report), 
+ensure that:
+1. Research/gathering subtasks can run in parallel - they should return results as text, NOT create files
+2. Only ONE final subtask actually generates the output file
+3. Other subtasks prepare content/sections that feed into the final output - return as text/markdown
+4. Do NOT create multiple versions of the same output
+5. Do NOT create intermediate files (.txt, .md) - all results should be returned as text in responses
+6. Workers will pass results through state, not through files
+7. Ensure all subtasks contribute meaningful content that addresses the task requirements""", suffix="""Task: {refined_query}
+
+Success Criteria: {success_criteria}{evaluation_feedback}{notification_instruction}
+
+Break this down into subtasks and organize them into parallel execution groups.
+Consider which tasks are independent and can run concurrently.""")
+
+
+def create_planner_node(planner_llm_with_output):
+    """Creates a planner node function"""
+    async def planner(state: State) -> Dict[str, Any]:
+        """Breaks refined task into subtasks and identifies parallel execution groups"""
+        user_message = state["messages"][0].content if state["messages"] else ""
+        success_criteria = state.get("success_criteria", "The answer should be clear and accurate")
+        answers = state.get("clarification_answers", [])
+        
+        refined_query = user_message
+        if answers:
+            answers_text = "\n".join([f"- {answer}" for answer in answers if answer and answer.strip()])
+            refined_query += f"\n\nAdditional context from clarification:\n{answers_text}"
+        
+        evaluation_feedback = ""
+        if state.get("feedback_on_work"):
+            evaluation_feedback = f"\n\nIMPORTANT: Previous attempt feedback: {state['feedback_on_work']}"
+        if state.get("overall_evaluation_score") is not None:
+            score = state['overall_evaluation_score']
+            evaluation_feedback += f"\nPrevious evaluation score: {score:.2f}/1.0"
+            if score < 0.7:
+                evaluation_feedback += "\nThe previous plan did not meet the success criteria. Create a better plan that addresses the feedback."
+        
+        previous_plan = state.get("task_plan") or []
+        failed_subtasks = [
+            f"- {subtask['description']}: {state['task_evaluation_results'][idx].get('feedback', '')}"
+            for idx, subtask in enumerate(previous_plan)
+            if idx in (state.get("task_evaluation_results") or {})
+            and not state["task_evaluation_results"][idx].get("is_complete", False)
+        ]
+        if failed_subtasks:
+            evaluation_feedback += "\n\nThese subtasks of the previous plan kept failing after retries:\n" + "\n".join(failed_subtasks)
+
+        previous_validation = state.get("plan_validation") or {}
+        if previous_plan and plan_rejected(state):
+            if not previous_validation.get("structure_valid", True):
+                evaluation_feedback += "\n\nThe previous plan was rejected for these structural problems:\n" + "\n".join(
+                    f"- {issue}" for issue in previous_validation["issues"]
+                )
+            elif state.get("plan_quality_feedback"):
+                evaluation_feedback += (
+                    "\n\nThe previous plan was rejected in review. Create a plan that addresses this feedback:\n"
+                    + state["plan_quality_feedback"]
+                )
 
         # Check if user requested push notification
         user_query_lower = refined_query.lower()
@@ -119,40 +229,16 @@ IMPORTANT: The user has explicitly requested a push notification. You MUST inclu
 - Has success criteria like "Push notification successfully sent to user with task completion summary"
 - Should be in its own final parallel group (since it depends on everything else)"""
 
-        user_prompt = f"""Task: {refined_query}
-
-Success Criteria: {success_criteria}{evaluation_feedback}{notification_instruction}
-
-CRITICAL: The clarification answers above contain specific user requirements (e.g., page count, format preferences, content depth, etc.). 
-You MUST incorporate these requirements into your subtask descriptions and success criteria. For example:
-- If the user specified "10 pages" in a clarification answer, ensure subtasks explicitly mention this requirement
-- If the user specified format preferences, include those in relevant subtask descriptions
-- Make sure each subtask's success criteria reflects the clarification requirements
-
-Break this down into subtasks and organize them into parallel execution groups.
-Consider which tasks are independent and can run concurrently.
-
-IMPORTANT: When creating parallel_groups, use 0-based indices that correspond to the subtasks list.
-For example, if you create 3 subtasks, valid indices are 0, 1, 2.
-Each group should contain a list of indices (e.g., [0, 1] means subtasks at index 0 and 1 run in parallel).
-Make absolutely sure all indices in parallel_groups are valid (0 to len(subtasks)-1).
-
-CRITICAL: If this task involves creating a single output file (PDF, document, report), 
-ensure that:
-1. Research/gathering subtasks can run in parallel - they should return results as text, NOT create files
-2. Only ONE final subtask actually generates the output file
-3. Other subtasks prepare content/sections that feed into the final output - return as text/markdown
-4. Do NOT create multiple versions of the same output
-5. Do NOT create intermediate files (.txt, .md) - all results should be returned as text in responses
-6. Workers will pass results through state, not through files
-7. Ensure all subtasks contribute meaningful content that addresses the task requirements"""
-
-        messages = [
-            SystemMessage(content=system_message),
-            HumanMessage(content=user_prompt)
-        ]
+        messages = PLANNER_PROMPT.messages(
+            refined_query=refined_query,
+            success_criteria=success_criteria,
+            evaluation_feedback=evaluation_feedback,
+            notification_instruction=notification_instruction
+        )
 
-        result = planner_llm_with_output.invoke(messages)
+        # A re-plan must not replay the cached plan that led here
+        with fresh_responses(bool(previous_plan)):
+            result = await planner_llm_with_output.ainvoke(messages)
         
         task_plan = []
         for subtask in result.subtasks:
@@ -163,37 +249,48 @@ ensure that:
                 "can_parallelize": subtask.can_parallelize
             })
 
-        num_subtasks = len(task_plan)
-        validated_groups = []
-        for group in result.parallel_groups:
-            validated_group = []
-            for idx in group:
-                if isinstance(idx, int) and 0 <= idx < num_subtasks:
-                    validated_group.append(idx)
-                else:
-                    print(f"Warning: Invalid index {idx} in parallel group. Valid range is 0-{num_subtasks-1}. Skipping.")
-            if validated_group:
-                validated_groups.append(validated_group)
-        
-        if not validated_groups and task_plan:
-            validated_groups = [[i] for i in range(len(task_plan))]
-            print("Warning: No valid parallel groups found. Creating sequential groups.")
+        dependencies, _ = normalize_dependencies(task_plan)
+        for idx, subtask in enumerate(task_plan):
+            subtask["dependencies"] = sorted(dependencies[idx])
+
+        for subtask, fingerprint in zip(task_plan, fingerprint_subtasks(task_plan)):
+            subtask["fingerprint"] = fingerprint
+        worker_results, task_evaluation_results = carry_forward_results(state, task_plan)
+
+        # Groups are derived from the dependencies; the LLM's own groups are only checked against them
+        validation = validate_plan(task_plan, result.parallel_groups)
+        for issue in validation["issues"]:
+            print(f"Warning: {issue}")
+        validated_groups = validation["levels"]
+        placed = {idx for level in validated_groups for idx in level}
+        if len(placed) < len(task_plan):
+            # Subtasks on a cycle run last, where the scheduler breaks the cycle
+            validated_groups = validated_groups + [[idx for idx in range(len(task_plan)) if idx not in placed]]
 
         feedback_context = ""
         if state.get("feedback_on_work"):
             feedback_context = f"\n\nPrevious attempt feedback: {state['feedback_on_work']}"
         if state.get("overall_evaluation_score") is not None:
             feedback_context += f"\nPrevious evaluation score: {state['overall_evaluation_score']:.2f}"
+        if worker_results:
+            feedback_context += f"\nReusing results from {len(worker_results)} unchanged subtasks."
         
         return {
             "task_plan": task_plan,
             "parallel_groups": validated_groups,
             "current_parallel_group": 0,
             "planning_complete": True,
-            "worker_results": {},
+            "plan_quality_score": None,
+            "plan_validation": {
+                "issues": validation["issues"],
+                "cycles": validation["cycles"],
+                "structure_valid": validation["structure_valid"]
+            },
+            "worker_results": worker_results,
             "all_tasks_complete": False,
             "plan_needs_refinement": False,
-            "task_evaluation_results": {},
+            "task_evaluation_results": task_evaluation_results,
+            "subtask_retry_counts": {},
             "messages": [{
                 "role": "assistant",
                 "content": f"I've created a plan with {len(task_plan)} subtasks organized into {len(validated_groups)} execution groups.{feedback_context}\n\nReasoning: {result.reasoning}"
@@ -202,3 +299,39 @@ ensure that:
     
     return planner
 
+
+
+PLAN_REVISION_PROMPT = PromptTemplate("plan_revision", prefix="""You review a plan that was drafted before the user answered clarifying questions.
+Decide whether the answers require a new plan.
+
+A new plan is needed when the answers add or remove work, change the scope or depth of a subtask, change the
+format or number of final outputs, or contradict an assumption the plan makes.
+No new plan is needed when the answers only refine details that workers can apply while executing the subtasks.
+Every worker is given the clarification answers in its instructions.""", suffix="""Task: {user_message}
+
+Plan drafted before the answers:
+{plan_summary}
+
+Clarification answers:
+{answers}
+
+Does this plan need to be redone?""")
+
+
+def create_plan_revision_check(plan_revision_llm_with_output):
+    """Creates a function that decides whether clarification answers invalidate a speculative plan"""
+    async def check_plan_revision(user_message: str, task_plan: List[Dict[str, Any]], clarification_answers: List[str]) -> bool:
+        """Returns True if the plan should be made again with the answers"""
+        plan_summary = "\n".join(
+            f"Task {i}: {task['description']} (Dependencies: {task['dependencies']})"
+            for i, task in enumerate(task_plan)
+        )
+        messages = PLAN_REVISION_PROMPT.messages(
+            user_message=user_message,
+            plan_summary=plan_summary,
+            answers="\n".join(f"- {answer}" for answer in clarification_answers)
+        )
+        result: PlanRevisionCheck = await plan_revision_llm_with_output.ainvoke(messages)
+        return result.needs_replan
+
+    return check_plan_revision
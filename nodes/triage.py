@@ -0,0 +1,92 @@
+from typing import Dict, Any, Optional, Tuple
+import re
+import sys
+from pathlib import Path
+parent_dir = Path(__file__).parent.parent
+if str(parent_dir) not in sys.path:
+    sys.path.insert(0, str(parent_dir))
+from state import State
+from models import ComplexityAssessment
+from prompts import PromptTemplate
+from nodes.workers import progress_writer
+
+
+# Signs that a request needs several steps or produces an artifact
+MULTI_STEP_PATTERNS = [
+    r"\b(pdf|report|document|essay|article|presentation|spreadsheet|slides?)\b",
+    r"\b(research|investigate|compare|comparison|analy[sz]e|analysis|evaluate|plan|itinerary|outline)\b",
+    r"\b(notify|notification|push)\b",
+    r"\b(and then|after that|afterwards|step by step|followed by|finally)\b",
+    r"\b(write|create|build|generate|draft|compile)\b.*\b(and|then)\b",
+    r"\b(each|every|all of|several|multiple|list of)\b",
+]
+LIST_ITEM = re.compile(r"^\s*(\d+[.)]|[-*•])\s+", re.MULTILINE)
+QUESTION_START = re.compile(
+    r"^\s*(what|who|whom|whose|when|where|which|why|how|is|are|was|were|do|does|did|can|could|should|"
+    r"define|convert|translate|calculate|explain|tell me|give me)\b",
+    re.IGNORECASE
+)
+MULTI_STEP = [re.compile(pattern, re.IGNORECASE | re.MULTILINE) for pattern in MULTI_STEP_PATTERNS]
+
+COMPLEXITY_PROMPT = PromptTemplate("complexity", prefix="""You triage requests to an assistant that can browse the web, search, run python and write files.
+Decide whether one assistant can answer the request directly in a short tool-using conversation,
+or whether it needs a plan of several subtasks, such as research across sources followed by writing,
+producing a document or other file, or steps that depend on each other.""", suffix="""Request: {message}
+
+Success criteria: {success_criteria}
+
+Is this a simple request?""")
+
+
+def classify_complexity(message: str, max_simple_words: int = 40) -> Tuple[Optional[bool], str]:
+    """Classifies a request with local heuristics.
+
+    Returns True for simple, False for multi-step, or None when the heuristics
+    cannot tell, along with the reason.
+    """
+    words = len(message.split())
+    signals = [pattern.pattern for pattern in MULTI_STEP if pattern.search(message)]
+    if len(LIST_ITEM.findall(message)) >= 2:
+        return False, "a list of steps"
+    sentences = len([part for part in re.split(r"[.!?\n]+", message) if part.strip()])
+
+    if words > 3 * max_simple_words or len(signals) >= 2:
+        return False, f"{words} words, {len(signals)} multi-step signals"
+    if not signals and words <= max_simple_words and sentences <= 2:
+        return True, f"{words} words, no multi-step signals"
+    if not signals and QUESTION_START.match(message) and sentences <= 3:
+        return True, "a direct question"
+    return None, f"{words} words, {len(signals)} multi-step signals"
+
+
+def create_triage_node(complexity_llm_with_output=None, enabled: bool = True):
+    """Creates a triage node that sends simple requests to the worker loop instead of the planner.
+
+    Requests the heuristics cannot place are assessed by complexity_llm_with_output
+    if given, and otherwise take the planner path.
+    """
+    async def triage(state: State) -> Dict[str, Any]:
+        if not enabled or state.get("clarification_answers") or state.get("clarification_questions"):
+            # Clarified requests are meant for the planner
+            return {"request_complexity": "complex"}
+
+        message = state["messages"][-1].content if state["messages"] else ""
+        is_simple, reason = classify_complexity(message)
+        if is_simple is None and complexity_llm_with_output:
+            try:
+                assessment: ComplexityAssessment = await complexity_llm_with_output.ainvoke(
+                    COMPLEXITY_PROMPT.messages(message=message, success_criteria=state.get("success_criteria", ""))
+                )
+                is_simple, reason = assessment.is_simple, assessment.reason
+            except Exception as e:
+                print(f"Warning: Complexity check failed, using the planner: {e}")
+
+        complexity = "simple" if is_simple else "complex"
+        progress_writer()({
+            "event": "triage",
+            "complexity": complexity,
+            "content": f"{'Simple request, answering directly' if is_simple else 'Multi-step request, planning'} ({reason})"
+        })
+        return {"request_complexity": complexity}
+
+    return triage
@@ -1,53 +1,75 @@
-from typing import Dict, Any
+from typing import Dict, Any, Iterable, List, Set
+from collections import OrderedDict
 from datetime import datetime
-from langchain_core.messages import SystemMessage, HumanMessage
+from langchain_core.messages import SystemMessage
+from langchain_core.runnables import RunnableConfig
 from langgraph.prebuilt import ToolNode
+from langgraph.config import get_stream_writer
+from contextlib import AsyncExitStack
 import asyncio
+import hashlib
+import os
 import sys
 from pathlib import Path
 parent_dir = Path(__file__).parent.parent
 if str(parent_dir) not in sys.path:
     sys.path.insert(0, str(parent_dir))
 from state import State
+from routing import plan_rejected
+from context_budget import ContextBudget, count_text_tokens, shorten
+from cache import make_cache_key
+from prompts import PromptTemplate
 
+subtask_digest_tokens = int(os.getenv("SUBTASK_DIGEST_TOKENS", "600"))
 
-def create_worker_node(worker_llm_with_tools):
-    """Creates a worker node function"""
-    def worker(state: State) -> Dict[str, Any]:
-        system_message = f"""You are a helpful assistant that can use tools to complete tasks.
-    You keep working on a task until either you have a question or clarification for the user, or the success criteria is met.
-    You have many tools to help you, including tools to browse the internet, navigating and retrieving web pages.
-    You have a tool to run python code, but note that you would need to include a print() statement if you wanted to receive output.
-    The current date and time is {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
 
-    This is the success criteria:
-    {state["success_criteria"]}
-    You should reply either with a question for the user about this assignment, or with your final response.
-    If you have a question for the user, you need to reply by clearly stating your question. An example might be:
+def progress_writer():
+    """Returns the graph's custom stream writer, or a no-op when not running inside a graph"""
+    try:
+        return get_stream_writer()
+    except RuntimeError:
+        return lambda chunk: None
 
-    Question: please clarify whether you want a summary or a detailed answer
 
-    If you've finished, reply with the final answer, and don't ask a question; simply reply with the answer.
-    """
+WORKER_PROMPT = PromptTemplate("worker", prefix="""You are a helpful assistant that can use tools to complete tasks.
+You keep working on a task until either you have a question or clarification for the user, or the success criteria is met.
+You have many tools to help you, including tools to browse the internet, navigating and retrieving web pages.
+You have a tool to run python code, but note that you would need to include a print() statement if you wanted to receive output.
 
-        if state.get("feedback_on_work"):
-            system_message += f"""
-    Previously you thought you completed the assignment, but your reply was rejected because the success criteria was not met.
-    Here is the feedback on why this was rejected:
-    {state["feedback_on_work"]}
-    With this feedback, please continue the assignment, ensuring that you meet the success criteria or have a question for the user."""
+You should reply either with a question for the user about this assignment, or with your final response.
+If you have a question for the user, you need to reply by clearly stating your question. An example might be:
+
+Question: please clarify whether you want a summary or a detailed answer
 
-        found_system_message = False
-        messages = state["messages"]
-        for message in messages:
-            if isinstance(message, SystemMessage):
-                message.content = system_message
-                found_system_message = True
+If you've finished, reply with the final answer, and don't ask a question; simply reply with the answer.""", suffix="""The current date and time is {now}
 
-        if not found_system_message:
-            messages = [SystemMessage(content=system_message)] + messages
+This is the success criteria:
+{success_criteria}{feedback}""")
+
+WORKER_FEEDBACK = """
+
+Previously you thought you completed the assignment, but your reply was rejected because the success criteria was not met.
+Here is the feedback on why this was rejected:
+{feedback_on_work}
+With this feedback, please continue the assignment, ensuring that you meet the success criteria or have a question for the user."""
+
+
+def create_worker_node(worker_llm_with_tools):
+    """Creates a worker node function"""
+    async def worker(state: State) -> Dict[str, Any]:
+        feedback = ""
+        if state.get("feedback_on_work"):
+            feedback = WORKER_FEEDBACK.format(feedback_on_work=state["feedback_on_work"])
 
-        response = worker_llm_with_tools.invoke(messages)
+        history = [message for message in state["messages"] if not isinstance(message, SystemMessage)]
+        messages = WORKER_PROMPT.around(
+            history,
+            now=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            success_criteria=state["success_criteria"],
+            feedback=feedback
+        )
+
+        response = await worker_llm_with_tools.ainvoke(messages)
 
         return {
             "messages": [response],
@@ -56,11 +78,92 @@ def create_worker_node(worker_llm_with_tools):
     return worker
 
 
-def create_process_subtask_node(worker_llm_with_tools, tools):
-    """Creates a process_subtask function"""
-    async def process_subtask(subtask: Dict[str, Any], subtask_index: int, state: State) -> Dict[str, Any]:
-        """Processes a single subtask"""
-        system_message = f"""You are a helpful assistant that can use tools to complete tasks.
+def create_tools_node(tools, browser_pool=None):
+    """Creates the tools node of the worker loop and a function that releases a thread's browser.
+
+    Every session runs the same compiled graph, so browsing through the shared
+    toolkit would let one user's pages and cookies leak into another's run. The
+    first browsing call of a thread leases a context from the pool instead, and
+    the thread keeps it, with its open page, until release_browser(thread_id)
+    is called at the end of the run.
+    """
+    browser_tool_names = browser_pool.tool_names if browser_pool else set()
+    local_tools = [tool for tool in tools if tool.name not in browser_tool_names]
+    local_tool_node = ToolNode(tools=local_tools)
+    leases: Dict[str, Any] = {}
+
+    async def tools_node(state: State, config: RunnableConfig) -> Dict[str, Any]:
+        thread_id = config.get("configurable", {}).get("thread_id", "")
+        tool_calls = getattr(state["messages"][-1], "tool_calls", None) or []
+        if thread_id not in leases and any(call["name"] in browser_tool_names for call in tool_calls):
+            stack = AsyncExitStack()
+            browser_tools = await stack.enter_async_context(browser_pool.lease())
+            leases[thread_id] = (stack, ToolNode(tools=local_tools + browser_tools))
+        tool_node = leases[thread_id][1] if thread_id in leases else local_tool_node
+        return await tool_node.ainvoke(state)
+
+    async def release_browser(thread_id: str):
+        lease = leases.pop(thread_id, None)
+        if lease:
+            await lease[0].aclose()
+
+    return tools_node, release_browser
+
+
+def create_result_digester(digest_llm=None, cache=None, max_tokens: int = subtask_digest_tokens, max_digests: int = 512):
+    """Creates a function that condenses a subtask result into a bounded digest for its dependents.
+
+    Each distinct result is digested once: digests are keyed by the result's
+    hash, shared in memory while in flight, and kept in the response cache.
+    Results that already fit within max_tokens are passed through unchanged.
+    If the digest fails, callers get an excerpt, which is not kept, so the
+    next caller asks the digest model again.
+    """
+    digests: "OrderedDict[str, asyncio.Future]" = OrderedDict()
+
+    prompt = PromptTemplate("digest", prefix=f"""You condense the result of one subtask so that workers on later subtasks can build on it.
+Write a digest of at most {max_tokens * 3 // 4} words. Keep every concrete fact, figure, name, date, source URL,
+file path and decision, and any content later subtasks must reuse verbatim. Drop narration about how the work was done.""",
+                            suffix="{result}")
+
+    async def summarize(result: str) -> str:
+        response = await digest_llm.ainvoke(prompt.messages(result=result))
+        return response.content
+
+    async def compute(result: str, key: str) -> str:
+        if cache:
+            return await cache.get_or_compute(key, lambda: summarize(result), dumps=str, loads=str)
+        return await summarize(result)
+
+    def forget_failed(key: str, future: asyncio.Future):
+        if not future.cancelled() and future.exception() is None:
+            return
+        if digests.get(key) is future:
+            del digests[key]
+        if not future.cancelled():
+            print(f"Warning: Could not digest subtask result, passing an excerpt instead: {future.exception()}")
+
+    async def digest(result: str) -> str:
+        if count_text_tokens(result) <= max_tokens:
+            return result
+        if digest_llm is None:
+            return shorten(result, max_tokens)
+        key = make_cache_key("digest", max_tokens, hashlib.sha256(result.encode("utf-8")).hexdigest())
+        if key not in digests:
+            digests[key] = asyncio.ensure_future(compute(result, key))
+            digests[key].add_done_callback(lambda future, key=key: forget_failed(key, future))
+            while len(digests) > max_digests:
+                digests.popitem(last=False)
+        try:
+            # Shielded so one cancelled dependent does not cancel the digest for the others
+            return await asyncio.shield(digests[key])
+        except Exception:
+            return shorten(result, max_tokens)
+
+    return digest
+
+
+SUBTASK_PROMPT = PromptTemplate("subtask", prefix="""You are a helpful assistant that can use tools to complete tasks.
 You are working on a specific subtask as part of a larger plan to create a SINGLE final output.
 
 CRITICAL FILE CREATION RULES:
@@ -75,12 +178,6 @@ IMPORTANT: If this task involves creating an output file (PDF, document, etc.),
 to ONE shared output, not creating your own separate file. Check if other workers have already 
 started creating the output, and contribute to that file rather than creating a new one.
 
-Current subtask: {subtask['description']}
-Subtask success criteria: {subtask['success_criteria']}
-
-The overall task success criteria is: {state['success_criteria']}
-The current date and time is {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
-
 You have many tools to help you, including tools to browse the internet, navigating and retrieving web pages.
 You have a tool to run python code, but note that you would need to include a print() statement if you wanted to receive output.
 You also have access to a push notification tool - if your subtask involves sending a push notification, use the push tool to send it.
@@ -92,13 +189,43 @@ Focus on completing this specific subtask.
 - The final file generation should typically be done by ONE worker, not all workers
 - If your subtask is to send a push notification, use the push tool with an appropriate message
 
-When done, provide a clear summary of what you accomplished and include any content/results in your response text."""
+CRITICAL INSTRUCTIONS:
+- This is part of a larger task to create a SINGLE final output
+- DO NOT create intermediate files (.txt, .md) to store your work
+- Return all your results, content, and findings as text in your response
+- Your results will be automatically saved and passed to other workers
+- Only create a file if it is the EXPLICITLY requested final output (e.g., the final PDF)
+- If you need to prepare content for a PDF/document, return it as markdown/text in your response
+- Do NOT create multiple versions of the same output
+- Do NOT create temporary or intermediate files
+- Pay close attention to the clarification answers - they contain specific user requirements that must be met
+
+When done, provide a clear summary of what you accomplished and include any content/results in your response text.""",
+suffix="""Subtask {subtask_index}: {description}
+Subtask success criteria: {success_criteria}
+
+The overall task success criteria is: {overall_success_criteria}
+The current date and time is {now}
+{context}{clarification_context}{retry_context}
 
+Please complete this subtask and return your results as text in your response.""")
+
+
+def create_process_subtask_node(worker_llm_with_tools, tools, browser_pool=None, digest_result=None):
+    """Creates a process_subtask function"""
+    async def process_subtask(subtask: Dict[str, Any], subtask_index: int, state: State) -> Dict[str, Any]:
+        """Processes a single subtask"""
         context = ""
         if subtask.get("dependencies"):
+            digested = False
             for dep_idx in subtask["dependencies"]:
                 if dep_idx in state.get("worker_results", {}):
-                    context += f"\nResult from dependent task {dep_idx}: {state['worker_results'][dep_idx]}\n"
+                    result = state["worker_results"][dep_idx]
+                    handoff = await digest_result(result) if digest_result else result
+                    digested = digested or handoff != result
+                    context += f"\nResult from dependent task {dep_idx}: {handoff}\n"
+            if digested:
+                context += "\nLong results above are digests. Call read_subtask_result with a task number to get its full text.\n"
 
         # Include clarification answers if available
         clarification_context = ""
@@ -111,42 +238,64 @@ When done, provide a clear summary of what you accomplished and include any cont
                     clarification_context += f"{i}. {answer}\n"
                 clarification_context += "\nThese clarification answers provide important context about the user's requirements. Make sure to incorporate these details into your work."
 
-        user_message = f"""Subtask {subtask_index}: {subtask['description']}
-{context}{clarification_context}
-
-CRITICAL INSTRUCTIONS:
-- This is part of a larger task to create a SINGLE final output
-- DO NOT create intermediate files (.txt, .md) to store your work
-- Return all your results, content, and findings as text in your response
-- Your results will be automatically saved and passed to other workers
-- Only create a file if it is the EXPLICITLY requested final output (e.g., the final PDF)
-- If you need to prepare content for a PDF/document, return it as markdown/text in your response
-- Do NOT create multiple versions of the same output
-- Do NOT create temporary or intermediate files
-- Pay close attention to the clarification answers above - they contain specific user requirements that must be met
-
-Please complete this subtask and return your results as text in your response."""
-
-        messages = [
-            SystemMessage(content=system_message),
-            HumanMessage(content=user_message)
-        ]
+        retry_context = ""
+        if subtask.get("retry_feedback"):
+            retry_context = f"\n\nIMPORTANT - A previous attempt at this subtask was rejected. Evaluator feedback:\n{subtask['retry_feedback']}\nAddress this feedback in your new attempt."
+
+        messages = SUBTASK_PROMPT.messages(
+            subtask_index=subtask_index,
+            description=subtask["description"],
+            success_criteria=subtask["success_criteria"],
+            overall_success_criteria=state["success_criteria"],
+            now=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            context=context,
+            clarification_context=clarification_context,
+            retry_context=retry_context
+        )
 
         max_iterations = 5
         iteration = 0
         current_messages = messages
+        tool_node = ToolNode(tools=tools)
+        browser_leased = False
+        context_budget = ContextBudget()
+        write_progress = progress_writer()
         
-        while iteration < max_iterations:
-            response = await asyncio.to_thread(worker_llm_with_tools.invoke, current_messages)
-            current_messages.append(response)
-            
-            if hasattr(response, 'tool_calls') and response.tool_calls:
-                tool_node = ToolNode(tools=tools)
-                tool_results = await tool_node.ainvoke({"messages": [response]})
-                current_messages.extend(tool_results.get("messages", []))
-                iteration += 1
-            else:
-                break
+        async with AsyncExitStack() as stack:
+            while iteration < max_iterations:
+                # Older tool outputs are shortened in place, so they are not re-sent in full every turn
+                current_messages, context_stats = context_budget.compact(current_messages)
+                response = await worker_llm_with_tools.ainvoke(
+                    current_messages, config={"tags": [f"subtask:{subtask_index}"]}
+                )
+                current_messages.append(response)
+                write_progress({
+                    "event": "subtask_context",
+                    "subtask_index": subtask_index,
+                    "iteration": iteration,
+                    **context_stats,
+                    "reported_prompt_tokens": (getattr(response, "usage_metadata", None) or {}).get("input_tokens"),
+                })
+                
+                if hasattr(response, 'tool_calls') and response.tool_calls:
+                    # Lease an isolated browser context the first time this subtask browses
+                    if browser_pool and not browser_leased and any(
+                        call["name"] in browser_pool.tool_names for call in response.tool_calls
+                    ):
+                        browser_tools = await stack.enter_async_context(browser_pool.lease())
+                        tool_node = ToolNode(tools=[
+                            tool for tool in tools if tool.name not in browser_pool.tool_names
+                        ] + browser_tools)
+                        browser_leased = True
+                    # worker_results is passed along for read_subtask_result
+                    tool_results = await tool_node.ainvoke({
+                        "messages": [response],
+                        "worker_results": state.get("worker_results", {})
+                    })
+                    current_messages.extend(tool_results.get("messages", []))
+                    iteration += 1
+                else:
+                    break
         
         result_content = response.content if hasattr(response, 'content') and response.content else "Task completed."
         
@@ -158,14 +307,18 @@ Please complete this subtask and return your results as text in your response.""
     return process_subtask
 
 
-def create_parallel_worker_group_node(process_subtask_func):
-    """Creates a parallel_worker_group node function"""
-    async def parallel_worker_group(state: State) -> Dict[str, Any]:
-        """Processes all subtasks in current parallel group concurrently"""
+def create_dag_scheduler_node(process_subtask_func, evaluate_subtask_func=None, digest_result_func=None,
+                              evaluate_plan_func=None):
+    """Creates a dag_scheduler node function.
+
+    With evaluate_plan_func, a plan that has not been checked yet is evaluated
+    while its first subtasks run. Subtasks with dependencies wait for the check,
+    and if the plan is rejected everything in flight is cancelled.
+    """
+    async def dag_scheduler(state: State) -> Dict[str, Any]:
+        """Runs every subtask in the plan, starting each one as soon as its dependencies finish"""
         task_plan = state.get("task_plan")
-        parallel_groups = state.get("parallel_groups")
-        current_parallel_group = state.get("current_parallel_group", 0)
-        
+
         if not task_plan:
             return {
                 "messages": [{
@@ -173,78 +326,251 @@ def create_parallel_worker_group_node(process_subtask_func):
                     "content": "Error: No task plan found. Please create a plan first."
                 }]
             }
-        
-        if not parallel_groups:
-            return {
-                "messages": [{
-                    "role": "assistant",
-                    "content": "Error: No parallel groups found. Please create a plan first."
-                }]
+
+        num_subtasks = len(task_plan)
+        worker_results = state.get("worker_results", {}).copy()
+        task_evaluation_results = state.get("task_evaluation_results", {}).copy()
+
+        # Build the dependency graph, dropping invalid and self references
+        dependencies = {}
+        for idx, subtask in enumerate(task_plan):
+            deps = set()
+            for dep_idx in subtask.get("dependencies", []) or []:
+                if isinstance(dep_idx, int) and 0 <= dep_idx < num_subtasks and dep_idx != idx:
+                    deps.add(dep_idx)
+                else:
+                    print(f"Warning: Invalid dependency {dep_idx} for subtask {idx}. Ignoring.")
+            dependencies[idx] = deps
+
+        write_progress = progress_writer()
+        pending = {idx for idx in range(num_subtasks) if idx not in worker_results}
+        done = set(range(num_subtasks)) - pending
+        running = {}
+        evaluations = {}
+        digests = []
+        completed = 0
+        plan_check = None
+        plan_evaluation = {}
+        if evaluate_plan_func and state.get("plan_quality_check_enabled") and state.get("plan_quality_score") is None:
+            plan_check = asyncio.create_task(evaluate_plan_func(state))
+
+        def start(idx: int):
+            # Each subtask sees the results finished so far, including its dependencies
+            subtask_state = {**state, "worker_results": dict(worker_results)}
+            task = asyncio.create_task(process_subtask_func(task_plan[idx], idx, subtask_state))
+            running[task] = idx
+            pending.discard(idx)
+            write_progress({
+                "event": "subtask_started",
+                "subtask_index": idx,
+                "content": f"Started subtask {idx}: {task_plan[idx].get('description', '')}"
+            })
+
+        def report_evaluation(idx: int, evaluation: asyncio.Task):
+            if evaluation.cancelled() or evaluation.exception():
+                return
+            write_progress({
+                "event": "subtask_evaluated",
+                "subtask_index": idx,
+                "content": f"Subtask {idx} {'passed' if evaluation.result()['is_complete'] else 'needs refinement'}"
+            })
+
+        try:
+            while pending or running or plan_check:
+                ready = sorted(idx for idx in pending if dependencies[idx] <= done)
+                if plan_check:
+                    # Only the first subtasks run before the plan is approved
+                    ready = [idx for idx in ready if not dependencies[idx]]
+                elif not ready and not running:
+                    # Remaining subtasks wait on each other; break the cycle at the lowest index
+                    idx = min(pending)
+                    print(f"Warning: Dependency cycle detected at subtask {idx}. Running it without waiting.")
+                    ready = [idx]
+                for idx in ready:
+                    start(idx)
+
+                finished, _ = await asyncio.wait(
+                    list(running) + ([plan_check] if plan_check else []), return_when=asyncio.FIRST_COMPLETED
+                )
+                if plan_check in finished:
+                    finished.discard(plan_check)
+                    try:
+                        plan_evaluation = plan_check.result()
+                    except Exception as e:
+                        print(f"Warning: Plan quality evaluation failed, continuing with the plan: {e}")
+                    plan_check = None
+                    if plan_rejected(plan_evaluation):
+                        write_progress({
+                            "event": "plan_rejected",
+                            "content": f"Plan rejected, cancelling {len(running)} running subtasks"
+                        })
+                        break
+                for task in finished:
+                    idx = running.pop(task)
+                    result = task.result()
+                    worker_results[result["subtask_index"]] = result["result"]
+                    done.add(idx)
+                    completed += 1
+                    write_progress({
+                        "event": "subtask_finished",
+                        "subtask_index": idx,
+                        "content": f"Finished subtask {idx}"
+                    })
+                    if digest_result_func and any(idx in dependencies[other] for other in pending):
+                        # Digest the result for its dependents while it is being graded
+                        digests.append(asyncio.ensure_future(digest_result_func(result["result"])))
+                    if evaluate_subtask_func:
+                        # Grade the subtask while its siblings and dependents keep running
+                        evaluations[idx] = asyncio.create_task(
+                            evaluate_subtask_func(task_plan[idx], idx, result["result"])
+                        )
+                        evaluations[idx].add_done_callback(
+                            lambda evaluation, idx=idx: report_evaluation(idx, evaluation)
+                        )
+
+            for idx, evaluation in evaluations.items():
+                try:
+                    task_evaluation_results[idx] = await evaluation
+                except Exception as e:
+                    # Leave it for the per-task evaluator to grade in its batch
+                    print(f"Warning: Evaluation of subtask {idx} failed: {e}")
+        finally:
+            in_flight = list(running) + list(evaluations.values()) + digests + ([plan_check] if plan_check else [])
+            for task in in_flight:
+                task.cancel()
+            # Wait until they stop, so none still holds a browser lease or calls a model once the node returns
+            await asyncio.gather(*in_flight, return_exceptions=True)
+
+        if plan_rejected(plan_evaluation):
+            # Only results that already passed their evaluation are kept, and the planner carries
+            # them forward only if the new plan has the same subtask built on the same results
+            for idx, evaluation in evaluations.items():
+                if evaluation.done() and not evaluation.cancelled() and not evaluation.exception():
+                    task_evaluation_results[idx] = evaluation.result()
+            passed = {
+                idx for idx, evaluation in task_evaluation_results.items()
+                if idx in worker_results and evaluation.get("is_complete", False)
             }
-        
-        if current_parallel_group >= len(parallel_groups):
             return {
-                "all_tasks_complete": True,
-                "messages": [{
-                    "role": "assistant",
-                    "content": "All parallel groups have been processed."
-                }]
+                **plan_evaluation,
+                "worker_results": {idx: worker_results[idx] for idx in passed},
+                "task_evaluation_results": {idx: task_evaluation_results[idx] for idx in passed},
             }
-        
-        current_group = parallel_groups[current_parallel_group]
-        worker_results = state.get("worker_results", {}).copy()
 
-        valid_indices = []
-        for idx in current_group:
-            if isinstance(idx, int) and 0 <= idx < len(task_plan):
-                valid_indices.append(idx)
-            else:
-                print(f"Warning: Invalid index {idx} in parallel group {current_parallel_group}. Skipping.")
-        
-        if not valid_indices:
-            return {
-                "messages": [{
-                    "role": "assistant",
-                    "content": f"Error: No valid subtask indices in parallel group {current_parallel_group}."
-                }]
-            }
+        return {
+            "worker_results": worker_results,
+            "task_evaluation_results": task_evaluation_results,
+            "all_tasks_complete": True,
+            **{key: value for key, value in plan_evaluation.items() if key != "messages"},
+            "messages": plan_evaluation.get("messages", []) + [{
+                "role": "assistant",
+                "content": f"Completed {completed} subtasks following their dependencies"
+            }]
+        }
 
-        subtasks = []
-        for idx in valid_indices:
-            try:
-                if 0 <= idx < len(task_plan):
-                    subtasks.append((idx, task_plan[idx]))
-                else:
-                    print(f"Warning: Index {idx} out of range [0, {len(task_plan)-1}]. Skipping.")
-            except (IndexError, TypeError) as e:
-                print(f"Error accessing task_plan[{idx}]: {e}. Skipping.")
+    return dag_scheduler
+
+
+def create_speculative_research_node(process_subtask_func, evaluate_subtask_func=None):
+    """Creates a node that runs a plan's research subtasks ahead of time.
+
+    Runs the subtasks that depend on nothing and feed into others, which the
+    planner uses for gathering information returned as text. Subtasks that
+    create the final output or send notifications are left for the real run.
+    """
+    async def speculative_research(state: State) -> Dict[str, Any]:
+        task_plan = state.get("task_plan") or []
+        dependents = {dep_idx for subtask in task_plan for dep_idx in subtask.get("dependencies", []) or []}
+        research = [
+            idx for idx, subtask in enumerate(task_plan)
+            if not subtask.get("dependencies") and idx in dependents
+            and "notif" not in subtask.get("description", "").lower()
+        ]
+
+        async def run(idx: int):
+            result = await process_subtask_func(task_plan[idx], idx, state)
+            evaluation = None
+            if evaluate_subtask_func:
+                try:
+                    evaluation = await evaluate_subtask_func(task_plan[idx], idx, result["result"])
+                except Exception as e:
+                    print(f"Warning: Evaluation of speculative subtask {idx} failed: {e}")
+            return idx, result["result"], evaluation
+
+        worker_results = {}
+        task_evaluation_results = {}
+        for outcome in await asyncio.gather(*[run(idx) for idx in research], return_exceptions=True):
+            if isinstance(outcome, BaseException):
+                print(f"Warning: Speculative subtask failed: {outcome}")
                 continue
-        
-        if not subtasks:
-            return {
-                "messages": [{
-                    "role": "assistant",
-                    "content": f"Error: No valid subtasks found in parallel group {current_parallel_group} after validation."
-                }]
-            }
+            idx, result, evaluation = outcome
+            worker_results[idx] = result
+            if evaluation:
+                task_evaluation_results[idx] = evaluation
+
+        return {
+            "worker_results": worker_results,
+            "task_evaluation_results": task_evaluation_results
+        }
+
+    return speculative_research
+
 
-        # Process all subtasks in parallel using asyncio.gather
-        results = await asyncio.gather(*[
-            process_subtask_func(subtask, idx, state)
-            for idx, subtask in subtasks
-        ])
+def dependents_of(task_plan: List[Dict[str, Any]], indices: Iterable[int]) -> Set[int]:
+    """Returns the subtasks that depend on any of the given ones, directly or indirectly"""
+    dependents = {idx: set() for idx in range(len(task_plan))}
+    for idx, subtask in enumerate(task_plan):
+        for dep_idx in subtask.get("dependencies", []) or []:
+            if dep_idx in dependents and dep_idx != idx:
+                dependents[dep_idx].add(idx)
 
-        # Store results
-        for result in results:
-            worker_results[result["subtask_index"]] = result["result"]
+    found = set()
+    stack = list(indices)
+    while stack:
+        for dependent in dependents.get(stack.pop(), ()):
+            if dependent not in found:
+                found.add(dependent)
+                stack.append(dependent)
+    return found
+
+
+def create_retry_failed_subtasks_node(max_subtask_retries: int):
+    """Creates a retry_failed_subtasks node function"""
+    def retry_failed_subtasks(state: State) -> Dict[str, Any]:
+        """Clears the results of failed subtasks and their dependents, attaching evaluator feedback to the failed ones"""
+        task_plan = [dict(subtask) for subtask in state.get("task_plan") or []]
+        worker_results = state.get("worker_results", {}).copy()
+        task_evaluation_results = state.get("task_evaluation_results", {}).copy()
+        retry_counts = dict(state.get("subtask_retry_counts") or {})
+
+        retried = []
+        for idx, subtask in enumerate(task_plan):
+            evaluation = task_evaluation_results.get(idx, {})
+            if evaluation.get("is_complete", False) or retry_counts.get(idx, 0) >= max_subtask_retries:
+                continue
+            subtask["retry_feedback"] = evaluation.get("feedback", "")
+            worker_results.pop(idx, None)
+            task_evaluation_results.pop(idx, None)
+            retry_counts[idx] = retry_counts.get(idx, 0) + 1
+            retried.append(idx)
+
+        # Results built on a retried subtask's rejected output have to be redone with its new one
+        rerun = sorted(dependents_of(task_plan, retried) - set(retried))
+        for idx in rerun:
+            worker_results.pop(idx, None)
+            task_evaluation_results.pop(idx, None)
 
         return {
+            "task_plan": task_plan,
             "worker_results": worker_results,
+            "task_evaluation_results": task_evaluation_results,
+            "subtask_retry_counts": retry_counts,
+            "all_tasks_complete": False,
             "messages": [{
                 "role": "assistant",
-                "content": f"Completed {len(results)} subtasks in parallel group {state['current_parallel_group']}"
+                "content": f"Retrying subtasks {retried} with evaluator feedback"
+                           + (f", then re-running their dependents {rerun}" if rerun else "")
             }]
         }
-    
-    return parallel_worker_group
 
+    return retry_failed_subtasks
@@ -0,0 +1,135 @@
+from typing import Any, Dict, List, Set, Tuple
+
+
+def normalize_dependencies(task_plan: List[Dict[str, Any]]) -> Tuple[Dict[int, Set[int]], List[str]]:
+    """Maps each subtask to its valid dependencies, reporting out-of-range, self and duplicate references"""
+    num_subtasks = len(task_plan)
+    dependencies = {}
+    issues = []
+    for idx, subtask in enumerate(task_plan):
+        deps = set()
+        for dep_idx in subtask.get("dependencies", []) or []:
+            if not isinstance(dep_idx, int) or not 0 <= dep_idx < num_subtasks:
+                issues.append(f"Subtask {idx} depends on subtask {dep_idx}, which does not exist")
+            elif dep_idx == idx:
+                issues.append(f"Subtask {idx} depends on itself")
+            elif dep_idx in deps:
+                issues.append(f"Subtask {idx} lists subtask {dep_idx} as a dependency more than once")
+            else:
+                deps.add(dep_idx)
+        dependencies[idx] = deps
+    return dependencies, issues
+
+
+def execution_levels(dependencies: Dict[int, Set[int]]) -> Tuple[List[List[int]], Set[int]]:
+    """Groups subtasks by topological level: each runs one level after its deepest dependency.
+
+    Returns the levels and the subtasks that could not be placed because they
+    are on, or depend on, a dependency cycle.
+    """
+    remaining = {idx: set(deps) for idx, deps in dependencies.items()}
+    dependents: Dict[int, Set[int]] = {idx: set() for idx in dependencies}
+    for idx, deps in dependencies.items():
+        for dep_idx in deps:
+            dependents[dep_idx].add(idx)
+
+    levels = []
+    ready = sorted(idx for idx, deps in remaining.items() if not deps)
+    while ready:
+        levels.append(ready)
+        next_ready = set()
+        for idx in ready:
+            del remaining[idx]
+            for dependent in dependents[idx]:
+                remaining[dependent].discard(idx)
+                if not remaining[dependent]:
+                    next_ready.add(dependent)
+        ready = sorted(next_ready)
+    return levels, set(remaining)
+
+
+def find_cycles(dependencies: Dict[int, Set[int]], among: Set[int]) -> List[List[int]]:
+    """Returns the dependency cycles among the given subtasks (strongly connected components, Tarjan)"""
+    index = {}
+    lowlink = {}
+    stack = []
+    on_stack = set()
+    cycles = []
+
+    def visit(idx: int):
+        index[idx] = lowlink[idx] = len(index)
+        stack.append(idx)
+        on_stack.add(idx)
+        for dep_idx in dependencies[idx] & among:
+            if dep_idx not in index:
+                visit(dep_idx)
+                lowlink[idx] = min(lowlink[idx], lowlink[dep_idx])
+            elif dep_idx in on_stack:
+                lowlink[idx] = min(lowlink[idx], index[dep_idx])
+        if lowlink[idx] == index[idx]:
+            component = []
+            while True:
+                member = stack.pop()
+                on_stack.discard(member)
+                component.append(member)
+                if member == idx:
+                    break
+            if len(component) > 1:
+                cycles.append(sorted(component))
+
+    for idx in sorted(among):
+        if idx not in index:
+            visit(idx)
+    return cycles
+
+
+def validate_plan(task_plan: List[Dict[str, Any]], parallel_groups: List[List[Any]] = None) -> Dict[str, Any]:
+    """Checks a plan's structure without an LLM and derives its parallel groups.
+
+    Returns the sanitized dependencies per subtask, the execution levels to use
+    as parallel groups, any dependency cycles, and a list of issues. Issues
+    other than cycles are repaired by the sanitized dependencies and derived
+    levels; cycles make the plan structurally unsound.
+    """
+    dependencies, issues = normalize_dependencies(task_plan)
+    levels, unplaced = execution_levels(dependencies)
+    cycles = find_cycles(dependencies, unplaced)
+    for cycle in cycles:
+        issues.append(f"Subtasks {', '.join(map(str, cycle))} depend on each other in a cycle")
+    blocked = sorted(unplaced - {idx for cycle in cycles for idx in cycle})
+    if blocked:
+        issues.append(f"Subtasks {', '.join(map(str, blocked))} can never start because they depend on a cycle")
+
+    if len(task_plan) > 1:
+        dependents = {dep_idx for deps in dependencies.values() for dep_idx in deps}
+        for idx in range(len(task_plan)):
+            if not dependencies[idx] and idx not in dependents:
+                issues.append(f"Subtask {idx} is orphaned: it has no dependencies and no subtask uses its result")
+
+    if parallel_groups is not None:
+        group_of = {}
+        for group_idx, group in enumerate(parallel_groups):
+            for idx in group:
+                if not isinstance(idx, int) or not 0 <= idx < len(task_plan):
+                    issues.append(f"Parallel group {group_idx} refers to subtask {idx}, which does not exist")
+                elif idx in group_of:
+                    issues.append(f"Subtask {idx} is in more than one parallel group")
+                else:
+                    group_of[idx] = group_idx
+        for idx in range(len(task_plan)):
+            if idx not in group_of:
+                issues.append(f"Subtask {idx} is not in any parallel group")
+                continue
+            for dep_idx in sorted(dependencies[idx]):
+                if dep_idx in group_of and group_of[dep_idx] >= group_of[idx]:
+                    issues.append(
+                        f"Subtask {idx} is in group {group_of[idx]} but depends on subtask {dep_idx} in group {group_of[dep_idx]}"
+                    )
+
+    return {
+        "dependencies": {idx: sorted(deps) for idx, deps in dependencies.items()},
+        "levels": levels,
+        "cycles": cycles,
+        "issues": issues,
+        "structure_valid": not unplaced,
+    }
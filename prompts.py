@@ -0,0 +1,75 @@
+import string
+from typing import Any, Dict, List, Optional, Tuple
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+from context_budget import count_text_tokens
+
+
+# Prompt token counts per node, see prompt_stats()
+_stats: Dict[str, Dict[str, int]] = {}
+
+
+class PromptTemplate:
+    """A node's prompt, split into a static prefix and a per-call suffix.
+
+    The prefix holds only fixed instructions, so every call a node makes starts
+    with the same text and the provider can serve it from its prompt cache.
+    Per-call values such as the task, results, feedback and the date only go
+    into the suffix, which is parsed into literal text and fields once, when the
+    template is created, and filled in on each call.
+    """
+    def __init__(self, name: str, prefix: str, suffix: str):
+        self.name = name
+        self.prefix = prefix
+        self.prefix_message = SystemMessage(content=prefix)
+        self.prefix_tokens = count_text_tokens(prefix)
+        self._parts: List[Tuple[str, Optional[str], str]] = [
+            (literal, field, spec or "") for literal, field, spec, _ in string.Formatter().parse(suffix)
+        ]
+        self.fields = {field for _, field, _ in self._parts if field is not None}
+        if "" in self.fields:
+            raise ValueError(f"Prompt {name} has an unnamed field")
+
+    def render(self, **values: Any) -> str:
+        missing = self.fields - values.keys()
+        if missing:
+            raise ValueError(f"Prompt {self.name} is missing values for: {', '.join(sorted(missing))}")
+        return "".join(
+            literal + (format(values[field], spec) if field is not None else "")
+            for literal, field, spec in self._parts
+        )
+
+    def messages(self, **values: Any) -> List[BaseMessage]:
+        """Returns the prefix as the system message and the filled-in suffix as the user message"""
+        suffix = self.render(**values)
+        self._record(suffix)
+        return [self.prefix_message, HumanMessage(content=suffix)]
+
+    def around(self, history: List[BaseMessage], **values: Any) -> List[BaseMessage]:
+        """Returns the prefix, then history, then the filled-in suffix as a closing system message.
+
+        For nodes that resend a growing conversation: the prefix and the earlier
+        turns stay identical from call to call, and only the suffix changes.
+        """
+        suffix = self.render(**values)
+        self._record(suffix)
+        return [self.prefix_message, *history, SystemMessage(content=suffix)]
+
+    def _record(self, suffix: str):
+        stats = _stats.setdefault(self.name, {"calls": 0, "prefix_tokens": 0, "suffix_tokens": 0})
+        stats["calls"] += 1
+        stats["prefix_tokens"] = self.prefix_tokens
+        stats["suffix_tokens"] += count_text_tokens(suffix)
+
+
+def prompt_stats() -> Dict[str, Dict[str, Any]]:
+    """Returns, per node, its calls, static prefix tokens and average per-call suffix tokens"""
+    report = {}
+    for name, stats in _stats.items():
+        average_suffix = stats["suffix_tokens"] / stats["calls"]
+        report[name] = {
+            "calls": stats["calls"],
+            "prefix_tokens": stats["prefix_tokens"],
+            "avg_suffix_tokens": round(average_suffix),
+            "static_share": round(stats["prefix_tokens"] / (stats["prefix_tokens"] + average_suffix), 2),
+        }
+    return report
@@ -0,0 +1,203 @@
+import asyncio
+import os
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+
+llm_requests_per_minute = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "500"))
+llm_tokens_per_minute = float(os.getenv("LLM_TOKENS_PER_MINUTE", "200000"))
+llm_max_concurrency = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+llm_target_latency = float(os.getenv("LLM_TARGET_LATENCY_S", "30"))
+llm_max_retries = int(os.getenv("LLM_MAX_RETRIES", "6"))
+
+T = TypeVar("T")
+
+
+class TokenBucket:
+    """Per-minute budget that refills continuously and allows bursts of burst_seconds worth"""
+    def __init__(self, per_minute: float, burst_seconds: float = 1):
+        self.rate = per_minute / 60
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def reserve(self, amount: float) -> float:
+        """Takes amount from the budget and returns how long to wait before it is covered"""
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        self.level -= amount
+        return max(0.0, -self.level / self.rate)
+
+    def adjust(self, amount: float):
+        """Corrects an earlier reservation once the real cost is known"""
+        self.level = min(self.capacity, self.level - amount)
+
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    return getattr(error, "status_code", None) == 429 or type(error).__name__ == "RateLimitError"
+
+
+def is_transient_error(error: BaseException) -> bool:
+    return getattr(error, "status_code", None) in (500, 502, 503, 504) or type(error).__name__ in (
+        "APIConnectionError", "APITimeoutError", "InternalServerError"
+    )
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Reads the server's Retry-After header from an API error, if it sent one"""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveRateLimiter:
+    """Process-wide limiter for LLM calls.
+
+    Every call reserves one request and its estimated tokens from per-minute
+    budgets and waits for a concurrency slot. The number of slots adapts AIMD
+    style: it grows by one per window of fast successful calls, halves on a
+    429, and shrinks by a tenth when calls get slower than target_latency. A
+    429 also pauses every caller for a jittered backoff, so retries from
+    parallel subtasks and sessions are spread out instead of bursting together.
+    """
+    def __init__(self, requests_per_minute: float = llm_requests_per_minute,
+                 tokens_per_minute: float = llm_tokens_per_minute, max_concurrency: int = llm_max_concurrency,
+                 min_concurrency: int = 1, target_latency: float = llm_target_latency,
+                 max_retries: int = llm_max_retries, base_backoff: float = 1.0, max_backoff: float = 60.0):
+        # Providers enforce per-minute limits over much shorter windows, so only allow small bursts
+        self.requests = TokenBucket(requests_per_minute, burst_seconds=0.1)
+        self.tokens = TokenBucket(tokens_per_minute, burst_seconds=1)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.concurrency = float(max(min_concurrency, max_concurrency // 2))
+        self.target_latency = target_latency
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.in_flight = 0
+        self.waiting = 0
+        self.completed = 0
+        self.throttled = 0
+        self.retries = 0
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._slots = asyncio.Condition()
+
+    async def run(self, call: Callable[[], Awaitable[T]], estimated_tokens: int = 1000,
+                  usage: Callable[[T], Optional[int]] = None) -> T:
+        """Runs call within the limits, retrying rate-limit and transient errors with jittered backoff"""
+        attempt = 0
+        while True:
+            await self._acquire(estimated_tokens)
+            started = time.monotonic()
+            throttled = False
+            succeeded = False
+            try:
+                result = await call()
+            except Exception as e:
+                throttled = is_rate_limit_error(e)
+                if not (throttled or is_transient_error(e)) or attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt, retry_after(e))
+                if throttled:
+                    self.throttled += 1
+                    self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                    print(f"Warning: LLM rate limited, backing off {delay:.1f}s "
+                          f"({self.waiting} queued, {self.concurrency:.0f} concurrent).")
+            else:
+                actual_tokens = usage(result) if usage else None
+                if actual_tokens is not None:
+                    self.tokens.adjust(actual_tokens - estimated_tokens)
+                self.completed += 1
+                succeeded = True
+                return result
+            finally:
+                await self._release(time.monotonic() - started, throttled, succeeded)
+
+            self.retries += 1
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def _backoff(self, attempt: int, server_delay: Optional[float]) -> float:
+        # Full jitter: a random delay up to the exponential bound
+        delay = random.uniform(0, min(self.max_backoff, self.base_backoff * 2 ** attempt))
+        return max(delay, server_delay or 0.0)
+
+    async def _acquire(self, estimated_tokens: int):
+        self.waiting += 1
+        try:
+            async with self._slots:
+                await self._slots.wait_for(lambda: self.in_flight < int(self.concurrency))
+                self.in_flight += 1
+        finally:
+            self.waiting -= 1
+        try:
+            while True:
+                delay = max(self._paused_until - time.monotonic(), 0.0)
+                if delay <= 0:
+                    break
+                await asyncio.sleep(delay)
+            delay = max(self.requests.reserve(1), self.tokens.reserve(estimated_tokens))
+            if delay > 0:
+                await asyncio.sleep(delay)
+        except BaseException:
+            await self._release(0.0, False, False)
+            raise
+
+    async def _release(self, latency: float, throttled: bool, succeeded: bool):
+        async with self._slots:
+            self.in_flight -= 1
+            now = time.monotonic()
+            # Decrease at most once per cooldown, so one burst of 429s only halves the limit once
+            cooldown_over = now - self._last_decrease > max(latency, 1.0)
+            if throttled and cooldown_over:
+                self.concurrency = max(self.min_concurrency, self.concurrency / 2)
+                self._last_decrease = now
+            elif latency > self.target_latency and cooldown_over:
+                self.concurrency = max(self.min_concurrency, self.concurrency * 0.9)
+                self._last_decrease = now
+            elif succeeded:
+                # Only successful calls grow the limit, so failures and timeouts do not add load
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+            self._slots.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": self.waiting,
+            "in_flight": self.in_flight,
+            "concurrency_limit": int(self.concurrency),
+            "completed": self.completed,
+            "throttled": self.throttled,
+            "retries": self.retries,
+        }
+
+
+def estimate_tokens(messages: List[Any], max_output_tokens: int = 1000) -> int:
+    """Roughly estimates a call's tokens as four characters per token plus the expected output"""
+    characters = 0
+    for message in messages:
+        content = message.get("content", "") if isinstance(message, dict) else getattr(message, "content", "")
+        characters += len(content) if isinstance(content, str) else len(str(content))
+    return characters // 4 + max_output_tokens
+
+
+class RateLimitedLLM:
+    """Wraps a model or structured-output chain so its calls go through the shared limiter"""
+    def __init__(self, llm, limiter: AdaptiveRateLimiter, max_output_tokens: int = 1000):
+        self.llm = llm
+        self.limiter = limiter
+        self.max_output_tokens = max_output_tokens
+
+    async def ainvoke(self, messages: List[Any], *args, **kwargs):
+        return await self.limiter.run(
+            lambda: self.llm.ainvoke(messages, *args, **kwargs),
+            estimated_tokens=estimate_tokens(messages, self.max_output_tokens),
+            usage=lambda result: (getattr(result, "usage_metadata", None) or {}).get("total_tokens"),
+        )
+
+    def invoke(self, messages: List[Any], *args, **kwargs):
+        return self.llm.invoke(messages, *args, **kwargs)
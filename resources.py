@@ -0,0 +1,140 @@
+import asyncio
+import os
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+from langchain_openai import ChatOpenAI
+from tools import playwright_tools, other_tools
+from checkpoint_store import CheckpointStore
+from cache import ResponseCache
+from rate_limiter import AdaptiveRateLimiter
+from model_routing import ModelRouter
+
+
+shared_resources_idle_timeout = float(os.getenv("SHARED_RESOURCES_IDLE_S", "300"))
+
+
+class SharedResources:
+    """Process-wide resources shared by every Sidekick session.
+
+    Owns the Playwright runtime and browser pool, the tools, one OpenAI client
+    per routed model with their rate limiter and model router, the checkpoint
+    store, the response and tool caches, and the compiled graphs. Sessions only hold a reference and
+    their own thread id. The resources stay open for idle_timeout seconds after
+    the last session is released, so a returning user does not pay for startup.
+    """
+    _resources: Dict[str, "SharedResources"] = {}
+    _resources_lock = asyncio.Lock()
+
+    def __init__(self, db_path: str, idle_timeout: float = shared_resources_idle_timeout):
+        self.db_path = db_path
+        self.idle_timeout = idle_timeout
+        self.checkpoint_store = None
+        self.response_cache = None
+        self.tool_cache = None
+        self.tools = None
+        self.browser = None
+        self.browser_pool = None
+        self.llm = None
+        self.rate_limiter = None
+        self.model_router = None
+        self._llms: Dict[str, ChatOpenAI] = {}
+        self._templates: Dict[Hashable, Dict[str, Any]] = {}
+        self._templates_lock = asyncio.Lock()
+        self._close_task: Optional[asyncio.Task] = None
+        self._users = 0
+
+    @classmethod
+    async def shared(cls, db_path: str, **kwargs) -> "SharedResources":
+        """Returns the resources for db_path, starting them on first use"""
+        async with cls._resources_lock:
+            resources = cls._resources.get(db_path)
+            if resources is None:
+                resources = cls(db_path, **kwargs)
+                try:
+                    await resources.setup()
+                except BaseException:
+                    # Close what was already opened, such as the stores, when the tools fail to load
+                    await resources.close()
+                    raise
+                cls._resources[db_path] = resources
+            if resources._close_task:
+                resources._close_task.cancel()
+                resources._close_task = None
+            resources._users += 1
+            return resources
+
+    async def release(self):
+        """Releases one session's hold, closing everything once no session has used it for idle_timeout"""
+        async with self._resources_lock:
+            self._users -= 1
+            if self._users > 0:
+                return
+            if self.idle_timeout > 0:
+                self._close_task = asyncio.create_task(self._close_when_idle())
+                return
+            self._resources.pop(self.db_path, None)
+        await self.close()
+
+    async def _close_when_idle(self):
+        await asyncio.sleep(self.idle_timeout)
+        async with self._resources_lock:
+            if self._users > 0:
+                return
+            self._resources.pop(self.db_path, None)
+            self._close_task = None
+        await self.close()
+
+    async def setup(self):
+        self.checkpoint_store = await CheckpointStore.shared(self.db_path)
+
+        self.response_cache = ResponseCache(str(Path(self.db_path).with_name("response_cache.db")))
+        await self.response_cache.setup()
+
+        self.tools, self.browser, self.browser_pool = playwright_tools()
+        self.tool_cache = ResponseCache(
+            str(Path(self.db_path).with_name("tool_cache.db")), ttl_seconds=24 * 3600, max_entries=2000
+        )
+        await self.tool_cache.setup()
+        self.tools += other_tools(self.tool_cache)
+
+        self.model_router = ModelRouter()
+        self.llm = self.llm_for(self.model_router.default)
+        self.rate_limiter = AdaptiveRateLimiter()
+
+    def llm_for(self, model: str) -> ChatOpenAI:
+        """Returns the shared client for model, creating it on first use"""
+        # Nodes routed to the same model bind their own tools or schema to one client, so they share
+        # its connection pool. Retries are left to the rate limiter, which coordinates them across sessions.
+        if model not in self._llms:
+            self._llms[model] = ChatOpenAI(model=model, max_retries=0)
+        return self._llms[model]
+
+    async def template(self, key: Hashable, build: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        """Returns the compiled graph and bound LLMs for key, building them on first use"""
+        async with self._templates_lock:
+            if key not in self._templates:
+                self._templates[key] = await build()
+            return self._templates[key]
+
+    async def close(self):
+        if self.browser:
+            try:
+                if self.browser_pool:
+                    await self.browser_pool.close()
+                await self.browser.close()
+            except Exception as e:
+                print(f"Error closing browser/playwright: {e}")
+
+        for cache in (self.response_cache, self.tool_cache):
+            if cache:
+                try:
+                    await cache.close()
+                except Exception as e:
+                    print(f"Error closing cache: {e}")
+
+        if self.checkpoint_store:
+            try:
+                await self.checkpoint_store.release()
+                self.checkpoint_store = None
+            except Exception as e:
+                print(f"Error releasing checkpoint store: {e}")
@@ -0,0 +1,251 @@
+"""Checkpoint retention for memory.db.
+
+Keeps the newest checkpoints of every thread, expires threads that have been
+idle for too long, removes blobs no checkpoint references any more, and gives
+freed pages back to the filesystem with incremental vacuum.
+
+Usage: python retention.py [--db memory.db] [--prune] [--vacuum]
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional
+
+
+checkpoint_keep_last = int(os.getenv("CHECKPOINT_KEEP_LAST", "20"))
+checkpoint_thread_ttl = float(os.getenv("CHECKPOINT_THREAD_TTL_HOURS", "168")) * 3600
+checkpoint_retention_interval = float(os.getenv("CHECKPOINT_RETENTION_INTERVAL_S", "600"))
+checkpoint_vacuum_pages = int(os.getenv("CHECKPOINT_VACUUM_PAGES", "256"))
+
+# Offset between the UUID epoch (1582-10-15) and the Unix epoch, in 100ns intervals
+UUID_EPOCH_OFFSET = 0x01B21DD213814000
+
+
+def checkpoint_time(checkpoint_id: str) -> Optional[float]:
+    """Returns the Unix time a checkpoint was created at, read from its UUIDv6 id"""
+    try:
+        value = int(checkpoint_id.replace("-", ""), 16)
+    except (AttributeError, ValueError):
+        return None
+    if (value >> 76) & 0xF != 6:
+        return None
+    time_high_mid = value >> 80
+    time_low = (value >> 64) & 0x0FFF
+    return ((time_high_mid << 12 | time_low) - UUID_EPOCH_OFFSET) / 1e7
+
+
+class CheckpointRetention:
+    """Background retention for a CheckpointStore.
+
+    Every pass trims each thread to its keep_last newest checkpoints and
+    deletes threads whose newest checkpoint is older than thread_ttl seconds,
+    together with their pending writes. Work is done one thread at a time under
+    the store's write lock, so active runs only ever wait for a single small
+    delete. Unreferenced blobs are then collected and up to vacuum_pages free
+    pages are released.
+    """
+    def __init__(self, store, keep_last: int = checkpoint_keep_last, thread_ttl: float = checkpoint_thread_ttl,
+                 interval: float = checkpoint_retention_interval, vacuum_pages: int = checkpoint_vacuum_pages):
+        self.store = store
+        self.keep_last = keep_last
+        self.thread_ttl = thread_ttl
+        self.interval = interval
+        self.vacuum_pages = vacuum_pages
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except Exception as e:
+                print(f"Warning: Checkpoint retention failed: {e}")
+
+    async def run_once(self) -> Dict[str, int]:
+        """Runs one retention pass and returns what it removed"""
+        stats = {"threads_expired": 0, "checkpoints_deleted": 0, "writes_deleted": 0,
+                 "blobs_deleted": 0, "pages_vacuumed": 0}
+        now = time.time()
+        async with self.store.reader() as reader:
+            cursor = await reader.conn.execute(
+                "SELECT thread_id, checkpoint_ns, COUNT(*), MAX(checkpoint_id) FROM checkpoints GROUP BY thread_id, checkpoint_ns"
+            )
+            threads = await cursor.fetchall()
+
+        for thread_id, checkpoint_ns, count, newest_id in threads:
+            last_active = checkpoint_time(newest_id)
+            if self.thread_ttl > 0 and last_active is not None and now - last_active > self.thread_ttl:
+                deleted = await self._delete(
+                    "thread_id = ? AND checkpoint_ns = ?", (thread_id, checkpoint_ns)
+                )
+                stats["threads_expired"] += 1
+            elif self.keep_last > 0 and count > self.keep_last:
+                deleted = await self._delete(
+                    "thread_id = ? AND checkpoint_ns = ? AND checkpoint_id < ("
+                    "SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+                    "ORDER BY checkpoint_id DESC LIMIT 1 OFFSET ?)",
+                    (thread_id, checkpoint_ns, thread_id, checkpoint_ns, self.keep_last - 1)
+                )
+            else:
+                continue
+            stats["checkpoints_deleted"] += deleted[0]
+            stats["writes_deleted"] += deleted[1]
+            # Let active runs get at the write lock between threads
+            await asyncio.sleep(0)
+
+        stats["blobs_deleted"] = await self.collect_blobs()
+        stats["pages_vacuumed"] = await self.incremental_vacuum()
+        return stats
+
+    async def _delete(self, where: str, params: tuple) -> List[int]:
+        writer = self.store.writer
+        async with self.store.saver.lock:
+            # The blob references go first, while the checkpoints the condition may look up still exist
+            await writer.execute(f"DELETE FROM blob_refs WHERE {where}", params)
+            writes = await writer.execute(f"DELETE FROM writes WHERE {where}", params)
+            checkpoints = await writer.execute(f"DELETE FROM checkpoints WHERE {where}", params)
+            deleted = [checkpoints.rowcount, writes.rowcount]
+        await self.store.flush()
+        return deleted
+
+    async def collect_blobs(self) -> int:
+        """Deletes blobs that no remaining checkpoint or write references, according to blob_refs"""
+        serde = self.store.serde
+        query = "SELECT key FROM blobs WHERE key NOT IN (SELECT key FROM blob_refs)"
+        async with self.store.reader() as reader:
+            cursor = await reader.conn.execute(query)
+            unreferenced = {row[0] for row in await cursor.fetchall()}
+        if not unreferenced:
+            return 0
+
+        # From here on a checkpoint that needs one of these blobs writes it again. The references of
+        # checkpoints serialized before this point are pending until the next flush.
+        serde.forget(unreferenced)
+        async with self.store.saver.lock:
+            # Checkpoints written since the scan may have reused a blob, so check again
+            cursor = await self.store.writer.execute(query)
+            unreferenced &= {row[0] for row in await cursor.fetchall()}
+            unreferenced -= serde.pending_ref_keys()
+            keys = list(unreferenced)
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                await self.store.writer.execute(
+                    f"DELETE FROM blobs WHERE key IN ({','.join('?' * len(batch))})", batch
+                )
+        await self.store.flush()
+        return len(keys)
+
+    async def incremental_vacuum(self) -> int:
+        """Releases up to vacuum_pages free pages, if the database uses incremental auto-vacuum"""
+        writer = self.store.writer
+        cursor = await writer.execute("PRAGMA auto_vacuum")
+        if (await cursor.fetchone())[0] != 2 or self.vacuum_pages <= 0:
+            return 0
+        await self.store.flush()
+        async with self.store.saver.lock:
+            cursor = await writer.execute("PRAGMA freelist_count")
+            free_pages = (await cursor.fetchone())[0]
+            if free_pages:
+                cursor = await writer.execute(f"PRAGMA incremental_vacuum({self.vacuum_pages})")
+                await cursor.fetchall()
+                await writer.execute("PRAGMA wal_checkpoint(PASSIVE)")
+        return min(free_pages, self.vacuum_pages)
+
+
+def disk_usage(db_path: str) -> Dict[str, Any]:
+    """Reports checkpoint counts and bytes per thread, plus file and free space totals"""
+    from blob_store import BlobSerializer
+    from serializers import CompressedSerializer
+
+    serde = BlobSerializer(db_path, serde=CompressedSerializer())
+    conn = sqlite3.connect(db_path)
+    try:
+        threads: Dict[str, Dict[str, Any]] = {}
+        for thread_id, count, size, newest_id in conn.execute(
+            "SELECT thread_id, COUNT(*), SUM(LENGTH(checkpoint) + IFNULL(LENGTH(metadata), 0)), MAX(checkpoint_id) "
+            "FROM checkpoints GROUP BY thread_id"
+        ):
+            threads[thread_id] = {"checkpoints": count, "checkpoint_bytes": size or 0, "writes": 0,
+                                  "write_bytes": 0, "blob_keys": set(), "last_active": checkpoint_time(newest_id)}
+        for thread_id, count, size in conn.execute(
+            "SELECT thread_id, COUNT(*), SUM(IFNULL(LENGTH(value), 0)) FROM writes GROUP BY thread_id"
+        ):
+            thread = threads.setdefault(thread_id, {"checkpoints": 0, "checkpoint_bytes": 0, "blob_keys": set(),
+                                                    "last_active": None})
+            thread.update(writes=count, write_bytes=size or 0)
+        for query in ["SELECT thread_id, type, checkpoint FROM checkpoints", "SELECT thread_id, type, value FROM writes"]:
+            for thread_id, type_, data in conn.execute(query):
+                if type_ and data is not None:
+                    threads[thread_id]["blob_keys"] |= serde.referenced_blobs((type_, data))
+
+        blob_sizes = dict(conn.execute("SELECT key, LENGTH(data) FROM blobs"))
+        for thread in threads.values():
+            thread["blob_bytes"] = sum(blob_sizes.get(key, 0) for key in thread.pop("blob_keys"))
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        return {
+            "threads": threads,
+            "blobs": len(blob_sizes),
+            "blob_bytes": sum(blob_sizes.values()),
+            "file_bytes": os.path.getsize(db_path),
+            "free_bytes": conn.execute("PRAGMA freelist_count").fetchone()[0] * page_size,
+            "auto_vacuum": {0: "none", 1: "full", 2: "incremental"}[conn.execute("PRAGMA auto_vacuum").fetchone()[0]],
+        }
+    finally:
+        conn.close()
+        serde.close()
+
+
+def print_report(usage: Dict[str, Any]):
+    print(f"{'thread':<38} {'checkpoints':>11} {'writes':>7} {'checkpoint KB':>14} {'write KB':>9} {'blob KB':>8}  last active")
+    threads = sorted(usage["threads"].items(), key=lambda item: item[1]["last_active"] or 0, reverse=True)
+    for thread_id, thread in threads:
+        last_active = time.strftime("%Y-%m-%d %H:%M", time.localtime(thread["last_active"])) if thread["last_active"] else "-"
+        print(f"{thread_id:<38} {thread['checkpoints']:>11} {thread['writes']:>7} "
+              f"{thread['checkpoint_bytes'] / 1024:>14,.1f} {thread['write_bytes'] / 1024:>9,.1f} "
+              f"{thread['blob_bytes'] / 1024:>8,.1f}  {last_active}")
+    print(f"\n{len(threads)} threads, {usage['blobs']} blobs ({usage['blob_bytes'] / 1024:,.1f} KB), "
+          f"file {usage['file_bytes'] / 1024:,.1f} KB, free {usage['free_bytes'] / 1024:,.1f} KB, "
+          f"auto_vacuum={usage['auto_vacuum']}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default="memory.db")
+    parser.add_argument("--prune", action="store_true", help="Run one retention pass before reporting")
+    parser.add_argument("--vacuum", action="store_true",
+                        help="Fully vacuum the database and switch it to incremental auto-vacuum (run while the app is stopped)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        parser.error(f"{args.db} does not exist")
+    if args.prune:
+        from checkpoint_store import CheckpointStore
+
+        store = await CheckpointStore.shared(args.db)
+        try:
+            stats = await store.retention.run_once()
+        finally:
+            await store.release()
+        print(", ".join(f"{name.replace('_', ' ')}: {value}" for name, value in stats.items()) + "\n")
+    if args.vacuum:
+        conn = sqlite3.connect(args.db, isolation_level=None)
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+        conn.close()
+    print_report(disk_usage(args.db))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -34,14 +34,21 @@ def create_route_after_wait_for_user():
     return route_after_wait_for_user
 
 
-def create_route_after_planner():
+def plan_rejected(state: Dict[str, Any]) -> bool:
+    """Whether the plan-quality evaluation asks for a new plan"""
+    score = state.get("plan_quality_score")
+    return state.get("plan_needs_refinement", False) or (score is not None and score < 0.6)
+
+
+def create_route_after_planner(optimistic_plan_check: bool = False):
     """Creates route_after_planner function"""
     def route_after_planner(state: State) -> str:
-        """Routes after planner - conditionally to plan_quality_evaluator or workers"""
-        if state.get("plan_quality_check_enabled", False):
+        """Routes after planner - conditionally to plan_quality_evaluator or dag_scheduler"""
+        # In optimistic mode the scheduler checks the plan while its first subtasks run
+        if state.get("plan_quality_check_enabled", False) and not optimistic_plan_check:
             return "plan_quality_evaluator"
         else:
-            return "parallel_worker_group"
+            return "dag_scheduler"
     
     return route_after_planner
 
@@ -50,45 +57,42 @@ def create_route_after_plan_quality():
     """Creates route_after_plan_quality function"""
     def route_after_plan_quality(state: State) -> str:
         """Routes after plan quality evaluation"""
-        if state.get("plan_needs_refinement", False) or state.get("plan_quality_score", 1.0) < 0.6:
+        if plan_rejected(state):
             return "planner"
         else:
-            return "parallel_worker_group"
+            return "dag_scheduler"
     
     return route_after_plan_quality
 
 
-def create_move_to_next_group():
-    """Creates move_to_next_group function"""
-    def move_to_next_group(state: State) -> Dict[str, Any]:
-        """Moves to the next parallel group"""
-        current = state.get("current_parallel_group", 0)
-        total_groups = len(state.get("parallel_groups", []))
-        
-        if current < total_groups - 1:
-            return {
-                "current_parallel_group": current + 1
-            }
-        return {}
+def create_route_after_dag_scheduler():
+    """Creates route_after_dag_scheduler function"""
+    def route_after_dag_scheduler(state: State) -> str:
+        """Routes after the scheduler - back to the planner if the plan was rejected while it ran"""
+        if plan_rejected(state):
+            return "planner"
+        return "collector"
     
-    return move_to_next_group
+    return route_after_dag_scheduler
 
 
-def create_route_after_per_task_evaluation():
+def create_route_after_per_task_evaluation(max_subtask_retries: int):
     """Creates route_after_per_task_evaluation function"""
     def route_after_per_task_evaluation(state: State) -> str:
         """Routes after per-task evaluation"""
         task_eval_results = state.get("task_evaluation_results", {})
-        current_group = state["parallel_groups"][state["current_parallel_group"]]
+        task_plan = state.get("task_plan") or []
+        retry_counts = state.get("subtask_retry_counts") or {}
         
-        needs_refinement = False
-        for idx in current_group:
-            eval_result = task_eval_results.get(idx, {})
-            if not eval_result.get("is_complete", False):
-                needs_refinement = True
-                break
-
-        if needs_refinement:
+        failed = [
+            idx for idx in range(len(task_plan))
+            if not task_eval_results.get(idx, {}).get("is_complete", False)
+        ]
+
+        if failed:
+            # Retry only the failed subtasks until one of them runs out of retries
+            if all(retry_counts.get(idx, 0) < max_subtask_retries for idx in failed):
+                return "retry_failed_subtasks"
             return "planner"
         
         if state.get("all_tasks_complete", False):
@@ -127,6 +131,10 @@ def create_route_from_start():
         if questions and len(questions) >= 3:
             return "wait_for_user"
         
+        # Set by the triage node; simple requests skip planning
+        if state.get("request_complexity") == "simple":
+            return "worker"
+        
         return "planner"
     
     return route_from_start
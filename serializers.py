@@ -0,0 +1,77 @@
+import os
+import zlib
+from typing import Any, Callable, Dict, Optional, Tuple
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+
+checkpoint_compression = os.getenv("CHECKPOINT_COMPRESSION", "auto").lower()
+checkpoint_compression_threshold = int(os.getenv("CHECKPOINT_COMPRESSION_THRESHOLD", "2048"))
+
+
+def available_codecs() -> Dict[str, Tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]]]:
+    """Returns the (compress, decompress) pairs for every codec that can be imported"""
+    codecs = {"zlib": (lambda data: zlib.compress(data, 1), zlib.decompress)}
+    if lz4 is not None:
+        codecs["lz4"] = (lz4.frame.compress, lz4.frame.decompress)
+    if zstandard is not None:
+        compressor = zstandard.ZstdCompressor(level=3)
+        decompressor = zstandard.ZstdDecompressor()
+        codecs["zstd"] = (compressor.compress, decompressor.decompress)
+    return codecs
+
+
+def resolve_codec(name: str) -> Optional[str]:
+    """Picks the codec to write with; "auto" prefers zstd, then lz4, then zlib"""
+    codecs = available_codecs()
+    if name == "none":
+        return None
+    if name == "auto":
+        return next(codec for codec in ("zstd", "lz4", "zlib") if codec in codecs)
+    if name not in codecs:
+        print(f"Warning: Compression codec {name} is not installed. Falling back to zlib.")
+        return "zlib"
+    return name
+
+
+class CompressedSerializer:
+    """Serializer that compresses large payloads of an inner serializer.
+
+    Payloads of at least threshold bytes are compressed and tagged by appending
+    the codec to their type (e.g. "msgpack+zstd"). Smaller payloads skip
+    compression entirely, and untagged payloads written before compression was
+    enabled load unchanged.
+    """
+    def __init__(self, serde=None, codec: str = checkpoint_compression,
+                 threshold: int = checkpoint_compression_threshold):
+        self.serde = serde or JsonPlusSerializer()
+        self.codecs = available_codecs()
+        self.codec = resolve_codec(codec)
+        self.threshold = threshold
+
+    def dumps_typed(self, obj: Any) -> Tuple[str, bytes]:
+        type_, data = self.serde.dumps_typed(obj)
+        if self.codec is None or len(data) < self.threshold:
+            return type_, data
+        compressed = self.codecs[self.codec][0](data)
+        if len(compressed) >= len(data):
+            return type_, data
+        return f"{type_}+{self.codec}", compressed
+
+    def loads_typed(self, data: Tuple[str, bytes]) -> Any:
+        type_, payload = data
+        if "+" in type_:
+            type_, codec = type_.rsplit("+", 1)
+            if codec not in self.codecs:
+                raise ValueError(f"Checkpoint was compressed with {codec}, which is not installed")
+            payload = self.codecs[codec][1](payload)
+        return self.serde.loads_typed((type_, payload))
@@ -1,13 +1,13 @@
 from langgraph.graph import StateGraph, START, END
 from dotenv import load_dotenv
-from langgraph.prebuilt import ToolNode
-from langchain_openai import ChatOpenAI
 from langchain_core.messages import AIMessage, HumanMessage
 from typing import List, Any
-from tools import playwright_tools, other_tools
+import asyncio
+import os
 import uuid
-import aiosqlite
-from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+from resources import SharedResources
+from cache import CachedStructuredLLM
+from rate_limiter import RateLimitedLLM
 
 # Import models and state
 from models import (
@@ -16,25 +16,33 @@ from models import (
     PlannerOutput,
     PlanQualityEvaluation,
     PerTaskEvaluation,
-    OverallEvaluation
+    OverallEvaluation,
+    PlanRevisionCheck,
+    ComplexityAssessment
 )
 from state import State
 
 # Import node creators
 from nodes.clarifier import create_clarifier_node, create_wait_for_user_node
-from nodes.planner import create_planner_node
+from nodes.planner import create_planner_node, create_plan_revision_check
 from nodes.workers import (
     create_worker_node,
+    create_tools_node,
     create_process_subtask_node,
-    create_parallel_worker_group_node
+    create_dag_scheduler_node,
+    create_retry_failed_subtasks_node,
+    create_result_digester,
+    create_speculative_research_node
 )
 from nodes.evaluators import (
     create_evaluator_node,
     create_plan_quality_evaluator_node,
     create_per_task_evaluator_node,
+    create_subtask_evaluator,
     create_overall_evaluator_node
 )
 from nodes.collector import create_collector_node
+from nodes.triage import create_triage_node
 
 # Import routing functions
 from routing import (
@@ -42,7 +50,7 @@ from routing import (
     create_route_after_wait_for_user,
     create_route_after_planner,
     create_route_after_plan_quality,
-    create_move_to_next_group,
+    create_route_after_dag_scheduler,
     create_route_after_per_task_evaluation,
     create_route_after_overall_evaluation,
     create_route_from_start,
@@ -51,6 +59,13 @@ from routing import (
 
 load_dotenv(override=True)
 
+speculative_planning = os.getenv("SPECULATIVE_PLANNING", "true").lower() != "false"
+speculative_subtasks = os.getenv("SPECULATIVE_SUBTASKS", "false").lower() == "true"
+optimistic_plan_check = os.getenv("PLAN_QUALITY_OPTIMISTIC", "true").lower() != "false"
+plan_semantic_review = os.getenv("PLAN_SEMANTIC_REVIEW", "true").lower() != "false"
+fast_path = os.getenv("FAST_PATH", "true").lower() != "false"
+fast_path_model_check = os.getenv("FAST_PATH_MODEL_CHECK", "true").lower() != "false"
+
 
 class Sidekick:
     def __init__(self):
@@ -61,98 +76,163 @@ class Sidekick:
         self.plan_quality_evaluator_llm_with_output = None
         self.per_task_evaluator_llm_with_output = None
         self.overall_evaluator_llm_with_output = None
+        self.digest_llm = None
+        self.plan_revision_llm_with_output = None
+        self.complexity_llm_with_output = None
         self.tools = None
         self.llm_with_tools = None
         self.graph = None
         self.clarifier = None  # Store clarifier node function for direct access
+        self.speculation_graph = None
+        self.speculative_research_graph = None
+        self.check_plan_revision = None
+        self.release_browser = None
+        self.speculation = None
         self.sidekick_id = str(uuid.uuid4())
-        self.browser = None
-        self.playwright = None
+        self.resources = None
+        self.browser_pool = None
         self.db_path = "memory.db"
+        self.checkpoint_store = None
+        self.max_subtask_retries = 2
+        self.response_cache = None
+        self.tool_cache = None
+        # Nodes whose responses are memoized in the response cache
+        self.response_cache_nodes = {
+            "evaluator": False,
+            "clarifier": True,
+            "planner": True,
+            "plan_quality": True,
+            "per_task": True,
+            "overall": True,
+            "plan_revision": True,
+            "complexity": True,
+            "digest": True,
+        }
 
     async def setup(self):
-        raw_conn = await aiosqlite.connect(self.db_path)
-        class ConnectionWrapper:
-            def __init__(self, conn):
-                self._conn = conn
-            
-            def is_alive(self):
-                try:
-                    return hasattr(self._conn, '_connection') and self._conn._connection is not None
-                except:
-                    return False
-            
-            def __getattr__(self, name):
-                return getattr(self._conn, name)
-        
-        self.db_conn = ConnectionWrapper(raw_conn)
-        self.sqlite_memory = AsyncSqliteSaver(self.db_conn)
-        
-        self.tools, self.browser, self.playwright = await playwright_tools()
-        self.tools += await other_tools()
-        worker_llm = ChatOpenAI(model="gpt-4o-mini")
-        self.worker_llm_with_tools = worker_llm.bind_tools(self.tools)
-        evaluator_llm = ChatOpenAI(model="gpt-4o-mini")
-        self.evaluator_llm_with_output = evaluator_llm.with_structured_output(EvaluatorOutput)
-        clarifier_llm = ChatOpenAI(model="gpt-4o-mini")
-        self.clarifier_llm_with_output = clarifier_llm.with_structured_output(ClarifierOutput)
-        planner_llm = ChatOpenAI(model="gpt-4o-mini")
-        self.planner_llm_with_output = planner_llm.with_structured_output(PlannerOutput)
-        plan_quality_llm = ChatOpenAI(model="gpt-4o-mini")
-        self.plan_quality_evaluator_llm_with_output = plan_quality_llm.with_structured_output(PlanQualityEvaluation)
-        per_task_llm = ChatOpenAI(model="gpt-4o-mini")
-        self.per_task_evaluator_llm_with_output = per_task_llm.with_structured_output(PerTaskEvaluation)
-        overall_llm = ChatOpenAI(model="gpt-4o-mini")
-        self.overall_evaluator_llm_with_output = overall_llm.with_structured_output(OverallEvaluation)
+        self.resources = await SharedResources.shared(self.db_path)
+        self.checkpoint_store = self.resources.checkpoint_store
+        self.sqlite_memory = self.checkpoint_store.saver
+        self.response_cache = self.resources.response_cache
+        self.tool_cache = self.resources.tool_cache
+        self.tools = self.resources.tools
+        self.browser_pool = self.resources.browser_pool
         
+        # Sessions with the same settings share the bound LLMs and the compiled graph
+        template_key = (self.max_subtask_retries, tuple(sorted(self.response_cache_nodes.items())))
+        template = await self.resources.template(template_key, self.build_template)
+        for name, value in template.items():
+            setattr(self, name, value)
+
+    async def build_template(self):
+        """Binds each node's LLM to the shared client for its routed model and compiles the graph"""
+        router = self.resources.model_router
+        limiter = self.resources.rate_limiter
+        self.worker_llm_with_tools = router.route(
+            "worker", lambda model: RateLimitedLLM(self.resources.llm_for(model).bind_tools(self.tools), limiter)
+        )
+        self.evaluator_llm_with_output = self.structured_output("evaluator", EvaluatorOutput)
+        self.clarifier_llm_with_output = self.structured_output("clarifier", ClarifierOutput)
+        self.planner_llm_with_output = self.structured_output("planner", PlannerOutput)
+        self.plan_quality_evaluator_llm_with_output = self.structured_output("plan_quality", PlanQualityEvaluation)
+        self.per_task_evaluator_llm_with_output = self.structured_output("per_task", PerTaskEvaluation)
+        self.overall_evaluator_llm_with_output = self.structured_output("overall", OverallEvaluation)
+        self.plan_revision_llm_with_output = self.structured_output("plan_revision", PlanRevisionCheck)
+        self.complexity_llm_with_output = self.structured_output("complexity", ComplexityAssessment)
+        self.digest_llm = router.route("digest", lambda model: RateLimitedLLM(self.resources.llm_for(model), limiter))
+
         await self.build_graph()
+        return {
+            name: getattr(self, name) for name in (
+                "worker_llm_with_tools", "evaluator_llm_with_output", "clarifier_llm_with_output",
+                "planner_llm_with_output", "plan_quality_evaluator_llm_with_output",
+                "per_task_evaluator_llm_with_output", "overall_evaluator_llm_with_output",
+                "plan_revision_llm_with_output", "complexity_llm_with_output", "digest_llm", "graph", "clarifier",
+                "speculation_graph", "speculative_research_graph", "check_plan_revision", "release_browser",
+            )
+        }
+
+    def structured_output(self, node_name, schema):
+        """Binds a structured output schema to the node's routed model or cascade, memoizing responses if caching is enabled for the node"""
+        router = self.resources.model_router
+
+        def bind(model):
+            llm_with_output = self.resources.llm_for(model).with_structured_output(schema)
+            # Cache hits are answered without waiting for the rate limiter
+            return RateLimitedLLM(llm_with_output, self.resources.rate_limiter)
+
+        llm_with_output = router.route(node_name, bind)
+        if self.response_cache and self.response_cache_nodes.get(node_name, False):
+            model_name = ">".join(router.models_for(node_name))
+            return CachedStructuredLLM(llm_with_output, self.response_cache, model_name, schema)
+        return llm_with_output
+
+    def model_stats(self):
+        """Returns call counts, escalation rates and per-model latency for each routed node"""
+        return self.resources.model_router.stats() if self.resources else {}
 
     async def build_graph(self):
         graph_builder = StateGraph(State)
 
         # Create routing functions
-        move_to_next_group = create_move_to_next_group()
         route_from_start = create_route_from_start()
         route_after_wait_for_user = create_route_after_wait_for_user()
-        route_after_planner = create_route_after_planner()
+        route_after_planner = create_route_after_planner(optimistic_plan_check)
         route_after_plan_quality = create_route_after_plan_quality()
-        route_after_per_task_evaluation = create_route_after_per_task_evaluation()
+        route_after_dag_scheduler = create_route_after_dag_scheduler()
+        route_after_per_task_evaluation = create_route_after_per_task_evaluation(self.max_subtask_retries)
         route_after_overall_evaluation = create_route_after_overall_evaluation()
         route_based_on_evaluation = create_route_based_on_evaluation()
         worker_router = create_worker_router()
 
         # Create node functions
+        triage = create_triage_node(self.complexity_llm_with_output if fast_path_model_check else None, fast_path)
         worker = create_worker_node(self.worker_llm_with_tools)
+        tools, self.release_browser = create_tools_node(self.tools, self.browser_pool)
         evaluator = create_evaluator_node(self.evaluator_llm_with_output)
         clarifier = create_clarifier_node(self.clarifier_llm_with_output)
         self.clarifier = clarifier  # Store for direct access from UI
         wait_for_user = create_wait_for_user_node()
-        planner = create_planner_node(self.planner_llm_with_output, move_to_next_group)
-        plan_quality_evaluator = create_plan_quality_evaluator_node(self.plan_quality_evaluator_llm_with_output)
-        process_subtask = create_process_subtask_node(self.worker_llm_with_tools, self.tools)
-        parallel_worker_group = create_parallel_worker_group_node(process_subtask)
+        planner = create_planner_node(self.planner_llm_with_output)
+        plan_quality_evaluator = create_plan_quality_evaluator_node(
+            self.plan_quality_evaluator_llm_with_output, plan_semantic_review
+        )
+        digest_cache = self.response_cache if self.response_cache_nodes.get("digest", False) else None
+        digest_result = create_result_digester(self.digest_llm, digest_cache)
+        process_subtask = create_process_subtask_node(
+            self.worker_llm_with_tools, self.tools, self.browser_pool, digest_result
+        )
+        evaluate_subtask = create_subtask_evaluator(self.per_task_evaluator_llm_with_output)
+        dag_scheduler = create_dag_scheduler_node(
+            process_subtask, evaluate_subtask, digest_result,
+            plan_quality_evaluator if optimistic_plan_check else None
+        )
+        retry_failed_subtasks = create_retry_failed_subtasks_node(self.max_subtask_retries)
         collector = create_collector_node()
         per_task_evaluator = create_per_task_evaluator_node(self.per_task_evaluator_llm_with_output)
         overall_evaluator = create_overall_evaluator_node(self.overall_evaluator_llm_with_output)
 
         # Add nodes to graph
+        graph_builder.add_node("triage", triage)
         graph_builder.add_node("worker", worker)
-        graph_builder.add_node("tools", ToolNode(tools=self.tools))
+        graph_builder.add_node("tools", tools)
         graph_builder.add_node("evaluator", evaluator)
         graph_builder.add_node("clarifier", clarifier)
         graph_builder.add_node("wait_for_user", wait_for_user)
         graph_builder.add_node("planner", planner)
         graph_builder.add_node("plan_quality_evaluator", plan_quality_evaluator)
-        graph_builder.add_node("parallel_worker_group", parallel_worker_group)
+        graph_builder.add_node("dag_scheduler", dag_scheduler)
+        graph_builder.add_node("retry_failed_subtasks", retry_failed_subtasks)
         graph_builder.add_node("collector", collector)
         graph_builder.add_node("per_task_evaluator", per_task_evaluator)
         graph_builder.add_node("overall_evaluator", overall_evaluator)
 
         # Add edges
+        graph_builder.add_edge(START, "triage")
         graph_builder.add_conditional_edges(
-            START,
+            "triage",
             route_from_start,
-            {"clarifier": "clarifier", "planner": "planner"}
+            {"clarifier": "clarifier", "planner": "planner", "worker": "worker"}
         )
         
         graph_builder.add_edge("clarifier", "wait_for_user")
@@ -166,25 +246,31 @@ class Sidekick:
         graph_builder.add_conditional_edges(
             "planner",
             route_after_planner,
-            {"plan_quality_evaluator": "plan_quality_evaluator", "parallel_worker_group": "parallel_worker_group"}
+            {"plan_quality_evaluator": "plan_quality_evaluator", "dag_scheduler": "dag_scheduler"}
         )
         
         graph_builder.add_conditional_edges(
             "plan_quality_evaluator",
             route_after_plan_quality,
-            {"planner": "planner", "parallel_worker_group": "parallel_worker_group"}
+            {"planner": "planner", "dag_scheduler": "dag_scheduler"}
         )
         
-        graph_builder.add_edge("parallel_worker_group", "collector")
+        graph_builder.add_conditional_edges(
+            "dag_scheduler",
+            route_after_dag_scheduler,
+            {"planner": "planner", "collector": "collector"}
+        )
         
         graph_builder.add_edge("collector", "per_task_evaluator")
         
         graph_builder.add_conditional_edges(
             "per_task_evaluator",
             route_after_per_task_evaluation,
-            {"planner": "planner", "overall_evaluator": "overall_evaluator"}
+            {"planner": "planner", "retry_failed_subtasks": "retry_failed_subtasks", "overall_evaluator": "overall_evaluator"}
         )
         
+        graph_builder.add_edge("retry_failed_subtasks", "dag_scheduler")
+        
         graph_builder.add_conditional_edges(
             "overall_evaluator",
             route_after_overall_evaluation,
@@ -201,7 +287,92 @@ class Sidekick:
 
         self.graph = graph_builder.compile(checkpointer=self.sqlite_memory)
 
-    async def run_superstep(self, message, success_criteria, history, clarification_answers=None):
+        # Plans, and optionally researches, a request while the user answers the clarifying questions.
+        # The research runs as a separate step, so the plan can be checked as soon as it is ready.
+        speculation_builder = StateGraph(State)
+        speculation_builder.add_node("planner", planner)
+        speculation_builder.add_edge(START, "planner")
+        speculation_builder.add_edge("planner", END)
+        self.speculation_graph = speculation_builder.compile()
+        if speculative_subtasks:
+            research_builder = StateGraph(State)
+            research_builder.add_node(
+                "speculative_research", create_speculative_research_node(process_subtask, evaluate_subtask)
+            )
+            research_builder.add_edge(START, "speculative_research")
+            research_builder.add_edge("speculative_research", END)
+            self.speculative_research_graph = research_builder.compile()
+        if self.plan_revision_llm_with_output:
+            self.check_plan_revision = create_plan_revision_check(self.plan_revision_llm_with_output)
+
+    def speculate(self, message, success_criteria):
+        """Starts planning the request in the background, to be picked up when the user presses Go"""
+        self.cancel_speculation()
+        if not speculative_planning or not self.speculation_graph:
+            return
+        _, _, state = self.prepare_superstep(message, success_criteria)
+        plan = asyncio.create_task(self.speculation_graph.ainvoke(state))
+        task = asyncio.create_task(self.research_speculatively(plan)) if self.speculative_research_graph else plan
+        for future in {plan, task}:
+            # Mark failures as retrieved; apply_speculation reports them if the plan is ever needed
+            future.add_done_callback(lambda done: done.cancelled() or done.exception())
+        self.speculation = {"request": (message, state["success_criteria"]), "plan": plan, "task": task}
+
+    async def research_speculatively(self, plan: asyncio.Task):
+        """Runs the research subtasks of the speculative plan once it is ready"""
+        # Shielded so dropping the research does not cancel the plan
+        planned = await asyncio.shield(plan)
+        return await self.speculative_research_graph.ainvoke(planned)
+
+    def cancel_speculation(self):
+        if self.speculation:
+            self.speculation["plan"].cancel()
+            self.speculation["task"].cancel()
+            self.speculation = None
+
+    async def apply_speculation(self, config, state) -> bool:
+        """Seeds the thread with the speculative plan if it still fits the request and answers.
+
+        Returns True if the graph should resume after the planner instead of starting from state.
+        """
+        if not self.speculation:
+            return False
+        speculation = self.speculation
+        request = (state["messages"][0].content, state["success_criteria"])
+        if speculation["request"] != request:
+            self.cancel_speculation()
+            return False
+        self.speculation = None
+        try:
+            # Only the plan is awaited before the check; research still running is dropped if it is revised
+            planned = await speculation["plan"]
+            answers = state["clarification_answers"]
+            if answers and (not self.check_plan_revision or await self.check_plan_revision(
+                request[0], planned["task_plan"], answers
+            )):
+                speculation["task"].cancel()
+                return False
+        except Exception as e:
+            speculation["task"].cancel()
+            print(f"Warning: Speculative plan could not be used, planning again: {e}")
+            return False
+        try:
+            result = await speculation["task"]
+        except Exception as e:
+            print(f"Warning: Speculative research failed, keeping only the plan: {e}")
+            result = planned
+
+        # The speculative run started from the same initial state, apart from the answers
+        values = {
+            **result,
+            "clarification_answers": state["clarification_answers"],
+            "clarification_complete": state["clarification_complete"],
+        }
+        await self.graph.aupdate_state(config, values, as_node="planner")
+        return True
+
+    def prepare_superstep(self, message, success_criteria, clarification_answers=None):
+        """Builds the config, input messages and initial state for a superstep"""
         config = {
             "configurable": {"thread_id": self.sidekick_id},
             "recursion_limit": 100
@@ -224,6 +395,7 @@ class Sidekick:
             "feedback_on_work": None,
             "success_criteria_met": False,
             "user_input_needed": False,
+            "request_complexity": None,
             "clarification_questions": None,
             "clarification_answers": valid_answers,
             "clarification_complete": clarification_complete,
@@ -234,19 +406,33 @@ class Sidekick:
             "all_tasks_complete": False,
             "planning_complete": False,
             "plan_quality_score": None,
+            "plan_quality_feedback": None,
             "plan_needs_refinement": False,
             "plan_quality_check_enabled": True,
+            "plan_validation": None,
             "task_evaluation_results": {},
+            "subtask_retry_counts": {},
             "overall_evaluation_score": None,
         }
+        return config, messages, state
+
+    async def run_superstep(self, message, success_criteria, history, clarification_answers=None):
+        config, messages, state = self.prepare_superstep(message, success_criteria, clarification_answers)
+        speculated = await self.apply_speculation(config, state)
         
-        result = await self.graph.ainvoke(state, config=config)
+        try:
+            result = await self.graph.ainvoke(None if speculated else state, config=config)
+        finally:
+            await self.release_browser(self.sidekick_id)
         
         final_messages = result.get("messages", [])
         if final_messages:
             user = {"role": "user", "content": message if isinstance(message, str) else messages[0].content}
             last_assistant_msg = None
             for msg in reversed(final_messages):
+                # In the worker loop, show the worker's answer rather than the evaluator's feedback on it
+                if isinstance(msg, AIMessage) and msg.name == "evaluator":
+                    continue
                 if isinstance(msg, dict) and msg.get("role") == "assistant":
                     last_assistant_msg = msg
                     break
@@ -261,20 +447,67 @@ class Sidekick:
         
         return history
 
-    async def cleanup(self):
-        if self.browser:
-            try:
-                await self.browser.close()
-                if self.playwright:
-                    await self.playwright.stop()
-            except Exception as e:
-                print(f"Error closing browser/playwright: {e}")
+    async def stream_superstep(self, message, success_criteria, history, clarification_answers=None):
+        """Runs a superstep like run_superstep, yielding the chat history as progress and tokens arrive"""
+        config, messages, state = self.prepare_superstep(message, success_criteria, clarification_answers)
+        user = {"role": "user", "content": message if isinstance(message, str) else messages[0].content}
+        
+        progress = []
+        streams = {}
+        last_assistant_msg = None
+        speculated = await self.apply_speculation(config, state)
+        if speculated:
+            progress.append("Using the plan prepared while the clarifying questions were open")
         
-        if hasattr(self, 'db_conn') and self.db_conn:
+        try:
+            async for mode, chunk in self.graph.astream(None if speculated else state, config=config,
+                                                        stream_mode=["updates", "messages", "custom"]):
+                if mode == "messages":
+                    message_chunk, metadata = chunk
+                    # Only stream worker tokens; structured-output nodes would stream raw JSON
+                    source = next((tag for tag in metadata.get("tags", []) if tag.startswith("subtask:")), None)
+                    if source is None and metadata.get("langgraph_node") == "worker":
+                        source = "worker"
+                    if source and isinstance(message_chunk.content, str) and message_chunk.content:
+                        streams[source] = streams.get(source, "") + message_chunk.content
+                elif mode == "custom":
+                    # Metrics events such as subtask_context carry no content for the chat
+                    if chunk.get("content"):
+                        progress.append(chunk["content"])
+                    if chunk.get("event") == "subtask_finished":
+                        streams.pop(f"subtask:{chunk['subtask_index']}", None)
+                elif mode == "updates":
+                    for node_name, update in chunk.items():
+                        for msg in (update or {}).get("messages", []) if isinstance(update, dict) else []:
+                            if isinstance(msg, dict) and msg.get("role") == "assistant":
+                                content = msg.get("content", "")
+                            elif isinstance(msg, AIMessage) and msg.content:
+                                content = msg.content
+                            else:
+                                continue
+                            if node_name != "evaluator":
+                                last_assistant_msg = {"role": "assistant", "content": content}
+                            progress.append(f"**{node_name}**: {content.splitlines()[0] if content else ''}")
+                        if node_name == "worker":
+                            streams.pop("worker", None)
+            
+                rendered = "\n".join(f"- {line}" for line in progress)
+                for source, text in streams.items():
+                    rendered += f"\n\n*{source}* …{text[-500:]}"
+                yield history + [user, {"role": "assistant", "content": rendered or "Processing..."}]
+        finally:
+            # The worker loop keeps its browser context for the whole run
+            await self.release_browser(self.sidekick_id)
+
+        yield history + [user, last_assistant_msg or {"role": "assistant", "content": "Processing..."}]
+
+    async def cleanup(self):
+        self.cancel_speculation()
+        if self.release_browser:
+            await self.release_browser(self.sidekick_id)
+        if self.resources:
             try:
-                if hasattr(self.db_conn, '_conn'):
-                    await self.db_conn._conn.close()
-                else:
-                    await self.db_conn.close()
+                await self.resources.release()
+                self.resources = None
             except Exception as e:
-                print(f"Error closing database connection: {e}")
+                print(f"Error releasing shared resources: {e}")
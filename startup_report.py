@@ -0,0 +1,77 @@
+"""Reports where Sidekick's cold start goes: module imports, then session setup.
+
+Run with `python app.py --startup-report`, which prints the report instead of
+starting the UI.
+"""
+import asyncio
+import importlib
+import resource
+import sys
+import time
+
+
+# Imported in order, so each line shows what the module adds on top of the ones before it
+STARTUP_MODULES = [
+    "gradio",
+    "langgraph.graph",
+    "langchain_openai",
+    "playwright.async_api",
+    "tools",
+    "sidekick",
+]
+
+
+def time_imports():
+    timings = []
+    for module in STARTUP_MODULES:
+        start = time.perf_counter()
+        try:
+            importlib.import_module(module)
+            timings.append((module, time.perf_counter() - start, None))
+        except Exception as e:
+            timings.append((module, time.perf_counter() - start, e))
+    return timings
+
+
+async def time_sessions():
+    from sidekick import Sidekick
+
+    timings = []
+    sessions = []
+    for label in ("first session setup", "second session setup"):
+        start = time.perf_counter()
+        session = Sidekick()
+        await session.setup()
+        timings.append((label, time.perf_counter() - start))
+        sessions.append(session)
+
+    resources = sessions[0].resources
+    browser_launched = resources.browser is not None and resources.browser.browser is not None
+    resources.idle_timeout = 0
+    for session in sessions:
+        await session.cleanup()
+    return timings, browser_launched
+
+
+def print_startup_report():
+    started = time.perf_counter()
+    print("Imports")
+    for module, elapsed, error in time_imports():
+        status = f"  failed: {error}" if error else ""
+        print(f"  {module:<40} {elapsed * 1000:>8.0f} ms{status}")
+    # The toolkits load when a session first builds its tools, not on import
+    toolkits_imported = "langchain_community" in sys.modules
+    print(f"  {'langchain_community imported':<40} {'yes' if toolkits_imported else 'no (on setup)':>11}")
+
+    print("Setup")
+    try:
+        timings, browser_launched = asyncio.run(time_sessions())
+        for label, elapsed in timings:
+            print(f"  {label:<40} {elapsed * 1000:>8.1f} ms")
+        print(f"  {'browser launched':<40} {'yes' if browser_launched else 'no (on first use)':>11}")
+    except Exception as e:
+        print(f"  setup failed: {e}")
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_rss_mb = peak_rss / (1024 * 1024) if sys.platform == "darwin" else peak_rss / 1024
+    print(f"\nReady in {time.perf_counter() - started:.2f}s, peak memory {peak_rss_mb:.0f} MB")
@@ -9,6 +9,7 @@ class State(TypedDict):
     feedback_on_work: Optional[str]
     success_criteria_met: bool
     user_input_needed: bool
+    request_complexity: Optional[str]
     clarification_questions: Optional[List[str]]
     clarification_answers: Optional[List[str]]
     clarification_complete: bool
@@ -19,8 +20,11 @@ class State(TypedDict):
     all_tasks_complete: bool
     planning_complete: bool
     plan_quality_score: Optional[float]
+    plan_quality_feedback: Optional[str]
     plan_needs_refinement: bool
     plan_quality_check_enabled: bool
+    plan_validation: Optional[Dict[str, Any]]
     task_evaluation_results: Optional[Dict[int, Dict[str, Any]]]
+    subtask_retry_counts: Optional[Dict[int, int]]
     overall_evaluation_score: Optional[float]
 
@@ -0,0 +1,124 @@
+import asyncio
+from langchain_core.messages import HumanMessage
+from cache import CachedStructuredLLM, ResponseCache
+from models import PlannerOutput, PlanQualityEvaluation, Subtask
+from nodes.evaluators import create_plan_quality_evaluator_node
+from nodes.planner import create_planner_node
+from routing import plan_rejected
+
+
+def run_with_cache(tmp_path, test):
+    async def run():
+        cache = ResponseCache(str(tmp_path / "response_cache.db"))
+        await cache.setup()
+        try:
+            await test(cache)
+        finally:
+            await cache.close()
+
+    asyncio.run(run())
+
+
+def test_cancelling_the_first_caller_does_not_cancel_the_others(tmp_path):
+    async def test(cache):
+        calls = 0
+        release = asyncio.Event()
+
+        async def compute():
+            nonlocal calls
+            calls += 1
+            await release.wait()
+            return "value"
+
+        leader = asyncio.create_task(cache.get_or_compute("key", compute, dumps=str, loads=str))
+        await asyncio.sleep(0.01)
+        follower = asyncio.create_task(cache.get_or_compute("key", compute, dumps=str, loads=str))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        await asyncio.sleep(0.01)
+        release.set()
+
+        assert await follower == "value"
+        assert leader.cancelled()
+        assert calls == 1
+        assert await cache.get("key") == "value"
+
+    run_with_cache(tmp_path, test)
+
+
+def test_failed_lookup_is_retried_by_the_next_caller(tmp_path):
+    async def test(cache):
+        attempts = 0
+
+        async def compute():
+            nonlocal attempts
+            attempts += 1
+            if attempts == 1:
+                raise RuntimeError("upstream error")
+            return "value"
+
+        try:
+            await cache.get_or_compute("key", compute, dumps=str, loads=str)
+        except RuntimeError:
+            pass
+        assert cache.stats()["in_flight"] == 0
+        assert await cache.get_or_compute("key", compute, dumps=str, loads=str) == "value"
+        assert attempts == 2
+
+    run_with_cache(tmp_path, test)
+
+
+class FakeStructuredLLM:
+    def __init__(self, answer):
+        self.answer = answer
+        self.calls = 0
+
+    async def ainvoke(self, messages, *args, **kwargs):
+        self.calls += 1
+        return self.answer(self.calls)
+
+
+def test_rejected_plan_is_planned_and_reviewed_again_upstream(tmp_path):
+    async def test(cache):
+        planner_llm = FakeStructuredLLM(lambda call: PlannerOutput(
+            subtasks=[
+                Subtask(description="research", success_criteria="facts"),
+                Subtask(description="write", success_criteria="report", dependencies=[0]),
+            ],
+            parallel_groups=[[0], [1]],
+            reasoning="same plan every time",
+        ))
+        review_llm = FakeStructuredLLM(lambda call: PlanQualityEvaluation(
+            plan_quality_score=0.3 if call == 1 else 0.9,
+            plan_needs_refinement=call == 1,
+            feedback="split the research" if call == 1 else "good",
+        ))
+        planner = create_planner_node(CachedStructuredLLM(planner_llm, cache, "model", PlannerOutput))
+        plan_quality_evaluator = create_plan_quality_evaluator_node(
+            CachedStructuredLLM(review_llm, cache, "model", PlanQualityEvaluation)
+        )
+        state = {
+            "messages": [HumanMessage(content="Write a report")],
+            "success_criteria": "A report",
+            "clarification_answers": [],
+            "plan_quality_check_enabled": True,
+        }
+
+        async def step(node):
+            update = await node(state)
+            update.pop("messages", None)
+            state.update(update)
+
+        await step(planner)
+        await step(plan_quality_evaluator)
+        assert plan_rejected(state)
+
+        # The planner repeats its plan, which is reviewed again instead of replaying the rejection
+        await step(planner)
+        await step(plan_quality_evaluator)
+
+        assert planner_llm.calls == 2
+        assert review_llm.calls == 2
+        assert not plan_rejected(state)
+
+    run_with_cache(tmp_path, test)
@@ -0,0 +1,40 @@
+import asyncio
+import os
+from langgraph.checkpoint.base import empty_checkpoint
+from blob_store import BlobSerializer
+from checkpoint_store import CheckpointStore
+
+
+def test_checkpoints_load_their_blobs_without_blocking_reads(tmp_path, monkeypatch):
+    def read_blob(self, key):
+        raise AssertionError("blob read on the event loop")
+
+    monkeypatch.setattr(BlobSerializer, "_read_blob", read_blob)
+
+    async def run():
+        store = await CheckpointStore.shared(str(tmp_path / "memory.db"))
+        try:
+            saver = store.saver
+            # Random text, so the values stay above the blob threshold after compression
+            result = os.urandom(2000).hex()
+            write = os.urandom(2000).hex()
+            checkpoint = empty_checkpoint()
+            checkpoint["channel_values"] = {"worker_results": {"0": result, "1": "short"}}
+            checkpoint["channel_versions"] = {"worker_results": 1}
+            config = {"configurable": {"thread_id": "thread", "checkpoint_ns": ""}}
+            saved = await saver.aput(config, checkpoint, {"step": 1}, {"worker_results": 1})
+            await saver.aput_writes(saved, [("worker_results", {"2": write})], "task")
+            await store.flush()
+            saver.serde._cache.clear()
+
+            loaded = await saver.aget_tuple(config)
+            assert loaded.checkpoint["channel_values"]["worker_results"] == {"0": result, "1": "short"}
+            assert [value for _, _, value in loaded.pending_writes] == [{"2": write}]
+
+            saver.serde._cache.clear()
+            history = [checkpoint_tuple async for checkpoint_tuple in saver.alist(config)]
+            assert history[0].checkpoint["channel_values"]["worker_results"]["0"] == result
+        finally:
+            await store.release()
+
+    asyncio.run(run())
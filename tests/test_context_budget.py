@@ -0,0 +1,96 @@
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+from context_budget import ContextBudget, RollingTranscript, count_message_tokens, count_text_tokens
+
+
+def tool_loop(old_tool_output: str, old_response: str = "Looking it up"):
+    def call(call_id):
+        return [{"name": "search", "args": {"query": call_id}, "id": call_id, "type": "tool_call"}]
+
+    return [
+        SystemMessage(content="You are a worker"),
+        HumanMessage(content="Research the market"),
+        AIMessage(content=old_response, tool_calls=call("1")),
+        ToolMessage(content=old_tool_output, tool_call_id="1"),
+        AIMessage(content="Checking one more source", tool_calls=call("2")),
+        ToolMessage(content="newest " * 500, tool_call_id="2"),
+    ]
+
+
+def test_budget_leaves_a_conversation_under_budget_alone():
+    messages = tool_loop("short output")
+    budget = ContextBudget(max_tokens=10000)
+
+    compacted, stats = budget.compact(messages)
+
+    assert compacted is messages
+    assert stats["messages_shortened"] == 0
+    assert stats["prompt_tokens"] == sum(count_message_tokens(message) for message in messages)
+
+
+def test_budget_shortens_old_tool_outputs_before_model_responses():
+    messages = tool_loop("data " * 2000, old_response="thinking " * 1000)
+    total = sum(count_message_tokens(message) for message in messages)
+    budget = ContextBudget(max_tokens=total - 500, tool_output_tokens=100)
+
+    compacted, stats = budget.compact(messages)
+
+    assert stats["messages_shortened"] == 1
+    assert stats["tokens_before_compaction"] == total and stats["prompt_tokens"] <= total - 500
+    assert "omitted to save context" in compacted[3].content and compacted[3].tool_call_id == "1"
+    assert compacted[2] is messages[2]
+    # The newest turn is kept whole
+    assert compacted[4:] == messages[4:]
+
+
+def test_budget_shortens_old_model_responses_when_tool_outputs_are_not_enough():
+    messages = tool_loop("data " * 2000, old_response="thinking " * 1000)
+    budget = ContextBudget(max_tokens=100, tool_output_tokens=100)
+
+    compacted, stats = budget.compact(messages)
+
+    assert stats["messages_shortened"] == 2
+    assert "omitted to save context" in compacted[2].content
+    assert compacted[2].tool_calls == messages[2].tool_calls
+    assert compacted[:2] == messages[:2] and compacted[4:] == messages[4:]
+
+
+def test_transcript_shortens_a_turn_longer_than_the_window():
+    transcript = RollingTranscript(max_tokens=2000)
+    messages = [
+        HumanMessage(content="Write a report", id="0"),
+        AIMessage(content="start " + "detail " * 5000 + "end", id="1"),
+    ]
+
+    rendered = transcript.update(messages)
+
+    assert count_text_tokens(rendered) < 2000
+    assert "Assistant: start" in rendered and rendered.rstrip().endswith("end")
+
+
+def test_transcript_keeps_the_request_and_newest_turns_and_excerpts_older_ones():
+    transcript = RollingTranscript(max_tokens=2000)
+    messages = [HumanMessage(content="Write a report", id="request")]
+    messages += [AIMessage(content=f"turn {i}\n" + "detail " * 100, id=str(i)) for i in range(200)]
+
+    rendered = transcript.update(messages)
+
+    assert rendered.startswith("Conversation history:\n\nUser: Write a report")
+    assert "earlier turns omitted]" in rendered
+    assert "Assistant: turn 150\ndetail" not in rendered and "Assistant: turn 150\n" in rendered
+    assert "Assistant: turn 199\ndetail" in rendered
+    assert "Assistant: turn 0\n" not in rendered and "Earlier turns (excerpts)" in rendered
+    assert count_text_tokens(rendered) < 2000
+
+
+def test_transcript_renders_only_new_messages_and_restarts_on_a_new_conversation():
+    transcript = RollingTranscript(max_tokens=2000)
+    messages = [HumanMessage(content="Plan a trip", id="0"), AIMessage(content="Which dates?", id="1")]
+
+    first = transcript.update(messages)
+    assert transcript.update(messages) is first
+
+    messages.append(HumanMessage(content="Next week", id="2"))
+    assert transcript.update(messages) == first + "User: Next week\n"
+
+    rendered = transcript.update([HumanMessage(content="Something else", id="3")])
+    assert "Plan a trip" not in rendered and "User: Something else" in rendered
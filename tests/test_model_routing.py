@@ -0,0 +1,31 @@
+import asyncio
+from model_routing import ModelRouter
+
+
+class FakeLLM:
+    def __init__(self, model, failing):
+        self.model = model
+        self.failing = failing
+
+    async def ainvoke(self, messages, *args, **kwargs):
+        if self.model in self.failing:
+            raise RuntimeError("upstream error")
+        return self.model
+
+
+def test_single_model_routes_record_their_calls():
+    router = ModelRouter(routes={}, default="small")
+    llm = router.route("digest", lambda model: FakeLLM(model, failing=set()))
+
+    assert asyncio.run(llm.ainvoke([])) == "small"
+    assert router.stats()["digest"]["calls"] == 1
+    assert "small" in router.stats()["digest"]["avg_latency_ms"]
+
+
+def test_worker_cascade_escalates_when_a_call_fails():
+    router = ModelRouter(routes={"worker": ["small", "large"]})
+    llm = router.route("worker", lambda model: FakeLLM(model, failing={"small"}))
+
+    assert asyncio.run(llm.ainvoke([])) == "large"
+    stats = router.stats()["worker"]
+    assert (stats["calls"], stats["escalation_rate"], stats["failures"]) == (1, 1.0, 1)
@@ -0,0 +1,56 @@
+from plan_validator import find_cycles, validate_plan
+
+
+def plan(*dependencies):
+    return [{"description": f"step {idx}", "dependencies": list(deps)} for idx, deps in enumerate(dependencies)]
+
+
+def test_valid_plan_is_grouped_by_dependency_depth():
+    result = validate_plan(plan([], [0], [0], [1, 2]))
+
+    assert result["structure_valid"]
+    assert result["issues"] == []
+    assert result["levels"] == [[0], [1, 2], [3]]
+    assert result["dependencies"] == {0: [], 1: [0], 2: [0], 3: [1, 2]}
+
+
+def test_invalid_dependencies_are_dropped_and_reported():
+    result = validate_plan(plan([0, 5], [0, 0]))
+
+    assert result["structure_valid"]
+    assert result["dependencies"] == {0: [], 1: [0]}
+    assert result["levels"] == [[0], [1]]
+    assert result["issues"] == [
+        "Subtask 0 depends on itself",
+        "Subtask 0 depends on subtask 5, which does not exist",
+        "Subtask 1 lists subtask 0 as a dependency more than once",
+    ]
+
+
+def test_cycles_make_a_plan_structurally_unsound():
+    result = validate_plan(plan([1], [0], [1], []))
+
+    assert not result["structure_valid"]
+    assert result["cycles"] == [[0, 1]]
+    assert result["levels"] == [[3]]
+    assert "Subtasks 0, 1 depend on each other in a cycle" in result["issues"]
+    assert "Subtasks 2 can never start because they depend on a cycle" in result["issues"]
+    assert "Subtask 3 is orphaned: it has no dependencies and no subtask uses its result" in result["issues"]
+
+
+def test_parallel_groups_are_checked_against_dependencies():
+    result = validate_plan(plan([], [0], []), parallel_groups=[[0, 1], [7]])
+
+    assert result["issues"] == [
+        "Subtask 2 is orphaned: it has no dependencies and no subtask uses its result",
+        "Parallel group 1 refers to subtask 7, which does not exist",
+        "Subtask 1 is in group 0 but depends on subtask 0 in group 0",
+        "Subtask 2 is not in any parallel group",
+    ]
+
+
+def test_find_cycles_returns_each_strongly_connected_component():
+    dependencies = {0: {2}, 1: {0}, 2: {1}, 3: {4}, 4: {3}, 5: {0}}
+
+    assert find_cycles(dependencies, set(dependencies)) == [[0, 1, 2], [3, 4]]
+    assert find_cycles(dependencies, {0, 1, 5}) == []
@@ -0,0 +1,46 @@
+from nodes.planner import carry_forward_results, fingerprint_subtasks
+
+
+def make_plan(*subtasks):
+    task_plan = [
+        {"description": description, "success_criteria": "done", "dependencies": dependencies}
+        for description, dependencies in subtasks
+    ]
+    for subtask, fingerprint in zip(task_plan, fingerprint_subtasks(task_plan)):
+        subtask["fingerprint"] = fingerprint
+    return task_plan
+
+
+def passed():
+    return {"completion_score": 1.0, "is_complete": True, "feedback": "ok"}
+
+
+def test_dependent_of_a_failed_subtask_is_not_carried_forward():
+    previous_plan = make_plan(("research", []), ("write", [0]), ("other", []))
+    state = {
+        "task_plan": previous_plan,
+        "worker_results": {0: "thin research", 1: "report", 2: "other result"},
+        "task_evaluation_results": {
+            0: {"completion_score": 0.2, "is_complete": False, "feedback": "too thin"},
+            1: passed(),
+            2: passed(),
+        },
+    }
+
+    worker_results, evaluations = carry_forward_results(state, make_plan(("research", []), ("write", [0]), ("other", [])))
+
+    assert worker_results == {2: "other result"}
+    assert set(evaluations) == {2}
+
+
+def test_subtask_built_from_reused_upstream_results_is_carried_forward():
+    previous_plan = make_plan(("research", []), ("write", [0]), ("notify", [1]))
+    state = {
+        "task_plan": previous_plan,
+        "worker_results": {0: "research", 1: "report", 2: "sent"},
+        "task_evaluation_results": {0: passed(), 1: passed(), 2: {"is_complete": False}},
+    }
+
+    worker_results, _ = carry_forward_results(state, make_plan(("research", []), ("write", [0]), ("notify", [1])))
+
+    assert worker_results == {0: "research", 1: "report"}
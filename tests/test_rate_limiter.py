@@ -0,0 +1,109 @@
+import asyncio
+import pytest
+from rate_limiter import AdaptiveRateLimiter, TokenBucket, retry_after
+
+
+class ServerError(Exception):
+    status_code = 500
+
+
+def test_only_successful_calls_grow_the_concurrency_limit():
+    limiter = AdaptiveRateLimiter(requests_per_minute=60000, tokens_per_minute=10 ** 9, max_concurrency=8,
+                                  max_retries=0)
+    start = limiter.concurrency
+
+    async def fail():
+        raise ServerError("bad gateway")
+
+    async def succeed():
+        return "ok"
+
+    async def test():
+        for _ in range(3):
+            try:
+                await limiter.run(fail)
+            except ServerError:
+                pass
+        assert limiter.concurrency == start
+        assert await limiter.run(succeed) == "ok"
+        assert limiter.concurrency > start
+
+    asyncio.run(test())
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+    def __init__(self, message, headers=None):
+        super().__init__(message)
+        self.response = type("Response", (), {"headers": headers or {}})()
+
+
+def test_token_bucket_allows_a_burst_then_makes_callers_wait():
+    bucket = TokenBucket(per_minute=600, burst_seconds=1)
+
+    assert bucket.reserve(10) == 0
+    assert bucket.reserve(5) == pytest.approx(0.5, abs=0.05)
+    # The call used fewer tokens than reserved, so the difference is given back
+    bucket.adjust(-5)
+    assert bucket.reserve(0) == pytest.approx(0, abs=0.05)
+
+
+def test_rate_limit_halves_the_concurrency_limit_and_retries():
+    limiter = AdaptiveRateLimiter(requests_per_minute=60000, tokens_per_minute=10 ** 9, max_concurrency=8,
+                                  base_backoff=0.01, max_backoff=0.01)
+    calls = []
+
+    async def throttled_once():
+        calls.append(len(calls))
+        if len(calls) == 1:
+            raise RateLimitError("slow down")
+        return "ok"
+
+    assert asyncio.run(limiter.run(throttled_once)) == "ok"
+    assert len(calls) == 2
+    assert limiter.concurrency < 4
+    assert limiter.stats()["throttled"] == 1 and limiter.stats()["retries"] == 1
+
+
+def test_other_errors_are_not_retried():
+    limiter = AdaptiveRateLimiter(requests_per_minute=60000, tokens_per_minute=10 ** 9)
+    calls = []
+
+    async def invalid():
+        calls.append(1)
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        asyncio.run(limiter.run(invalid))
+    assert len(calls) == 1
+    assert limiter.stats()["in_flight"] == 0
+
+
+def test_backoff_respects_the_server_retry_after():
+    limiter = AdaptiveRateLimiter(base_backoff=0.01, max_backoff=0.01)
+
+    assert retry_after(RateLimitError("slow down", {"retry-after": "2"})) == 2
+    assert retry_after(RateLimitError("slow down")) is None
+    assert limiter._backoff(0, 2) == 2
+
+
+def test_callers_wait_for_a_concurrency_slot():
+    limiter = AdaptiveRateLimiter(requests_per_minute=60000, tokens_per_minute=10 ** 9, max_concurrency=2)
+    assert int(limiter.concurrency) == 1
+
+    async def test():
+        release = asyncio.Event()
+
+        async def call():
+            await release.wait()
+            return "ok"
+
+        calls = [asyncio.create_task(limiter.run(call)) for _ in range(3)]
+        await asyncio.sleep(0.05)
+        assert (limiter.in_flight, limiter.waiting) == (1, 2)
+        release.set()
+        assert await asyncio.gather(*calls) == ["ok"] * 3
+        assert limiter.stats()["completed"] == 3
+
+    asyncio.run(test())
@@ -0,0 +1,107 @@
+import asyncio
+import os
+import sqlite3
+from langgraph.checkpoint.base import empty_checkpoint
+from blob_store import BlobSerializer
+from checkpoint_store import CheckpointStore
+
+
+def random_text() -> str:
+    # Random, so the value stays above the blob threshold after compression
+    return os.urandom(2000).hex()
+
+
+async def put_checkpoints(store, thread_id, values):
+    config = {"configurable": {"thread_id": thread_id, "checkpoint_ns": ""}}
+    for version, value in enumerate(values, 1):
+        checkpoint = empty_checkpoint()
+        checkpoint["channel_values"] = {"worker_results": {"0": value}}
+        checkpoint["channel_versions"] = {"worker_results": version}
+        config = await store.saver.aput(config, checkpoint, {"step": version}, {"worker_results": version})
+    await store.flush()
+    return config
+
+
+def count_blobs(db_path) -> int:
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM blobs").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_prune_collects_blobs_of_deleted_checkpoints_without_loading_checkpoints(tmp_path, monkeypatch):
+    db_path = str(tmp_path / "memory.db")
+
+    def referenced_blobs(self, data):
+        raise AssertionError("checkpoint loaded to find its blobs")
+
+    async def run():
+        store = await CheckpointStore.shared(db_path)
+        try:
+            values = [random_text() for _ in range(3)]
+            config = await put_checkpoints(store, "thread", values)
+            assert count_blobs(db_path) == 3
+
+            monkeypatch.setattr(BlobSerializer, "referenced_blobs", referenced_blobs)
+            store.retention.keep_last = 1
+            stats = await store.retention.run_once()
+
+            assert (stats["checkpoints_deleted"], stats["blobs_deleted"]) == (2, 2)
+            assert count_blobs(db_path) == 1
+            store.serde._cache.clear()
+            latest = await store.saver.aget_tuple({"configurable": {**config["configurable"], "checkpoint_id": None}})
+            assert latest.checkpoint["channel_values"]["worker_results"]["0"] == values[-1]
+        finally:
+            await store.release()
+
+    asyncio.run(run())
+
+
+def test_blob_references_are_rebuilt_for_an_existing_database(tmp_path):
+    db_path = str(tmp_path / "memory.db")
+
+    async def run():
+        store = await CheckpointStore.shared(db_path)
+        try:
+            await put_checkpoints(store, "thread", [random_text(), random_text()])
+        finally:
+            await store.release()
+
+        # A database written before blob references were recorded
+        conn = sqlite3.connect(db_path)
+        conn.execute("DROP TABLE blob_refs")
+        conn.commit()
+        conn.close()
+
+        store = await CheckpointStore.shared(db_path)
+        try:
+            assert await store.retention.collect_blobs() == 0
+            assert count_blobs(db_path) == 2
+        finally:
+            await store.release()
+
+    asyncio.run(run())
+
+
+def test_idle_threads_expire_with_their_blobs(tmp_path):
+    db_path = str(tmp_path / "memory.db")
+
+    async def run():
+        store = await CheckpointStore.shared(db_path)
+        try:
+            await put_checkpoints(store, "idle", [random_text(), random_text()])
+            await asyncio.sleep(0.5)
+            active = await put_checkpoints(store, "active", [random_text()])
+
+            store.retention.thread_ttl = 0.25
+            stats = await store.retention.run_once()
+
+            assert (stats["threads_expired"], stats["checkpoints_deleted"], stats["blobs_deleted"]) == (1, 2, 2)
+            assert count_blobs(db_path) == 1
+            assert await store.saver.aget_tuple({"configurable": {"thread_id": "idle", "checkpoint_ns": ""}}) is None
+            assert await store.saver.aget_tuple(active) is not None
+        finally:
+            await store.release()
+
+    asyncio.run(run())
@@ -0,0 +1,36 @@
+import asyncio
+from langchain_core.messages import HumanMessage
+from sidekick import Sidekick
+
+
+def test_revised_plan_cancels_the_research_without_waiting_for_it():
+    async def test():
+        session = Sidekick()
+
+        async def plan():
+            return {"task_plan": [{"description": "research", "success_criteria": "facts", "dependencies": []}]}
+
+        async def research():
+            await asyncio.sleep(3600)
+
+        async def check_plan_revision(request, task_plan, answers):
+            return True
+
+        research_task = asyncio.create_task(research())
+        session.check_plan_revision = check_plan_revision
+        session.speculation = {
+            "request": ("Write a report", "A report"),
+            "plan": asyncio.create_task(plan()),
+            "task": research_task,
+        }
+        state = {
+            "messages": [HumanMessage(content="Write a report")],
+            "success_criteria": "A report",
+            "clarification_answers": ["Cover Europe only"],
+        }
+
+        assert await asyncio.wait_for(session.apply_speculation({}, state), timeout=1) is False
+        await asyncio.gather(research_task, return_exceptions=True)
+        assert research_task.cancelled()
+
+    asyncio.run(test())
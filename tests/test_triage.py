@@ -0,0 +1,40 @@
+import asyncio
+from langchain_core.messages import HumanMessage
+from models import ComplexityAssessment
+from nodes.triage import classify_complexity, create_triage_node
+
+
+def test_short_questions_are_simple():
+    assert classify_complexity("What is the capital of France?")[0] is True
+    assert classify_complexity("Convert 30 degrees Celsius to Fahrenheit")[0] is True
+
+
+def test_lists_and_artifacts_are_multi_step():
+    assert classify_complexity("1. Find flights to Rome\n2. Book a hotel near the station") == (False, "a list of steps")
+    assert classify_complexity("Research the EV market and write a PDF report")[0] is False
+    assert classify_complexity(" ".join(["word"] * 130))[0] is False
+
+
+def test_requests_the_heuristics_cannot_place_are_undecided():
+    assert classify_complexity("Compare Python and Go.")[0] is None
+
+
+def test_triage_asks_the_llm_only_when_the_heuristics_are_undecided():
+    class ComplexityLLM:
+        calls = 0
+
+        async def ainvoke(self, messages):
+            self.calls += 1
+            return ComplexityAssessment(is_simple=True, reason="one short comparison")
+
+    llm = ComplexityLLM()
+    triage = create_triage_node(llm)
+
+    def state(message):
+        return {"messages": [HumanMessage(content=message)], "success_criteria": "an answer"}
+
+    assert asyncio.run(triage(state("What is the capital of France?"))) == {"request_complexity": "simple"}
+    assert llm.calls == 0
+    assert asyncio.run(triage(state("Compare Python and Go."))) == {"request_complexity": "simple"}
+    assert llm.calls == 1
+    assert asyncio.run(create_triage_node(llm, enabled=False)(state("Hi"))) == {"request_complexity": "complex"}
@@ -0,0 +1,202 @@
+import asyncio
+from contextlib import asynccontextmanager
+from langchain_core.messages import AIMessage
+from langchain_core.tools import tool
+from langgraph.graph import END, START, MessagesState, StateGraph
+from nodes.workers import (
+    create_dag_scheduler_node, create_result_digester, create_retry_failed_subtasks_node, create_tools_node
+)
+
+
+def test_retry_reruns_dependents_of_the_retried_subtask():
+    task_plan = [
+        {"description": "research", "success_criteria": "facts", "dependencies": []},
+        {"description": "analyse", "success_criteria": "analysis", "dependencies": [0]},
+        {"description": "write report", "success_criteria": "report", "dependencies": [1]},
+        {"description": "unrelated", "success_criteria": "done", "dependencies": []},
+    ]
+    state = {
+        "task_plan": task_plan,
+        "success_criteria": "a report",
+        "worker_results": {0: "thin research", 1: "old analysis", 2: "old report", 3: "unrelated result"},
+        "task_evaluation_results": {
+            0: {"completion_score": 0.3, "is_complete": False, "feedback": "add sources"},
+            1: {"completion_score": 0.9, "is_complete": True, "feedback": "ok"},
+            2: {"completion_score": 0.9, "is_complete": True, "feedback": "ok"},
+            3: {"completion_score": 0.9, "is_complete": True, "feedback": "ok"},
+        },
+        "subtask_retry_counts": {},
+    }
+
+    retry = create_retry_failed_subtasks_node(max_subtask_retries=2)(state)
+
+    assert retry["worker_results"] == {3: "unrelated result"}
+    assert set(retry["task_evaluation_results"]) == {3}
+    assert retry["task_plan"][0]["retry_feedback"] == "add sources"
+    assert "retry_feedback" not in retry["task_plan"][1]
+    assert retry["subtask_retry_counts"] == {0: 1}
+
+    inputs = {}
+
+    async def process_subtask(subtask, subtask_index, subtask_state):
+        inputs[subtask_index] = dict(subtask_state["worker_results"])
+        return {"subtask_index": subtask_index, "result": f"new {subtask['description']}"}
+
+    scheduled = asyncio.run(create_dag_scheduler_node(process_subtask)({**state, **retry}))
+
+    assert sorted(inputs) == [0, 1, 2]
+    assert inputs[1][0] == "new research"
+    assert inputs[2][1] == "new analyse"
+    assert scheduled["worker_results"][3] == "unrelated result"
+
+
+def test_rejected_plan_keeps_only_results_that_passed():
+    task_plan = [
+        {"description": "research a", "success_criteria": "facts", "dependencies": []},
+        {"description": "research b", "success_criteria": "facts", "dependencies": []},
+        {"description": "write", "success_criteria": "report", "dependencies": [0, 1]},
+    ]
+    state = {
+        "task_plan": task_plan,
+        "success_criteria": "a report",
+        "worker_results": {},
+        "task_evaluation_results": {},
+        "plan_quality_check_enabled": True,
+        "plan_quality_score": None,
+    }
+
+    async def process_subtask(subtask, subtask_index, subtask_state):
+        return {"subtask_index": subtask_index, "result": f"{subtask['description']} result"}
+
+    async def evaluate_subtask(subtask, subtask_index, result):
+        return {"completion_score": 0.9 if subtask_index == 0 else 0.2, "is_complete": subtask_index == 0, "feedback": ""}
+
+    async def evaluate_plan(plan_state):
+        await asyncio.sleep(0.05)
+        return {"plan_quality_score": 0.3, "plan_needs_refinement": True, "plan_quality_feedback": "merge the research"}
+
+    dag_scheduler = create_dag_scheduler_node(process_subtask, evaluate_subtask, evaluate_plan_func=evaluate_plan)
+    result = asyncio.run(dag_scheduler(state))
+
+    assert result["plan_quality_feedback"] == "merge the research"
+    assert result["worker_results"] == {0: "research a result"}
+    assert set(result["task_evaluation_results"]) == {0}
+
+
+def test_rejected_plan_waits_for_cancelled_subtasks_to_stop():
+    task_plan = [
+        {"description": "quick research", "success_criteria": "facts", "dependencies": []},
+        {"description": "slow research", "success_criteria": "facts", "dependencies": []},
+    ]
+    state = {
+        "task_plan": task_plan,
+        "success_criteria": "a report",
+        "worker_results": {},
+        "task_evaluation_results": {},
+        "plan_quality_check_enabled": True,
+        "plan_quality_score": None,
+    }
+    leases = []
+
+    async def process_subtask(subtask, subtask_index, subtask_state):
+        leases.append(subtask_index)
+        try:
+            if subtask_index == 1:
+                await asyncio.sleep(3600)
+            return {"subtask_index": subtask_index, "result": "result"}
+        finally:
+            # Releasing a browser context takes a moment
+            await asyncio.sleep(0.01)
+            leases.remove(subtask_index)
+
+    async def evaluate_plan(plan_state):
+        await asyncio.sleep(0.05)
+        return {"plan_quality_score": 0.3, "plan_needs_refinement": True, "plan_quality_feedback": "too broad"}
+
+    dag_scheduler = create_dag_scheduler_node(process_subtask, evaluate_plan_func=evaluate_plan)
+
+    async def test():
+        await dag_scheduler(state)
+        assert leases == []
+
+    asyncio.run(test())
+
+
+def test_failed_digest_is_retried_by_the_next_dependent():
+    class FlakyDigestLLM:
+        calls = 0
+
+        async def ainvoke(self, messages):
+            self.calls += 1
+            if self.calls == 1:
+                raise RuntimeError("upstream error")
+            return AIMessage(content="digest")
+
+    digest_llm = FlakyDigestLLM()
+    digest = create_result_digester(digest_llm, max_tokens=20)
+    result = "word " * 200
+
+    async def test():
+        excerpt = await digest(result)
+        assert excerpt != "digest" and len(excerpt) < len(result)
+        assert await digest(result) == "digest"
+        assert await digest(result) == "digest"
+
+    asyncio.run(test())
+    assert digest_llm.calls == 2
+
+
+class FakeBrowserPool:
+    tool_names = {"navigate_browser"}
+
+    def __init__(self):
+        self.leased = []
+        self.released = []
+
+    @asynccontextmanager
+    async def lease(self):
+        context = f"context {len(self.leased)}"
+        self.leased.append(context)
+
+        @tool
+        def navigate_browser(url: str) -> str:
+            """Opens a URL"""
+            return f"{url} in {context}"
+
+        try:
+            yield [navigate_browser]
+        finally:
+            self.released.append(context)
+
+
+def test_worker_loop_browses_in_a_context_leased_for_its_thread():
+    @tool
+    def navigate_browser(url: str) -> str:
+        """Opens a URL in the shared browser"""
+        return "shared browser"
+
+    pool = FakeBrowserPool()
+    tools_node, release_browser = create_tools_node([navigate_browser], pool)
+    builder = StateGraph(MessagesState)
+    builder.add_node("tools", tools_node)
+    builder.add_edge(START, "tools")
+    builder.add_edge("tools", END)
+    graph = builder.compile()
+
+    def browse(url):
+        call = {"name": "navigate_browser", "args": {"url": url}, "id": url, "type": "tool_call"}
+        return {"messages": [AIMessage(content="", tool_calls=[call])]}
+
+    async def run(thread_id, url):
+        result = await graph.ainvoke(browse(url), {"configurable": {"thread_id": thread_id}})
+        return result["messages"][-1].content
+
+    async def test():
+        assert await run("a", "first") == "first in context 0"
+        assert await run("b", "second") == "second in context 1"
+        assert await run("a", "third") == "third in context 0"
+        await release_browser("a")
+        assert pool.released == ["context 0"]
+        assert await run("a", "fourth") == "fourth in context 2"
+
+    asyncio.run(test())
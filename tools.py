@@ -1,15 +1,14 @@
-from playwright.async_api import async_playwright
-from langchain_community.agent_toolkits import PlayWrightBrowserToolkit
+from playwright.async_api import async_playwright, Browser
 from dotenv import load_dotenv
 import os
-import requests
-from langchain.agents import Tool
-from langchain_community.agent_toolkits import FileManagementToolkit
-from langchain_community.tools.wikipedia.tool import WikipediaQueryRun
-from langchain_community.utilities import GoogleSerperAPIWrapper
-from langchain_community.utilities.wikipedia import WikipediaAPIWrapper
+from langchain_core.tools import tool
+from langgraph.prebuilt import InjectedState
 from datetime import datetime
-from markdown_pdf import MarkdownPdf, Section
+from contextlib import asynccontextmanager
+from typing import Annotated
+from cache import ResponseCache, make_cache_key
+import asyncio
+import re
 
 
 
@@ -17,22 +16,222 @@ load_dotenv(override=True)
 pushover_token = os.getenv("PUSHOVER_TOKEN")
 pushover_user = os.getenv("PUSHOVER_USER")
 pushover_url = "https://api.pushover.net/1/messages.json"
-serper = GoogleSerperAPIWrapper()
+browser_headless = os.getenv("BROWSER_HEADLESS", "true").lower() != "false"
+browser_pool_size = int(os.getenv("BROWSER_POOL_SIZE", "4"))
 
-async def playwright_tools():
-    playwright = await async_playwright().start()
-    browser = await playwright.chromium.launch(headless=False)
+
+class LazyBrowser(Browser):
+    """Stands in for the browser until a tool first needs a page, then launches it.
+
+    The Playwright toolkit only reads contexts and calls new_context, so
+    sessions that never browse never start Playwright at all. Contexts owned by
+    the subtask pool are hidden from contexts, so the shared toolkit never
+    drives a page that a subtask has leased.
+    """
+    def __init__(self, headless: bool = browser_headless):
+        self.headless = headless
+        self.playwright = None
+        self.browser = None
+        self.pooled_contexts = set()
+        self._launch_lock = asyncio.Lock()
+
+    async def launch(self) -> Browser:
+        async with self._launch_lock:
+            if self.browser is None:
+                self.playwright = await async_playwright().start()
+                self.browser = await self.playwright.chromium.launch(headless=self.headless)
+            return self.browser
+
+    @property
+    def contexts(self):
+        if not self.browser:
+            return []
+        return [context for context in self.browser.contexts if context not in self.pooled_contexts]
+
+    async def new_context(self, **kwargs):
+        return await (await self.launch()).new_context(**kwargs)
+
+    async def new_pooled_context(self, **kwargs):
+        """Creates a context for the subtask pool, hidden from the shared toolkit"""
+        context = await self.new_context(**kwargs)
+        self.pooled_contexts.add(context)
+        return context
+
+    def is_connected(self) -> bool:
+        return self.browser is not None and self.browser.is_connected()
+
+    async def close(self):
+        if self.browser:
+            await self.browser.close()
+            self.browser = None
+        if self.playwright:
+            await self.playwright.stop()
+            self.playwright = None
+
+
+class LeasedBrowser(Browser):
+    """A view of a shared browser that only exposes one leased context.
+
+    The Playwright toolkit always drives the first context of the browser it
+    is given, so handing each subtask its own view keeps their pages apart.
+    """
+    def __init__(self, context):
+        super().__init__(context.browser._impl_obj)
+        self._leased_context = context
+
+    @property
+    def contexts(self):
+        return [self._leased_context]
+
+    async def new_context(self, **kwargs):
+        return self._leased_context
+
+
+class BrowserContextPool:
+    """Pool of isolated browser contexts leased to parallel subtasks"""
+    def __init__(self, browser: LazyBrowser, size: int = 4, max_uses: int = 20):
+        self.browser = browser
+        self.size = size
+        self.max_uses = max_uses
+        from langchain_community.agent_toolkits import PlayWrightBrowserToolkit
+        self.tool_names = {tool.name for tool in PlayWrightBrowserToolkit.from_browser(async_browser=browser).get_tools()}
+        self._semaphore = asyncio.Semaphore(size)
+        self._idle = []
+        self._uses = {}
+
+    @asynccontextmanager
+    async def lease(self):
+        """Leases a context and yields browser tools bound to it"""
+        async with self._semaphore:
+            context = await self._acquire()
+            healthy = True
+            try:
+                from langchain_community.agent_toolkits import PlayWrightBrowserToolkit
+                toolkit = PlayWrightBrowserToolkit.from_browser(async_browser=LeasedBrowser(context))
+                yield toolkit.get_tools()
+            except BaseException:
+                healthy = False
+                raise
+            finally:
+                await self._release(context, healthy)
+
+    async def _acquire(self):
+        while self._idle:
+            context = self._idle.pop()
+            if await self._is_healthy(context):
+                return context
+            await self._close_context(context)
+        context = await self.browser.new_pooled_context()
+        self._uses[context] = 0
+        return context
+
+    async def _is_healthy(self, context) -> bool:
+        if not self.browser.is_connected():
+            return False
+        try:
+            page = context.pages[-1] if context.pages else await context.new_page()
+            await page.evaluate("1")
+            return True
+        except Exception:
+            return False
+
+    async def _release(self, context, healthy: bool):
+        self._uses[context] = self._uses.get(context, 0) + 1
+        if healthy and self._uses[context] < self.max_uses and len(self._idle) < self.size:
+            try:
+                # Reset the context so the next subtask starts from a blank page
+                for page in context.pages[1:]:
+                    await page.close()
+                if context.pages:
+                    await context.pages[0].goto("about:blank")
+                await context.clear_cookies()
+                self._idle.append(context)
+                return
+            except Exception as e:
+                print(f"Error recycling browser context: {e}")
+        await self._close_context(context)
+
+    async def _close_context(self, context):
+        self._uses.pop(context, None)
+        self.browser.pooled_contexts.discard(context)
+        try:
+            await context.close()
+        except Exception as e:
+            print(f"Error closing browser context: {e}")
+
+    async def close(self):
+        while self._idle:
+            await self._close_context(self._idle.pop())
+
+
+def playwright_tools(headless: bool = browser_headless, pool_size: int = browser_pool_size):
+    """Returns the browser tools, the browser and its context pool; the browser launches on first use"""
+    from langchain_community.agent_toolkits import PlayWrightBrowserToolkit
+    browser = LazyBrowser(headless=headless)
     toolkit = PlayWrightBrowserToolkit.from_browser(async_browser=browser)
-    return toolkit.get_tools(), browser, playwright
+    browser_pool = BrowserContextPool(browser, size=pool_size)
+    return toolkit.get_tools(), browser, browser_pool
+
+
+_serper = None
+_wikipedia = None
+
+
+def search(query: str) -> str:
+    """Runs a Serper web search, creating the client on first use"""
+    global _serper
+    if _serper is None:
+        from langchain_community.utilities import GoogleSerperAPIWrapper
+        _serper = GoogleSerperAPIWrapper()
+    return _serper.run(query)
+
+
+def wikipedia(query: str) -> str:
+    """Looks a query up on Wikipedia, creating the client on first use"""
+    global _wikipedia
+    if _wikipedia is None:
+        from langchain_community.tools.wikipedia.tool import WikipediaQueryRun
+        from langchain_community.utilities.wikipedia import WikipediaAPIWrapper
+        _wikipedia = WikipediaQueryRun(api_wrapper=WikipediaAPIWrapper())
+    return _wikipedia.run(query)
+
+
+def normalize_query(query: str) -> str:
+    """Collapses case and whitespace so near-identical queries share a cache entry"""
+    return re.sub(r"\s+", " ", query).strip().lower()
+
+
+def cached_tool_coroutine(name: str, func, cache: ResponseCache):
+    """Wraps a blocking query function with the tool cache and single-flight lookups"""
+    async def run(query: str) -> str:
+        key = make_cache_key("tool", name, normalize_query(query))
+        return await cache.get_or_compute(
+            key,
+            lambda: asyncio.to_thread(func, query),
+            dumps=str,
+            loads=str,
+        )
+    return run
 
 
 def push(text: str):
     """Send a push notification to the user"""
+    import requests
     requests.post(pushover_url, data = {"token": pushover_token, "user": pushover_user, "message": text})
     return "success"
 
 
+@tool
+def read_subtask_result(subtask_index: int, state: Annotated[dict, InjectedState]) -> str:
+    """Returns the full result of an earlier subtask. Use it when the digest of a dependency in your instructions leaves out details you need."""
+    worker_results = state.get("worker_results") or {}
+    if subtask_index not in worker_results:
+        return f"No result is available for subtask {subtask_index}."
+    return worker_results[subtask_index]
+
+
 def get_file_tools():
+    from langchain_community.agent_toolkits import FileManagementToolkit
     toolkit = FileManagementToolkit(root_dir="sandbox")
     return toolkit.get_tools()
 
@@ -61,6 +260,7 @@ def generate_pdf_from_markdown(markdown_content: str, filename: str = None) -> s
     pdf_path = os.path.join(sandbox_dir, filename)
     
     # Convert markdown to PDF using markdown-pdf library
+    from markdown_pdf import MarkdownPdf, Section
     pdf = MarkdownPdf(toc_level=2)
     pdf.add_section(Section(markdown_content))
     pdf.save(pdf_path)
@@ -68,18 +268,25 @@ def generate_pdf_from_markdown(markdown_content: str, filename: str = None) -> s
     return f"PDF generated successfully at: {pdf_path}"
 
 
-async def other_tools():
+def other_tools(tool_cache: ResponseCache = None):
+    from langchain.agents import Tool
     push_tool = Tool(name="send_push_notification", func=push, description="Use this tool when you want to send a push notification")
     file_tools = get_file_tools()
 
     tool_search =Tool(
         name="search",
-        func=serper.run,
+        func=search,
+        coroutine=cached_tool_coroutine("search", search, tool_cache) if tool_cache else None,
         description="Use this tool when you want to get the results of an online web search"
     )
 
-    wikipedia = WikipediaAPIWrapper()
-    wiki_tool = WikipediaQueryRun(api_wrapper=wikipedia)
+    wiki_tool = Tool(
+        name="wikipedia",
+        func=wikipedia,
+        coroutine=cached_tool_coroutine("wikipedia", wikipedia, tool_cache) if tool_cache else None,
+        description="A wrapper around Wikipedia. Useful for when you need to answer general questions about people, "
+                    "places, companies, facts, historical events, or other subjects. Input should be a search query."
+    )
     
     pdf_tool = Tool(
         name="generate_pdf_from_markdown",
@@ -90,5 +297,5 @@ async def other_tools():
                    "Example: generate_pdf_from_markdown('# Title\\n\\nContent here', 'document.pdf')"
     )
     
-    return file_tools + [push_tool, tool_search, wiki_tool, pdf_tool]
+    return file_tools + [push_tool, tool_search, wiki_tool, pdf_tool, read_subtask_result]
 